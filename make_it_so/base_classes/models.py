@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Case, F, Value, When
 from django.utils import timezone
 
 
@@ -31,3 +32,95 @@ class BaseModel(models.Model):
         if modified:
             self.save()
         return modified
+
+
+class BaseCountModel(models.Model):
+    """
+        Denormalized row counts grouped by COUNTED_FIELD plus the subclass's
+        key fields. Maintained incrementally with F() updates, a periodic
+        rebuild corrects any drift.
+    """
+    KEY_FIELDS = None
+    COUNTED_FIELD = None
+
+    count = models.IntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def move(cls, old_value, new_value, **key):
+        """ moves one row from old_value's count to new_value's, either may be None """
+        deltas = {}
+        if old_value is not None:
+            deltas[old_value] = -1
+        if new_value is not None:
+            deltas[new_value] = deltas.get(new_value, 0) + 1
+        cls.shift(deltas, **key)
+
+    @classmethod
+    def shift(cls, deltas, **key):
+        """ applies {value: delta} in one update, e.g. after a bulk insert """
+        deltas = {val: delta for (val, delta) in deltas.items() if delta}
+        if not deltas:
+            return
+
+        num_updated = cls._apply_deltas(key, deltas)
+        if num_updated == len(deltas):
+            return
+
+        # rare: first row for a value, create it at zero (unless another
+        # worker just did) then apply its delta
+        field = cls.COUNTED_FIELD
+        existing = set(
+            cls.objects.filter(**key, **{f'{field}__in': list(deltas)})
+            .values_list(field, flat=True)
+        )
+        missing = {
+            val: delta for (val, delta) in deltas.items() if val not in existing
+        }
+        cls.objects.bulk_create(
+            [cls(**key, **{field: val}) for val in missing],
+            ignore_conflicts=True
+        )
+        cls._apply_deltas(key, missing)
+
+    @classmethod
+    def _apply_deltas(cls, key, deltas):
+        field = cls.COUNTED_FIELD
+        return cls.objects.filter(
+            **key, **{f'{field}__in': list(deltas)}
+        ).update(
+            count=F('count') + Case(
+                *[When(**{field: val}, then=Value(delta))
+                  for (val, delta) in deltas.items()],
+                default=Value(0)
+            ),
+            updated=timezone.now()
+        )
+
+    @classmethod
+    def rebuild(cls, actual_counts, **key_filter):
+        """
+            overwrites counts with actual_counts: {(*key_values, value): count}
+            whose keys follow the order of cls.KEY_FIELDS + COUNTED_FIELD
+        """
+        fields = list(cls.KEY_FIELDS) + [cls.COUNTED_FIELD]
+        num_fixed = 0
+
+        for obj in cls.objects.filter(**key_filter):
+            tup = tuple(getattr(obj, fn) for fn in fields)
+            actual = actual_counts.pop(tup, 0)
+            if obj.count != actual:
+                cls.objects.filter(pk=obj.pk).update(
+                    count=actual, updated=timezone.now()
+                )
+                num_fixed += 1
+
+        cls.objects.bulk_create([
+            cls(count=actual, **dict(zip(fields, tup)))
+            for (tup, actual) in actual_counts.items()
+        ], ignore_conflicts=True)
+
+        return num_fixed + len(actual_counts)
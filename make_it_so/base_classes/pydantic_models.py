@@ -1,3 +1,5 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
 from typing import Optional
 from ipaddress import IPv4Address
 
@@ -14,6 +16,29 @@ from resources.models import ResourceModel
 logger = structlog.get_logger(__name__)
 
 
+# ResourceModels already loaded by the caller, keyed by id. ResourceForeignKey
+# validation and create_attr_dict() look here before querying the DB.
+_prefetched_resources = ContextVar('prefetched_resources', default=None)
+
+
+@contextmanager
+def prefetched_resources(resources):
+    known = {**(_prefetched_resources.get() or {})}
+    known.update({obj.id: obj for obj in resources})
+    token = _prefetched_resources.set(known)
+    try:
+        yield known
+    finally:
+        _prefetched_resources.reset(token)
+
+
+def get_prefetched_resource(resource_id):
+    known = _prefetched_resources.get()
+    if not known:
+        return None
+    return known.get(resource_id)
+
+
 class PydanticBaseModel(pydantic.BaseModel):
 
     @classmethod
@@ -53,10 +78,18 @@ class PydanticBaseModel(pydantic.BaseModel):
         if not resource_ids:
             return AttrDict(extra_data or {})
 
-        resources_by_id = {
-            obj.id: obj for obj in
-            ResourceModel.objects.filter(id__in=resource_ids)
-        }
+        resources_by_id = {}
+        for resource_id in resource_ids:
+            obj = get_prefetched_resource(resource_id)
+            if obj is not None:
+                resources_by_id[resource_id] = obj
+
+        missing_ids = [i for i in resource_ids if i not in resources_by_id]
+        if missing_ids:
+            resources_by_id.update({
+                obj.id: obj for obj in
+                ResourceModel.objects.filter(id__in=missing_ids)
+            })
         for key in fk_fields:
             val = extra_data.get(key)
             if val is None:
@@ -92,7 +125,9 @@ class _ResourceForeignKey(str):
         if not isinstance(v, str):
             raise TypeError('string required')
 
-        resource = ResourceModel.objects.filter(id=v).first()
+        resource = get_prefetched_resource(v)
+        if resource is None:
+            resource = ResourceModel.objects.filter(id=v).first()
         if resource is None:
             raise ValueError(f'Resource with id="{v}" not found')
         if resource.rtype != cls.RTYPE:
@@ -1,8 +1,10 @@
+import functools
+import json
 import re
 import sys
 from typing import Dict, Union, List
 
-from googleapiclient import discovery
+from googleapiclient import discovery, discovery_cache
 from googleapiclient.errors import HttpError
 import google.cloud.compute_v1 as compute_v1
 from google.cloud.compute_v1 import Operation
@@ -45,13 +47,18 @@ class GcpApiListResponse(ResourceApiListResponse, dict):
         return self.get('selfLink') or self.get('self_link')
 
 
+@functools.lru_cache(maxsize=None)
+def get_compute_discovery_doc():
+    # note: build() reads and parses this ~3.5MB document on every call
+    return json.loads(discovery_cache.get_static_doc('compute', 'v1'))
+
+
 class GcpApiClient:
 
     def __init__(self, credentials):
         self.credentials = coerce_gcp_credentials(credentials)
-        self.compute_service = discovery.build(
-            'compute', 'v1', credentials=self.credentials,
-            cache_discovery=False
+        self.compute_service = discovery.build_from_document(
+            get_compute_discovery_doc(), credentials=self.credentials
         )
 
     def create_vpc_network(
@@ -3,7 +3,7 @@ from typing import Optional
 import structlog
 
 from base_classes.pydantic_models import PydanticBaseModel
-from gcp_resources.api_client import GcpApiClient
+from gcp_resources.api_client import GcpApiClient, get_compute_discovery_doc
 from resources.base_resource import ResourceBase, ProviderBase, ResourceIdentifier
 
 
@@ -21,6 +21,10 @@ class GcpProvider(ProviderBase):
     def create_cli(cls, rtype, project):
         return GcpApiClient(project.credentials)
 
+    @classmethod
+    def warm_up(cls):
+        get_compute_discovery_doc()
+
 
 class GcpResourceIdentifier(ResourceIdentifier):
 
@@ -65,13 +69,15 @@ class GcpResource(ResourceBase):
             obj.extra_data['self_link'] = self_link
             updated = True
 
-        if updated:
-            obj.save()
+        if (obj.creation_response, obj.list_response) != (
+            creation_response, list_response
+        ):
+            obj.creation_response = creation_response
+            obj.list_response = list_response
+            updated = True
 
-        obj.update_fields(
-            creation_response=creation_response,
-            list_response=list_response
-        )
+        if updated:  # one save for the ids and the response
+            obj.save()
 
     def health_check__ensure_self_id_and_link_set(self):
         if self.model_obj.extra.self_id is None:
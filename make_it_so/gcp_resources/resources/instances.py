@@ -8,7 +8,6 @@ from gcp_resources.api_client import GcpApiClient
 from gcp_resources.resources.base_resource import GcpResource, GcpExtraResourceFieldsBase, GcpResourceIdentifier
 from gcp_resources.types import ZONES, MACHINE_TYPES
 from resources.utils import ResourceApiListResponse
-from users.models import ProjectModel
 
 
 logger = structlog.get_logger(__name__)
@@ -75,7 +74,7 @@ class GcpInstanceResource(GcpResource):
     @classmethod
     def clean(cls, model_obj):
         # note: gcp_project_id here is the pk, the naming is confusing
-        project = ProjectModel.objects.get(id=model_obj.project_id)
+        project = model_obj.project  # set by ingestion, otherwise fetched
         network = model_obj.extra.network  #ResourceModel.objects.get(id=extra_data['network_id'])
         try:
             GcpApiClient._create_instance_insertion_request(
@@ -5,13 +5,17 @@ import structlog
 from base_classes.enum_types import BaseStrEnum
 from gcp_resources.resources.base_resource import GcpResource, GcpExtraResourceFieldsBase, GcpResourceIdentifier
 from gcp_resources.resources.subnets import GcpSubnetResource
-from resources.models import ResourceModel
+from resources.base_resource import health_check_success_ttl
+from resources.models import ChildResourceModel, ResourceModel
 from resources.utils import ResourceApiListResponse
 
 
 logger = structlog.get_logger(__name__)
 
 
+SUBNET_RTYPE = 'gcp_resources.GcpSubnetResource'
+
+
 class RoutingModeEnum(BaseStrEnum):
     REGIONAL = 'REGIONAL'
     GLOBAL = 'GLOBAL'
@@ -65,14 +69,16 @@ class GcpVpcNetworkResource(GcpResource):
         response = self.cli.delete_network(project_id, network_obj.slug)
         return True, response
 
+    @health_check_success_ttl(None)  # can't regress
     def health_check__ensure_age_over_90s(self):
         age = self.model_obj.resource_age
         if age is None:  # can be None when resource is 'found'
             return True, None  # skip check by returning True
         if age <= 90:
-            return False, False
+            return False, False, 91 - age  # passes once it's over 90s
         return True, None
 
+    @health_check_success_ttl(None)
     def health_check__ensure_subnetworks_created(self):
         network_obj = self.model_obj
         if network_obj.extra.auto_create_subnetworks is False:
@@ -91,26 +97,25 @@ class GcpVpcNetworkResource(GcpResource):
         response = self.fetch()
 
         if response and response.get('subnetworks'):
-            for link in response['subnetworks']:
-                subnet_obj, created = self._create_subnet_model(network_obj, link)
-                subnet_obj.log_event(
-                    'resource_found_and_healthy', t=self.transition
-                )
+            # auto-created subnets are only tracked as children, unless
+            # they were declared in HCL
+            promoted = ChildResourceModel.sync(
+                network_obj, SUBNET_RTYPE,
+                self._get_subnet_extra_data(network_obj, response['subnetworks'])
+            )
+            ResourceModel.bulk_log_event(
+                promoted, 'resource_found_and_healthy',
+                transition=self.transition
+            )
         else:
             logger.warning('no subnetwork links found', response=response)
 
     @staticmethod
-    def _create_subnet_model(network_obj, subnet_link):
-        region = GcpSubnetResource.get_region_from_self_link(subnet_link)
-        slug = f'{network_obj.slug}-subnet_{region}'
-        subnet_obj, created = ResourceModel.objects.get_or_create(
-            slug=slug, project=network_obj.project,
-            rtype='gcp_resources.GcpSubnetResource',
-            defaults={
-                'extra_data': {
-                    'network': network_obj, 'self_link': subnet_link,
-                    'region': region
-                }
+    def _get_subnet_extra_data(network_obj, subnet_links):
+        extra_data_by_slug = {}
+        for link in subnet_links:
+            region = GcpSubnetResource.get_region_from_self_link(link)
+            extra_data_by_slug[f'{network_obj.slug}-subnet_{region}'] = {
+                'network': network_obj, 'self_link': link, 'region': region
             }
-        )
-        return subnet_obj, created
+        return extra_data_by_slug
@@ -1,5 +1,6 @@
 import datetime
 import os
+import time
 
 from celery.contrib import rdb
 from celery import Celery, bootsteps
@@ -10,6 +11,9 @@ from opentelemetry.exporter.jaeger.thrift import JaegerExporter
 from opentelemetry.sdk.resources import SERVICE_NAME, Resource
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+import structlog
+
+from make_it_so.serialization import MSGPACK_COMPRESSED, register_serializers
 
 
 # based on: https://testdriven.io/courses/django-celery/getting-started/
@@ -22,6 +26,8 @@ from opentelemetry.sdk.trace.export import SimpleSpanProcessor
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'make_it_so.settings')
 
 
+logger = structlog.get_logger(__name__)
+
 CELERY_POOL_TYPE = os.environ['CELERY_POOL_TYPE']
 assert CELERY_POOL_TYPE in ('prefork', 'gevent')
 # others: 'eventlet', 'solo', 'processes' ('processes' is just an alias of prefork)
@@ -39,8 +45,14 @@ class CustomCelery(Celery):
 worker_signal = worker_process_init if CELERY_POOL_TYPE == 'prefork' else worker_init
 
 
+# when disabled tasks create no spans and carry no trace context
+TRACING_ENABLED = os.environ.get('TRANSITION_TRACING', 'true').lower() == 'true'
+
+
 @worker_signal.connect(weak=False)
 def init_celery_tracing(*args, **kwargs):
+    if not TRACING_ENABLED:
+        return
     CeleryInstrumentor().instrument()
     return
 
@@ -64,6 +76,27 @@ app = Celery('proj')
 STORE_RESULTS = True
 IS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER', 'false').lower() == 'true'
 
+# 'task_result': task attempts are tracked with django_celery_results.TaskResult
+# 'slim': attempts are recorded on TransitionModel, no result backend needed
+TRACKING_MODE = os.environ.get('TRANSITION_TRACKING_MODE', 'task_result').lower()
+assert TRACKING_MODE in ('task_result', 'slim')
+SLIM_TRACKING = TRACKING_MODE == 'slim'
+
+# retries with a countdown of at least this many seconds are parked in Redis
+# rather than held by workers as ETA messages, 0 disables parking
+PARKING_THRESHOLD = int(os.environ.get('TRANSITION_PARKING_THRESHOLD', '0'))
+
+# serializer for transition task messages: 'json', 'msgpack' or
+# 'msgpack_compressed', workers accept all three so it can be switched
+# while messages serialized with the previous one are still queued
+TASK_SERIALIZER = os.environ.get('TRANSITION_TASK_SERIALIZER', 'json')
+assert TASK_SERIALIZER in ('json', 'msgpack', MSGPACK_COMPRESSED)
+register_serializers()
+
+# when a transition succeeds, run the next one in the resource's chain in
+# the same worker (reusing its context) instead of waiting for the submitter
+FAST_PATH = os.environ.get('TRANSITION_FAST_PATH', 'false').lower() == 'true'
+
 
 class Config:
 
@@ -83,6 +116,9 @@ class Config:
     task_acks_on_failure_or_timeout = True
     task_reject_on_worker_lost = True
 
+    # serialization, transition tasks set their own (see TASK_SERIALIZER)
+    accept_content = ['json', 'msgpack', MSGPACK_COMPRESSED]
+
     # broker configs
     broker_url = 'redis://localhost:6379/0'
     redis_retry_on_timeout = True
@@ -129,6 +165,26 @@ class Config:
         'submit-transition-tasks': {
             'task': 'transitions.tasks.daemon_tasks.submit_transition_tasks',
             'schedule': 12
+        },
+        'reconcile-failed-transitions': {
+            'task': 'transitions.tasks.daemon_tasks.reconcile_failed_transitions',
+            'schedule': 60
+        },
+        'resend-stalled-transitions': {
+            'task': 'transitions.tasks.daemon_tasks.resend_stalled_transitions',
+            'schedule': 60
+        },
+        'pump-parked-transitions': {
+            'task': 'transitions.tasks.daemon_tasks.pump_parked_transitions',
+            'schedule': 5
+        },
+        'reconcile-state-counts': {
+            'task': 'transitions.tasks.daemon_tasks.reconcile_state_counts',
+            'schedule': 300
+        },
+        'update-resource-timings': {
+            'task': 'transitions.tasks.daemon_tasks.update_resource_timings',
+            'schedule': 600
         }
     }
 
@@ -143,6 +199,13 @@ app.autodiscover_tasks([
     'resources.tasks.hcl_express_desired_state',
     'transitions.tasks.daemon_tasks.create_missing_transitions',
     'transitions.tasks.daemon_tasks.submit_transition_tasks',
+    'transitions.tasks.daemon_tasks.reconcile_failed_transitions',
+    'transitions.tasks.daemon_tasks.resend_stalled_transitions',
+    'transitions.tasks.daemon_tasks.reconcile_state_counts',
+    'transitions.tasks.daemon_tasks.pump_parked_transitions',
+    'transitions.tasks.daemon_tasks.update_resource_timings',
+    'transitions.tasks.batch_tasks.ensure_exists_batch',
+    'transitions.tasks.batch_tasks.ensure_deleted_batch',
     'transitions.tasks.ensure_dependencies_ready',
     'transitions.tasks.ensure_exists',
     'transitions.tasks.ensure_healthy',
@@ -158,6 +221,15 @@ if not STORE_RESULTS:
         task_store_errors_even_if_ignored=True
     )
 
+if SLIM_TRACKING:
+    # Transitions track their own attempts, so every result write, and
+    # the args/kwargs stored with it, would be wasted DB round trips
+    app.conf.update(
+        result_backend=None,  # i.e. celery's DisabledBackend
+        result_extended=False,
+        task_ignore_result=True
+    )
+
 if IS_EAGER:
     app.conf.update(
         task_always_eager=True,
@@ -178,7 +250,31 @@ class StorePoolTypeOnCeleryApp(bootsteps.Step):
         # from transitions.tasks.test_task import test_task
 
 
+class WarmUpWorker(bootsteps.Step):
+    """
+        Warms the resource class registry, pydantic schemas and provider
+        libraries before the pool starts. Steps are constructed in the parent
+        process, so prefork children inherit these copy-on-write.
+    """
+    def __init__(self, parent, **options):
+        super().__init__(parent, **options)
+        from resources import warm_up_resource_classes
+
+        start = time.perf_counter()
+        try:
+            durations = warm_up_resource_classes()
+        except Exception as e:
+            # only an optimisation, the tasks load everything themselves
+            logger.warning('worker warm-up failed', exception=str(e))
+            return
+        logger.info(
+            'worker warm-up finished', duration=time.perf_counter() - start,
+            **{k: round(v, 3) for (k, v) in durations.items()}
+        )
+
+
 app.steps['worker'].add(StorePoolTypeOnCeleryApp)
+app.steps['worker'].add(WarmUpWorker)
 
 
 
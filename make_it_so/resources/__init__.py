@@ -23,6 +23,38 @@ def get_resource_classes():
     return resource_classes
 
 
+def warm_up_resource_classes():
+    """
+        loads the resource classes (and the provider libraries they import),
+        their extra fields schemas and provider caches. Returns the duration
+        of each step
+    """
+    from resources.models import ResourceModel
+    from resources.utils import CatchTime
+
+    durations = {}
+    with CatchTime() as t:
+        resource_classes = list(ResourceModel.get_resource_classes().values())
+    durations['resource_classes'] = t.duration
+
+    with CatchTime() as t:
+        for cls in resource_classes:
+            ExtraModelClass = cls.EXTRA_FIELDS_MODEL_CLASS
+            if ExtraModelClass is not None:
+                # pydantic caches the schema for each value of by_alias
+                ExtraModelClass.get_resource_fk_field_names(alias=False)
+                ExtraModelClass.get_resource_fk_field_names(alias=True)
+    durations['schemas'] = t.duration
+
+    with CatchTime() as t:
+        for provider_class in {cls.PROVIDER for cls in resource_classes}:
+            if provider_class is not None:
+                provider_class.warm_up()
+    durations['providers'] = t.duration
+
+    return durations
+
+
 EVENT_SIDE_EFFECTS = {
     ('ensure_exists', 'resource_found', 'found_before_creation'): 'exists',
     ('ensure_exists', 'resource_found', 'found_after_creation'): 'exists',
@@ -52,6 +84,8 @@ EVENT_SIDE_EFFECTS = {
 
 def log_activity_on_resource(resource_model, event_type):
     r = resource_model
+    if event_type == 'creation_request_succeeded':
+        r.resource_created_at = timezone.now()
     if event_type == 'resource_found':
         r.existence = ExistenceEnum.exists
         r.existence_last_checked_at = timezone.now()
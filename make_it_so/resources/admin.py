@@ -1,10 +1,13 @@
 from django.contrib import admin
 
 from resources.models import (
-    ResourceEventModel, ResourceModel, ResourceDependencyModel
+    ChildResourceModel, ResourceEventModel, ResourceModel, ResourceDependencyModel,
+    ResourceStateCountModel
 )
 
 
 admin.site.register(ResourceModel)
 admin.site.register(ResourceEventModel)
 admin.site.register(ResourceDependencyModel)
+admin.site.register(ResourceStateCountModel)
+admin.site.register(ChildResourceModel)
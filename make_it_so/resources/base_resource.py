@@ -1,9 +1,17 @@
+import datetime
+import functools
+import math
 from typing import Dict, List
 
 import gevent
+from gevent import monkey
+from gevent.lock import BoundedSemaphore
+from gevent.pool import Pool
+from django.db import connections
+from django.utils import timezone
 import structlog
 
-from resources.models import ResourceModel
+from resources.models import ResourceModel, ResourceTimingModel, get_resource_zone
 from resources.utils import CatchTime
 from transitions.celery_utils import get_exponential_backoff_interval
 
@@ -58,15 +66,87 @@ RETRY_PARAMS = {
 }
 
 
+ATTEMPT_TIME_LIMIT = 660  # default per-attempt limit, see DEFAULT_TASK_KWARGS
+
+# adaptive countdowns are bounded by these, the upper one relative to the static countdown
+ADAPTIVE_MIN_COUNTDOWN = 3
+ADAPTIVE_MAX_FACTOR = 4
+
+
 class ProviderBase:
 
+    BATCH_CONCURRENCY = 8
+
     def __init__(self):
         pass
 
+    @classmethod
+    def run_batch(cls, calls, on_result=None):
+        """
+            runs the per-resource calls of a bulk operation, returns their
+            results in order, a call that raised gives (False, {'exception': ...}).
+            on_result(i, result) is called as each one completes, so what
+            completed is kept if the batch is interrupted. Override where the
+            provider has a batch API
+        """
+        results = [(False, {'exception': 'interrupted'})] * len(calls)
+
+        def run_call(i, call):
+            try:
+                results[i] = call()
+            except Exception as e:
+                results[i] = (False, {'exception': repr(e)})
+            if on_result is not None:
+                on_result(i, results[i])
+
+        pool = Pool(cls.BATCH_CONCURRENCY)
+        try:
+            greenlets = [
+                pool.spawn(_run_in_greenlet, functools.partial(run_call, i, call))
+                for i, call in enumerate(calls)
+            ]
+            gevent.joinall(greenlets)
+        finally:
+            pool.kill()
+        return results
+
     @classmethod
     def create_cli(cls, rtype, project):
         raise NotImplementedError
 
+    @classmethod
+    def warm_up(cls):
+        """ preloads whatever create_cli() would otherwise load on first use """
+        pass
+
+
+def health_check_success_ttl(seconds):
+    """
+        how long a pass is trusted by later retries of the same Transition,
+        None for the Transition's lifetime and 0 to always re-run the check.
+        Only for checks that can't regress, undecorated checks always re-run
+    """
+    def decorator(func):
+        func.success_ttl = seconds
+        return func
+    return decorator
+
+
+def get_retry_after_seconds(retry_after):
+    """ retry_after is in seconds or a 'not before' datetime """
+    if isinstance(retry_after, datetime.datetime):
+        return math.ceil((retry_after - timezone.now()).total_seconds())
+    return math.ceil(retry_after)
+
+
+def _run_in_greenlet(func):
+    try:
+        return func()
+    finally:
+        if monkey.is_module_patched('threading'):
+            # each greenlet has its own (thread-local) DB connections
+            connections.close_all()
+
 
 class ResourceIdentifier:
 
@@ -116,22 +196,26 @@ class ResourceBase:
 
     FETCH_DELAY = 3
 
+    HEALTH_CHECK_CONCURRENCY = 4
+
     # AUTORETRY_FOR removed: setting this per resource is not trivial
     RETRY_PARAMS = RETRY_PARAMS
+    # schedule retries around the completion times learned per rtype/zone
+    ADAPTIVE_RETRIES = True
 
-    def __init__(self, model_obj, transition, cli=None):
+    def __init__(self, model_obj, transition, cli=None, existing=None):
         self.cluster = None  # disabled for now
         self.project = model_obj.project
 
         # note: this is None when ingesting HCL
         self.transition = self.t = transition
 
-        self.cli = cli
-        if self.cli is None:
-            with CatchTime() as t:
-                self.cli = self.create_cli(model_obj.rtype, self.project)
-            if t.duration > 0.4:
-                logger.info('create_cli() took a while', duration=t.duration)
+        self._cli = cli  # created on first use, many tasks never need it
+
+        # list responses by id, shared by the checks of one task execution
+        # and handed to the next one on the fast path
+        self._existing = existing
+        self._existing_lock = BoundedSemaphore()
 
         self.model_obj = model_obj
         model_obj.extra_fields_model_class = self.EXTRA_FIELDS_MODEL_CLASS
@@ -140,6 +224,19 @@ class ResourceBase:
         if self.cluster:
             self.labels = {'cluster_uid': self.cluster.uid}
 
+    @property
+    def cli(self):
+        if self._cli is None:
+            with CatchTime() as t:
+                self._cli = self.create_cli(self.model_obj.rtype, self.project)
+            if t.duration > 0.4:
+                logger.info('create_cli() took a while', duration=t.duration)
+        return self._cli
+
+    @property
+    def has_cli(self):
+        return self._cli is not None
+
     @classmethod
     def get_initial_transition_type(cls):
         if cls.HAS_DEPENDENCIES:
@@ -148,15 +245,26 @@ class ResourceBase:
 
     @classmethod
     def get_resource(cls, cli, project, id):
-        existing = {
+        return cls.get_existing(cli, project).get(id)
+
+    @classmethod
+    def get_existing(cls, cli, project):
+        """ the provider's resources of this type by id, one list request """
+        return {
             cls.IDENTIFIER.get_id_from_list_response(resp): resp
             for resp in cls.list_resources(cli, project)
         }
-        return existing.get(id)
 
     def fetch(self):
         id = self.IDENTIFIER.fetch_id(self.model_obj)
-        return self.get_resource(self.cli, self.project, id)
+        return self._get_existing().get(id)
+
+    def _get_existing(self, refresh=False):
+        """ lists the provider's resources at most once unless refresh=True """
+        with self._existing_lock:  # concurrent health checks share one request
+            if self._existing is None or refresh:
+                self._existing = self.get_existing(self.cli, self.project)
+            return self._existing
 
     @classmethod
     def list_resources(cls, cli, project) -> List:
@@ -168,6 +276,32 @@ class ResourceBase:
     def delete_resource(self):
         raise NotImplementedError
 
+    # bulk variants, used by the batch tasks for many resources of this
+    # type in one project. Override where the provider has a bulk API
+
+    @classmethod
+    def check_exists_many(cls, cli, project, resource_ws):
+        """ {model pk: list response or None}, one list request """
+        existing = cls.get_existing(cli, project)
+        return {
+            w.model_obj.pk: existing.get(cls.IDENTIFIER.fetch_id(w.model_obj))
+            for w in resource_ws
+        }
+
+    @classmethod
+    def create_resources(cls, cli, resource_ws, on_result=None):
+        """ [(success, response)] in the order of resource_ws, see run_batch() """
+        return cls.PROVIDER.run_batch(
+            [w.create_resource for w in resource_ws], on_result=on_result
+        )
+
+    @classmethod
+    def delete_resources(cls, cli, resource_ws, on_result=None):
+        """ [(success, response)] in the order of resource_ws, see run_batch() """
+        return cls.PROVIDER.run_batch(
+            [w.delete_resource for w in resource_ws], on_result=on_result
+        )
+
     @classmethod
     def create_cli(cls, rtype, project):
         return cls.PROVIDER.create_cli(rtype, project)
@@ -190,10 +324,8 @@ class ResourceBase:
     def _do_existence_check(self, i, cached_existing):
         existing = cached_existing if i == 0 else None
         if existing is None:
-            existing = {
-                self.IDENTIFIER.get_id_from_list_response(resp): resp
-                for resp in self.list_resources(self.cli, self.project)
-            }
+            # polling for changes, so always re-list
+            existing = self._get_existing(refresh=True)
         id = self.IDENTIFIER.fetch_id(self.model_obj)
         exists = id in existing
         return exists, existing.get(id)
@@ -241,6 +373,29 @@ class ResourceBase:
             if a.startswith('health_check__')
         ]
 
+    def run_health_checks(self, skip=()):
+        """
+            returns [(name, (succ, is_final, retry_after))] in the order of
+            health_checks. A check may return (succ, is_final, retry_after)
+            when it knows when it can pass, retry_after is None otherwise
+        """
+        health_checks = [
+            hc for hc in self.health_checks if hc.__name__ not in skip
+        ]
+        pool = Pool(self.HEALTH_CHECK_CONCURRENCY)
+        try:
+            greenlets = [pool.spawn(_run_in_greenlet, hc) for hc in health_checks]
+            gevent.joinall(greenlets, raise_error=True)
+        finally:
+            pool.kill()
+
+        results = []
+        for hc, greenlet in zip(health_checks, greenlets):
+            succ, is_final, *hint = greenlet.value
+            retry_after = get_retry_after_seconds(hint[0]) if hint else None
+            results.append((hc.__name__, (succ, is_final, retry_after)))
+        return results
+
     def do_update(self):
         if self.t.update_type:
             method = getattr(self, f'do_update__{self.t.update_type}')
@@ -299,15 +454,85 @@ class ResourceBase:
             if task_age > params['total_timeout']:
                 return None, 'total_timeout_exceeded'
 
+        countdown = self._get_countdown(params, retry_index)
+        if self.ADAPTIVE_RETRIES:
+            countdown = self._get_adaptive_countdown(
+                countdown, transition_type, task_age
+            )
+        return countdown, None
+
+    def _get_adaptive_countdown(self, countdown, transition_type, task_age):
+        """
+            aims the next check at the expected completion time (p50, then
+            p90) learned for this rtype and zone, see ResourceTimingModel
+        """
+        if task_age is None:
+            return countdown
+        timing = ResourceTimingModel.get_expected(
+            self.model_obj.rtype, get_resource_zone(self.model_obj.extra_data),
+            transition_type
+        )
+        if timing is None:
+            return countdown
+
+        if task_age < timing.p50_seconds:
+            expected_in = timing.p50_seconds - task_age
+        elif task_age < timing.p90_seconds:
+            expected_in = timing.p90_seconds - task_age
+        else:
+            return countdown  # slower than usual, poll at the static rate
+
+        return min(
+            max(math.ceil(expected_in), ADAPTIVE_MIN_COUNTDOWN),
+            countdown * ADAPTIVE_MAX_FACTOR
+        )
+
+    def bound_retry_after(self, retry_after, transition_type):
+        """
+            the countdown for a retry-after hint, kept within the longest
+            countdown the retry params would schedule (see get_transition_lifetime)
+        """
+        params = self.get_retry_params(transition_type)
+        max_countdown = max(
+            self._get_countdown(params, retry_index)
+            for retry_index in range(params['max_retries'])
+        )
+        if self.ADAPTIVE_RETRIES:
+            max_countdown *= ADAPTIVE_MAX_FACTOR
+
+        seconds = get_retry_after_seconds(retry_after)
+        return min(max(seconds, 1), max_countdown)
+
+    @staticmethod
+    def _get_countdown(params, retry_index):
         if 'retry_backoff' in params:
-            countdown = get_exponential_backoff_interval(
+            return get_exponential_backoff_interval(
                 params['retry_backoff'],
                 retry_index,
                 0.5,  # min
                 params.get('retry_backoff_max', 300),
                 params.get('retry_jitter', False)
             )
-        else:
-            countdown = params['default_retry_delay']
+        return params['default_retry_delay']
 
-        return countdown, None
+    @classmethod
+    def get_attempt_time_limit(cls, transition_type):
+        params = cls.get_retry_params(transition_type)
+        return params.get(
+            'time_limit', params.get('soft_time_limit', ATTEMPT_TIME_LIMIT)
+        )
+
+    @classmethod
+    def get_transition_lifetime(cls, transition_type):
+        """ upper bound in seconds on how long a Transition's task may keep retrying """
+        params = cls.get_retry_params(transition_type)
+        attempt_limit = cls.get_attempt_time_limit(transition_type)
+        if 'total_timeout' in params:
+            # checked before each retry, so the last attempt may overrun it
+            return params['total_timeout'] + attempt_limit
+
+        max_factor = ADAPTIVE_MAX_FACTOR if cls.ADAPTIVE_RETRIES else 1
+        return sum(
+            attempt_limit + cls._get_countdown(params, retry_index) * max_factor
+            for retry_index in range(params['max_retries'])
+        )
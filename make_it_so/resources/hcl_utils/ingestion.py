@@ -1,18 +1,25 @@
 
 from builtins import breakpoint
-from collections import defaultdict
+from collections import Counter, defaultdict
+import graphlib
 
 from django.core.exceptions import ValidationError as DjangoValidationError
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from celery.contrib import rdb
 
 from pydantic import ValidationError as PydanticValidationError
 import structlog
 
-from base_classes.pydantic_models import stringify_pydantic_validation_error
+from base_classes.pydantic_models import (
+    prefetched_resources, stringify_pydantic_validation_error
+)
 from resources import get_resource_classes
 from resources.hcl_utils.parsing import parse_hcl_file
-from resources.models import ResourceModel, ResourceDependencyModel
+from resources.models import (
+    ChildResourceModel, ResourceModel, ResourceDependencyModel,
+    ResourceStateCountModel
+)
 from transitions.celery_utils.exceptions import TaskFailureException
 from users.models import ProjectModel
 
@@ -37,9 +44,14 @@ def get_resource_from_hcl(ResourceClass, hcl_entry, project):
     return group, model_obj
 
 
-def create_resource_from_hcl(
-    hcl_entry, resource_classes, other_resources=None
+def build_resource_from_hcl(
+    hcl_entry, resource_classes, other_resources=None, project=None
 ):
+    """
+        validates the entry and returns its unsaved ResourceModel. Foreign
+        keys are only queried if they weren't prefetched, see
+        create_hcl_resource_models()
+    """
     if other_resources:
         hcl_entry.evaluate_expressions(other_resources)
 
@@ -74,8 +86,15 @@ def create_resource_from_hcl(
         )
 
     model_obj._extra_attrdict = extra_attr_dict  # so .extra prop works
+
+    clean_exclude = []
+    if project is not None and str(project.pk) == str(model_obj.project_id):
+        model_obj.project = project  # already known to exist
+        clean_exclude.append('project')
     try:
-        model_obj.full_clean()  # triggers validators on model fields
+        # triggers validators on model fields, uniqueness is left to the
+        # db constraints (the pk is fresh and Django 4.0 skips the others)
+        model_obj.full_clean(exclude=clean_exclude, validate_unique=False)
         ResourceClass.clean(model_obj)
     except (DjangoValidationError, ValueError) as e:
         raise TaskFailureException(
@@ -104,21 +123,49 @@ def create_resource_from_hcl(
             for pk in m2m_pks:
                 getattr(model_obj, field_name).add(pk)'''
 
-    model_obj.save()
-    created = True
+    return model_obj
 
-    for field_name in ExtraModelClass.get_resource_fk_field_names():
-        if model_obj.extra_data.get(field_name):
-            dep_id = model_obj.extra_data[field_name]
-            ResourceDependencyModel.objects.get_or_create(
-                resource_id=model_obj.id, depends_on_id=dep_id,
-                field_name=field_name
-            )
 
-    if other_resources:
-        other_resources[hcl_entry.fullname] = ResourceClass(model_obj, None)
+def save_resources_from_hcl(model_objs):
+    """ saves validated ResourceModels of one project and their dependency rows """
+    if not model_objs:
+        return
+
+    dependencies = []
+    for model_obj in model_objs:
+        ExtraModelClass = model_obj.resource_class.EXTRA_FIELDS_MODEL_CLASS
+        for field_name in ExtraModelClass.get_resource_fk_field_names():
+            if model_obj.extra_data.get(field_name):
+                dependencies.append(ResourceDependencyModel(
+                    resource_id=model_obj.id,
+                    depends_on_id=model_obj.extra_data[field_name],
+                    field_name=field_name
+                ))
+
+    promoted_children = ChildResourceModel.promote(model_objs)
+    states = Counter(
+        (obj.project_id, obj.rtype, obj.state) for obj in model_objs
+    )
+    with transaction.atomic():
+        ResourceModel.objects.bulk_create(model_objs)
+        ResourceDependencyModel.objects.bulk_create(
+            dependencies, ignore_conflicts=True
+        )
+        # bulk_create() bypasses save(), count the new rows in one go
+        deltas_by_key = defaultdict(dict)
+        for (project_id, rtype, state), num in states.items():
+            deltas_by_key[(project_id, rtype)][state] = num
+        for (project_id, rtype), deltas in deltas_by_key.items():
+            ResourceStateCountModel.shift(
+                deltas, project_id=project_id, rtype=rtype
+            )
+        if promoted_children:
+            ChildResourceModel.objects.filter(
+                pk__in=[child.pk for child in promoted_children]
+            ).delete()
 
-    return created, model_obj
+    for model_obj in model_objs:  # as save() would
+        model_obj._persisted_state = model_obj._get_state_values()
 
 
 def _collect_model_fields(hcl_entry, ResourceClass):
@@ -172,6 +219,23 @@ def _collect_model_fields(hcl_entry, ResourceClass):
     return new_values, extra_model_values, new_m2m_values, model_obj
 
 
+def _get_waves(hcl_entries):
+    """ yields lists of entries whose dependencies are all in earlier lists """
+    position = {e.fullname: i for (i, e) in enumerate(hcl_entries)}
+    sorter = graphlib.TopologicalSorter({
+        e.fullname: e.get_dependencies() for e in hcl_entries
+    })
+    sorter.prepare()
+    while sorter.is_active():
+        names = sorter.get_ready()
+        sorter.done(*names)
+        yield [
+            hcl_entries[position[name]]
+            for name in sorted(names, key=lambda n: position.get(n, -1))
+            if name in position
+        ]
+
+
 def _fetch_hcl_resource_models(hcl_entries, project):
 
     existing_objects, existing_by_name = [], {}
@@ -220,14 +284,24 @@ def create_hcl_resource_models(
 
     existing, existing_by_name = _fetch_hcl_resource_models(hcl_entries, project)
 
+    # a wave's entries only reference resources already in existing_by_name,
+    # so they're validated in memory and saved together
     new_objects = []
-    for hcl_entry in hcl_entries:
-        if hcl_entry.fullname not in existing_by_name:
-            _, model_obj = create_resource_from_hcl(
-                hcl_entry, RESOURCE_CLASSES, other_resources=existing_by_name
-            )
+    for wave in _get_waves(hcl_entries):
+        # note: updates are not yet supported, existing entries are skipped
+        wave = [e for e in wave if e.fullname not in existing_by_name]
+        with prefetched_resources(existing_by_name.values()):
+            model_objs = [
+                build_resource_from_hcl(
+                    hcl_entry, RESOURCE_CLASSES,
+                    other_resources=existing_by_name, project=project
+                )
+                for hcl_entry in wave
+            ]
+        save_resources_from_hcl(model_objs)
+
+        for model_obj in model_objs:
             existing_by_name[model_obj.hcl_slug] = model_obj
-            new_objects.append(model_obj)
-        # else:
-            # update_model(obj, hcl_entry)  # updates not yet supported
+        new_objects.extend(model_objs)
+
     return existing, new_objects
@@ -1,12 +1,20 @@
 import os.path
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import graphlib
+import hashlib
+import pickle
 import re
+import threading
 
 from celery.contrib import rdb
 import hcl2
+import structlog
 
 from transitions.celery_utils.exceptions import TaskFailureException
+from transitions.celery_utils.redis_client import get_redis_client, REDIS_ERRORS
+
+
+logger = structlog.get_logger(__name__)
 
 
 MANDATORY_PROVIDER_FIELDS = {
@@ -19,6 +27,15 @@ MANDATORY_PROVIDER_FIELDS = {
 }
 
 
+# parsed files by content hash, pickled
+PARSE_CACHE_SIZE = 32
+PARSE_CACHE_TTL = 60 * 60  # seconds, in Redis
+# bump when HclEntry or the parsing changes, Redis outlives a deploy
+PARSE_CACHE_VERSION = 1
+_parse_cache = OrderedDict()
+_parse_cache_lock = threading.Lock()
+
+
 def _parse_provider(hcl_dict):
 
     if len(hcl_dict.get('provider', [])) != 1:
@@ -152,17 +169,80 @@ class HclEntry:
 
 
 def parse_hcl_file(filepath=None, file_content=None):
-
+    """
+        results are cached by content hash, in-process and in Redis (if
+        available) so the tasks of one apply share them. Each call gets its
+        own copy, since evaluate_expressions() modifies the entries
+    """
     assert filepath or file_content
 
+    if filepath:
+        with open(filepath) as file:
+            file_content = file.read()
+
+    # file() expressions read other files, so the content doesn't identify the result
+    if '${file(' in file_content:
+        return _parse_hcl_content(file_content)
+
+    digest = hashlib.sha256(file_content.encode()).hexdigest()
+    pickled = _get_cached_parse(digest)
+    if pickled is not None:
+        return pickle.loads(pickled)
+
+    result = _parse_hcl_content(file_content)
+    if result[1] is not None:  # parsing failures aren't cached
+        _set_cached_parse(digest, pickle.dumps(result))
+    return result
+
+
+def _get_cached_parse(digest):
+    with _parse_cache_lock:
+        if digest in _parse_cache:
+            _parse_cache.move_to_end(digest)
+            return _parse_cache[digest]
+
+    redis_cli = get_redis_client()
+    if redis_cli is None:
+        return None
+    try:
+        pickled = redis_cli.get(_parse_cache_key(digest))
+    except REDIS_ERRORS as e:
+        logger.warning('parsed hcl cache unavailable', exception=str(e))
+        return None
+    if pickled is not None:
+        _set_local_parse(digest, pickled)
+    return pickled
+
+
+def _set_cached_parse(digest, pickled):
+    _set_local_parse(digest, pickled)
+    redis_cli = get_redis_client()
+    if redis_cli is None:
+        return
+    try:
+        redis_cli.set(_parse_cache_key(digest), pickled, ex=PARSE_CACHE_TTL)
+    except REDIS_ERRORS as e:
+        logger.warning('parsed hcl not cached', exception=str(e))
+
+
+def _set_local_parse(digest, pickled):
+    with _parse_cache_lock:
+        _parse_cache[digest] = pickled
+        _parse_cache.move_to_end(digest)
+        while len(_parse_cache) > PARSE_CACHE_SIZE:
+            _parse_cache.popitem(last=False)
+
+
+def _parse_cache_key(digest):
+    return f'hcl:parsed:v{PARSE_CACHE_VERSION}:{digest}'
+
+
+def _parse_hcl_content(file_content):
+
     none_tuple = (None, None, None, None)
 
     try:
-        if filepath:
-            with open(filepath) as file:
-                hcl_dict = hcl2.load(file)
-        else:
-            hcl_dict = hcl2.loads(file_content)
+        hcl_dict = hcl2.loads(file_content)
     except:
         return none_tuple
 
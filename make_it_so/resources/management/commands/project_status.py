@@ -0,0 +1,49 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+import structlog
+
+from resources.models import ResourceStateCountModel
+from transitions.models import TransitionStatusCountModel
+from users.models import ProjectModel
+
+
+logger = structlog.get_logger(__name__)
+
+
+def _print_counts(title, rows, key_field, counted_field):
+    counts_by_key = defaultdict(dict)
+    for obj in rows:
+        if obj.count:
+            key = getattr(obj, key_field)
+            counts_by_key[key][getattr(obj, counted_field)] = obj.count
+
+    print(f'\n{title}:')
+    if not counts_by_key:
+        print('  (none)')
+    for key in sorted(counts_by_key):
+        counts = counts_by_key[key]
+        counts_str = ', '.join(f'{k}: {v}' for (k, v) in sorted(counts.items()))
+        print(f'  {key.split(".")[-1]} [{sum(counts.values())}] {counts_str}')
+
+
+class Command(BaseCommand):
+    """ reads the summary count tables, so doesn't scan the Resources """
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_slug', type=str)
+
+    def handle(self, *args, **kwargs):
+        project = ProjectModel.objects.filter(slug=kwargs['project_slug']).first()
+        if project is None:
+            exit(f'no Project found with slug: {kwargs["project_slug"]}')
+
+        _print_counts(
+            'Resources', ResourceStateCountModel.objects.filter(project=project),
+            'rtype', 'state'
+        )
+        _print_counts(
+            'Transitions',
+            TransitionStatusCountModel.objects.filter(project=project),
+            'type', 'status'
+        )
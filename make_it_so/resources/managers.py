@@ -12,17 +12,28 @@ class ResourceModelManager(models.Manager):
         rtype = kwargs.get('rtype')
         assert rtype and rtype in resource_classes
 
-        extra_data = kwargs.pop('extra_data')
+        kwargs['extra_data'] = self._sanitize_extra_data(
+            resource_classes[rtype], kwargs.pop('extra_data')
+        )
+
+    @staticmethod
+    def _sanitize_extra_data(ResourceClass, extra_data):
+        from base_classes.pydantic_models import prefetched_resources
+        from resources.models import ResourceModel
+
+        # foreign keys passed as objects don't need to be queried again
+        known_resources = []
         for key, val in extra_data.items():
             if isinstance(val, ResourceModel):
+                known_resources.append(val)
                 extra_data[key] = val.id
 
-        ResourceClass = resource_classes[rtype]
         ExtraModelClass = ResourceClass.EXTRA_FIELDS_MODEL_CLASS
 
         # fails if provider id is missing
-        extra_obj = ExtraModelClass(**extra_data)
-        kwargs['extra_data'] = extra_obj.dict()
+        with prefetched_resources(known_resources):
+            extra_obj = ExtraModelClass(**extra_data)
+        return extra_obj.dict()
 
     def get_or_create(self, *args, **kwargs):
         from resources.models import ResourceModel
@@ -47,5 +58,11 @@ class ResourceModelManager(models.Manager):
         return new_obj, True
 
     def create(self, *args, **kwargs):
+        from resources.models import ResourceStateCountModel
+
         self._sanitize_kwargs(kwargs)
-        return super().create(*args, **kwargs)
+        obj = super().create(*args, **kwargs)
+        ResourceStateCountModel.move(
+            None, obj.state, project_id=obj.project_id, rtype=obj.rtype
+        )
+        return obj
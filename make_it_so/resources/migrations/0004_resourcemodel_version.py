@@ -0,0 +1,18 @@
+# Generated by Django 4.0.3 on 2026-10-19 07:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0003_resourcestatecountmodel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resourcemodel',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.0.3 on 2026-10-19 08:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0004_resourcemodel_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceTimingModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('rtype', models.CharField(max_length=255)),
+                ('zone', models.CharField(blank=True, default='', max_length=64)),
+                ('transition_type', models.CharField(max_length=64)),
+                ('sample_count', models.IntegerField(default=0)),
+                ('p50_seconds', models.FloatField()),
+                ('p90_seconds', models.FloatField()),
+            ],
+            options={
+                'unique_together': {('rtype', 'zone', 'transition_type')},
+            },
+        ),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 4.0.3 on 2026-10-19 08:09
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import F, Q
+from django.utils import timezone
+import django.db.models.deletion
+
+
+# subnets created by GcpVpcNetworkResource.healthy_hook(), i.e. not from HCL
+CHILD_RTYPES = {'gcp_resources.GcpSubnetResource': 'network'}
+
+# resources with these Transitions are left as they are
+ACTIVE_TRANSITION_STATUSES = ('pending', 'sent_to_broker', 'in_progress')
+
+
+def move_hook_created_resources_to_children(apps, schema_editor):
+    ResourceModel = apps.get_model('resources', 'ResourceModel')
+    ChildResourceModel = apps.get_model('resources', 'ChildResourceModel')
+    ResourceStateCountModel = apps.get_model('resources', 'ResourceStateCountModel')
+    TransitionModel = apps.get_model('transitions', 'TransitionModel')
+    TransitionStatusCountModel = apps.get_model(
+        'transitions', 'TransitionStatusCountModel'
+    )
+
+    active = TransitionModel.objects.filter(
+        status__in=ACTIVE_TRANSITION_STATUSES
+    ).values('resource_id')
+
+    for rtype, parent_field in CHILD_RTYPES.items():
+        query = ResourceModel.objects.filter(rtype=rtype).filter(
+            Q(hcl_slug=None) | Q(hcl_slug='')
+        ).exclude(backward_rels__isnull=False).exclude(id__in=active)
+
+        children, moved = [], []
+        for obj in query.iterator():
+            parent_id = (obj.extra_data or {}).get(parent_field)
+            if not ResourceModel.objects.filter(id=parent_id).exists():
+                continue
+            children.append(ChildResourceModel(
+                parent_id=parent_id, rtype=rtype, slug=obj.slug,
+                extra_data=obj.extra_data,
+                last_seen_at=obj.health_last_checked_at or timezone.now()
+            ))
+            moved.append(obj)
+
+        moved_ids = [obj.id for obj in moved]
+        # their finished Transitions are deleted along with them
+        transition_counts = Counter(
+            TransitionModel.objects.filter(resource_id__in=moved_ids)
+            .values_list('resource__project_id', 'type', 'status')
+        )
+
+        ChildResourceModel.objects.bulk_create(children, ignore_conflicts=True)
+        ResourceModel.objects.filter(id__in=moved_ids).delete()
+
+        counts = Counter((obj.project_id, obj.state) for obj in moved)
+        for (project_id, state), num in counts.items():
+            ResourceStateCountModel.objects.filter(
+                project_id=project_id, rtype=rtype, state=state
+            ).update(count=F('count') - num)
+        for (project_id, type, status), num in transition_counts.items():
+            TransitionStatusCountModel.objects.filter(
+                project_id=project_id, type=type, status=status
+            ).update(count=F('count') - num)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0005_resourcetimingmodel'),
+        ('transitions', '0003_transitionstatuscountmodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChildResourceModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('rtype', models.CharField(max_length=255)),
+                ('slug', models.CharField(max_length=47)),
+                ('extra_data', models.JSONField(default=dict)),
+                ('last_seen_at', models.DateTimeField()),
+                ('parent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='children', to='resources.resourcemodel')),
+            ],
+            options={
+                'unique_together': {('parent', 'rtype', 'slug')},
+            },
+        ),
+        migrations.RunPython(
+            move_hook_created_resources_to_children,
+            migrations.RunPython.noop
+        ),
+    ]
@@ -1,11 +1,16 @@
 from collections import defaultdict
+import datetime
+from functools import reduce
+import operator
 import re
+import time
+from types import SimpleNamespace
 from typing import Union
 
 from django.core.exceptions import ValidationError
 from django.db import models, transaction
 from django.db.models import UniqueConstraint
-from django.db.models import Q
+from django.db.models import Count, F, OuterRef, Q, Subquery
 from django.utils import timezone
 from celery.contrib import rdb
 from opentelemetry import trace
@@ -13,7 +18,7 @@ from shortuuid.django_fields import ShortUUIDField
 import structlog
 
 from base_classes.enum_types import BaseStrEnum
-from base_classes.models import BaseModel
+from base_classes.models import BaseModel, BaseCountModel
 from resources import (
     get_resource_classes, decide_next_state_from_event, log_activity_on_resource
 )
@@ -99,6 +104,266 @@ class ResourceDependencyModel(BaseModel):
         return f'{resource_type_name}:{self.resource_id}.{self.field_name} -> {dependency_type_name}:{self.depends_on_id}'
 
 
+class ResourceStateCountModel(BaseCountModel):
+    """ number of ResourceModels per (project, rtype, state) """
+
+    KEY_FIELDS = ('project_id', 'rtype')
+    COUNTED_FIELD = 'state'
+
+    project = models.ForeignKey(
+        'users.ProjectModel', on_delete=models.CASCADE
+    )
+    rtype = models.CharField(max_length=255)
+    state = models.CharField(max_length=64)
+
+    class Meta:
+        unique_together = ('project', 'rtype', 'state')
+
+    def __str__(self):
+        return f'{self.rtype}.{self.state}: {self.count}'
+
+    @classmethod
+    def reconcile(cls):
+        actual_counts = {
+            (di['project_id'], di['rtype'], di['state']): di['num']
+            for di in ResourceModel.objects.values(
+                'project_id', 'rtype', 'state').annotate(num=Count('id'))
+        }
+        return cls.rebuild(actual_counts)
+
+
+class ChildResourceModel(BaseModel):
+    """
+        A provider-managed sub-resource, e.g. an auto-mode network's
+        subnets. Unlike a ResourceModel it has no state, events or
+        transitions, so the daemon scans never see it. It's promoted to a
+        ResourceModel once an HCL entry declares it, see promote().
+    """
+    parent = models.ForeignKey(
+        'ResourceModel', on_delete=models.CASCADE, related_name='children'
+    )
+    rtype = models.CharField(max_length=255)
+    slug = models.CharField(max_length=47)
+    extra_data = models.JSONField(default=dict)
+    last_seen_at = models.DateTimeField()  # when the parent last reported it
+
+    class Meta:
+        unique_together = ('parent', 'rtype', 'slug')
+
+    def __str__(self):
+        return f'{self.rtype.split(".")[-1]}:{self.slug} (child of {self.parent_id})'
+
+    @classmethod
+    def sync(cls, parent, rtype, extra_data_by_slug):
+        """
+            records the sub-resources a healthy parent reported, returns
+            the ResourceModels of those that were already promoted
+        """
+        promoted = list(ResourceModel.objects.filter(
+            project_id=parent.project_id, rtype=rtype,
+            slug__in=list(extra_data_by_slug)
+        ))
+        promoted_slugs = {obj.slug for obj in promoted}
+
+        resource_class = ResourceModel.get_resource_classes()[rtype]
+        now = timezone.now()
+        children = [
+            cls(
+                parent=parent, rtype=rtype, slug=slug, last_seen_at=now,
+                extra_data=ResourceModel.objects._sanitize_extra_data(
+                    resource_class, extra_data
+                )
+            )
+            for (slug, extra_data) in extra_data_by_slug.items()
+            if slug not in promoted_slugs
+        ]
+        if children:
+            cls.objects.bulk_create(children, ignore_conflicts=True)
+            cls.objects.filter(
+                parent=parent, rtype=rtype,
+                slug__in=[child.slug for child in children]
+            ).update(last_seen_at=now, updated=now)
+
+        return promoted
+
+    @classmethod
+    def promote(cls, model_objs):
+        """
+            called before new ResourceModels are saved, those that were
+            reported as children take over the parent's findings. Returns
+            the children, which the caller deletes once they're saved
+        """
+        if not model_objs:
+            return []
+        by_key = {(obj.rtype, obj.slug): obj for obj in model_objs}
+        children = cls.objects.filter(
+            parent__project_id=model_objs[0].project_id,
+            rtype__in={obj.rtype for obj in model_objs},
+            slug__in=[obj.slug for obj in model_objs]
+        )
+
+        promoted = []
+        for child in children:
+            model_obj = by_key.get((child.rtype, child.slug))
+            if model_obj is None:
+                continue
+            # its own transitions still run, this only informs them
+            model_obj.existence = ExistenceEnum.exists
+            model_obj.existence_last_checked_at = child.last_seen_at
+            model_obj.health = HealthEnum.healthy
+            model_obj.health_last_checked_at = child.last_seen_at
+            promoted.append(child)
+        return promoted
+
+
+# (start event, end event) of each duration learned from the event history
+TIMED_TRANSITIONS = {
+    'ensure_exists': ('creation_request_succeeded', 'resource_found'),
+    'ensure_healthy': ('resource_found', 'health_checks_succeeded'),
+}
+TIMING_WINDOW = datetime.timedelta(days=7)
+TIMING_MIN_SAMPLES = 5
+TIMING_CACHE_TTL = 300  # seconds
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def get_resource_zone(extra_data):
+    extra_data = extra_data or {}
+    zone = extra_data.get('zone') or extra_data.get('region')
+    return zone if isinstance(zone, str) else ''
+
+
+class ResourceTimingModel(BaseModel):
+    """
+        observed seconds for a Transition to complete per (rtype, zone),
+        zone '' holds the stats across all zones of the rtype
+    """
+    rtype = models.CharField(max_length=255)
+    zone = models.CharField(max_length=64, blank=True, default='')
+    transition_type = models.CharField(max_length=64)
+
+    sample_count = models.IntegerField(default=0)
+    p50_seconds = models.FloatField()
+    p90_seconds = models.FloatField()
+
+    _cache = None
+    _cache_loaded_at = None
+
+    class Meta:
+        unique_together = ('rtype', 'zone', 'transition_type')
+
+    def __str__(self):
+        return f'{self.rtype}[{self.zone}].{self.transition_type}: {self.p50_seconds}s'
+
+    @classmethod
+    def get_expected(cls, rtype, zone, transition_type):
+        """ per-process cache of the whole table, refreshed every TIMING_CACHE_TTL """
+        now = time.monotonic()
+        if cls._cache is None or now - cls._cache_loaded_at > TIMING_CACHE_TTL:
+            cls._cache = {
+                (obj.rtype, obj.zone, obj.transition_type): obj
+                for obj in cls.objects.filter(sample_count__gte=TIMING_MIN_SAMPLES)
+            }
+            cls._cache_loaded_at = now
+
+        return (
+            cls._cache.get((rtype, zone, transition_type)) or
+            cls._cache.get((rtype, '', transition_type))
+        )
+
+    @classmethod
+    def rebuild(cls):
+        """ recomputes the stats from recent ResourceEventModel timestamps """
+        start_types = {start for (start, _) in TIMED_TRANSITIONS.values()}
+        end_types = {end for (_, end) in TIMED_TRANSITIONS.values()}
+
+        events = ResourceEventModel.objects.filter(
+            type__in=start_types | end_types,
+            created__gte=timezone.now() - TIMING_WINDOW
+        ).values(
+            'resource_id', 'resource__rtype', 'resource__extra_data',
+            'type', 'created'
+        ).order_by('resource_id', 'created')
+
+        samples = defaultdict(list)
+        last_seen, resource_id = {}, None
+        for ev in events.iterator():
+            if ev['resource_id'] != resource_id:
+                last_seen, resource_id = {}, ev['resource_id']
+
+            for transition_type, (start_type, end_type) in TIMED_TRANSITIONS.items():
+                if ev['type'] != end_type or start_type not in last_seen:
+                    continue
+                duration = (ev['created'] - last_seen.pop(start_type)).total_seconds()
+                rtype = ev['resource__rtype']
+                zone = get_resource_zone(ev['resource__extra_data'])
+                samples[(rtype, zone, transition_type)].append(duration)
+                if zone:
+                    samples[(rtype, '', transition_type)].append(duration)
+
+            if ev['type'] in start_types:
+                last_seen[ev['type']] = ev['created']
+
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create([
+                cls(
+                    rtype=rtype, zone=zone, transition_type=transition_type,
+                    sample_count=len(durations),
+                    p50_seconds=_percentile(sorted(durations), 0.5),
+                    p90_seconds=_percentile(sorted(durations), 0.9)
+                )
+                for ((rtype, zone, transition_type), durations) in samples.items()
+            ])
+        cls._cache = None
+        return len(samples)
+
+
+# written only by compare-and-swap in ResourceModel.log_event()
+STATE_FIELDS = ('state', 'state_cause', 'version')
+STATE_CAS_MAX_ATTEMPTS = 5
+
+
+class StateUpdateConflict(Exception):
+    """ a concurrent writer moved the state since the decision was made """
+
+
+def get_activity_values(event_type):
+    """ {field: value} that log_activity_on_resource() sets for event_type """
+    activity = SimpleNamespace()
+    log_activity_on_resource(activity, event_type)
+    return vars(activity)
+
+# guards against dependency cycles, real graphs are much shallower
+DEPENDENCY_CLOSURE_MAX_DEPTH = 32
+
+# {from_col} -> {to_col} is the direction being walked, a resource may be
+# reachable via several paths so its shortest distance is kept
+DEPENDENCY_CLOSURE_SQL = '''
+    WITH RECURSIVE closure(id, depth) AS (
+        SELECT rel.{to_col}, 1
+        FROM {rel_table} rel
+        WHERE rel.{from_col} = %s
+      UNION
+        SELECT rel.{to_col}, closure.depth + 1
+        FROM {rel_table} rel
+        JOIN closure ON rel.{from_col} = closure.id
+        WHERE closure.depth < %s
+    )
+    SELECT res.*, shortest.depth, ev.type AS state_cause_type
+    FROM (
+        SELECT id, MIN(depth) AS depth FROM closure GROUP BY id
+    ) shortest
+    JOIN {resource_table} res ON res.id = shortest.id
+    LEFT JOIN {event_table} ev ON ev.id = res.state_cause_id
+    ORDER BY shortest.depth, res.id
+'''
+
+
 class ResourceModel(BaseModel):
 
     RESOURCE_CLASSES = None
@@ -109,6 +374,7 @@ class ResourceModel(BaseModel):
         super().__init__(*args, **kwargs)
         self._resource_class = resource_class
         self._extra_attrdict = None
+        self._persisted_state = None
 
     # note: unlike a regular integer pk, this gets set when instantiating
     # an object (i.e. before save() is called) so you can't use self.pk
@@ -171,6 +437,9 @@ class ResourceModel(BaseModel):
     health_last_checked_at = models.DateTimeField(blank=True, null=True)
     # --------------------------------
 
+    # incremented on every state change, see log_event()
+    version = models.PositiveIntegerField(default=0)
+
     objects = ResourceModelManager()
 
     class Meta:
@@ -197,6 +466,54 @@ class ResourceModel(BaseModel):
     def get_related_fields(cls):
         return cls.RELATED_FIELDS
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        obj = super().from_db(db, field_names, values)
+        obj._persisted_state = obj._get_state_values()
+        return obj
+
+    def _get_state_values(self):
+        # __dict__ avoids loading deferred fields
+        return tuple(
+            self.__dict__.get(fn) for fn in ('state', 'state_cause_id', 'version')
+        )
+
+    @classmethod
+    def _get_non_state_fields(cls):
+        return [
+            f for f in cls._meta.concrete_fields
+            if f.primary_key is False and f.name not in STATE_FIELDS
+        ]
+
+    def save(self, *args, **kwargs):
+        is_whole_row_update = not (
+            self._state.adding or kwargs.get('force_insert')
+            or kwargs.get('update_fields') is not None
+        )
+        prev_state = None
+        if is_whole_row_update:
+            if self._get_state_values() == self._persisted_state:
+                # state wasn't changed on this instance, don't overwrite
+                # a newer state committed by a concurrent log_event()
+                deferred = self.get_deferred_fields()
+                kwargs['update_fields'] = [
+                    f.name for f in self._get_non_state_fields()
+                    if f.attname not in deferred
+                ]
+            else:  # set directly (e.g. in the admin), not compare-and-swap
+                self.version += 1
+                if self._persisted_state is not None:
+                    prev_state = self._persisted_state[0]
+
+        super().save(*args, **kwargs)
+        self._persisted_state = self._get_state_values()
+
+        if prev_state is not None and prev_state != self.state:
+            ResourceStateCountModel.move(
+                prev_state, self.state,
+                project_id=self.project_id, rtype=self.rtype
+            )
+
     def __str__(self):
         cls_name = self.__class__.__name__
         app_name, resource_class_name = self.rtype.split('.')
@@ -217,16 +534,45 @@ class ResourceModel(BaseModel):
             logger.error('ResourceModel.extra called when extra_data is None')
             return None
 
+        from base_classes.pydantic_models import prefetched_resources
+
+        # dependencies are the foreign keys in extra_data, prefetching them
+        # costs one query, validation and the attrdict then don't query them
         ExtraModelClass = self.resource_class.EXTRA_FIELDS_MODEL_CLASS
-        pydantic_obj = ExtraModelClass(**self.extra_data)
+        if ExtraModelClass.get_resource_fk_field_names():
+            self.prefetch_dependencies()
+        known_resources = [
+            rel.depends_on for rel in self._get_prefetched('forward_rels') or []
+        ]
+        with prefetched_resources(known_resources):
+            pydantic_obj = ExtraModelClass(**self.extra_data)
+            self._extra_attrdict = pydantic_obj.create_attr_dict()
 
-        self._extra_attrdict = pydantic_obj.create_attr_dict()
         return self._extra_attrdict
 
+    def prefetch_dependencies(self):
+        """ get_dependencies() and .extra reuse the result """
+        if self._get_prefetched('forward_rels') is not None:
+            return
+        models.prefetch_related_objects([self], models.Prefetch(
+            'forward_rels',
+            queryset=ResourceDependencyModel.objects.select_related(
+                'depends_on', 'depends_on__state_cause'
+            )
+        ))
+
+    def _get_prefetched(self, related_name):
+        cache = getattr(self, '_prefetched_objects_cache', {})
+        if related_name not in cache:
+            return None
+        return getattr(self, related_name).all()
+
     def get_dependencies(self):
-        query = ResourceDependencyModel.objects.select_related('depends_on').filter(
-            resource=self.id
-        )
+        query = self._get_prefetched('forward_rels')
+        if query is None:
+            query = ResourceDependencyModel.objects.select_related(
+                'depends_on', 'depends_on__state_cause'
+            ).filter(resource=self.id)
 
         dependencies_by_field = defaultdict(list)
         for rel in query:
@@ -244,11 +590,40 @@ class ResourceModel(BaseModel):
         return dict(dependencies_by_field)
 
     def get_forward_dependencies(self):
-        query = ResourceDependencyModel.objects.select_related('resource').filter(
-            depends_on=self.id
-        )
+        query = self._get_prefetched('backward_rels')
+        if query is None:
+            query = ResourceDependencyModel.objects.select_related(
+                'resource', 'resource__state_cause'
+            ).filter(depends_on=self.id)
         return [obj.resource for obj in query]
 
+    def _get_dependency_closure(self, from_col, to_col, max_depth):
+        sql = DEPENDENCY_CLOSURE_SQL.format(
+            from_col=from_col, to_col=to_col,
+            rel_table=ResourceDependencyModel._meta.db_table,
+            resource_table=ResourceModel._meta.db_table,
+            event_table=ResourceEventModel._meta.db_table
+        )
+        return list(ResourceModel.objects.raw(sql, [self.id, max_depth]))
+
+    def get_dependency_closure(self, max_depth=DEPENDENCY_CLOSURE_MAX_DEPTH):
+        """
+            all resources this one transitively depends on, in a single
+            query. Each is annotated with 'depth' (1 for direct dependencies)
+            and 'state_cause_type', and they're ordered by depth.
+        """
+        return self._get_dependency_closure(
+            'resource_id', 'depends_on_id', max_depth
+        )
+
+    def get_forward_dependency_closure(
+        self, max_depth=DEPENDENCY_CLOSURE_MAX_DEPTH
+    ):
+        """ like get_dependency_closure() but for dependents """
+        return self._get_dependency_closure(
+            'depends_on_id', 'resource_id', max_depth
+        )
+
     @property
     def resource_age(self):
         if self.resource_created_at is None:
@@ -257,10 +632,9 @@ class ResourceModel(BaseModel):
 
     @property
     def resource_class(self):
-        if self.RESOURCE_CLASSES is None:
-            self.RESOURCE_CLASSES = get_resource_classes()
         if self._resource_class is None:
-            self._resource_class = self.RESOURCE_CLASSES[self.rtype]
+            # note: the registry is cached on the class, not per instance
+            self._resource_class = self.get_resource_classes()[self.rtype]
         return self._resource_class
 
     def get_transition_history(self, reverse=False, status=None, statuses=None):
@@ -327,7 +701,9 @@ class ResourceModel(BaseModel):
         # note: we will also want to trigger 'resource_found' without a next_state side effect,
         # this would be when fetch_existing() discovers resources outside the current Transition
 
-        log_activity_on_resource(self, event_type)
+        activity = get_activity_values(event_type)
+        for fn, val in activity.items():
+            setattr(self, fn, val)
 
         if next_state is None and transition is None:
             logger.warning(
@@ -353,13 +729,170 @@ class ResourceModel(BaseModel):
             state_decision=next_state
         )
 
-        if next_state:
-            rtype = self.rtype.split('.')[-1]
-            logger.info('updating state', rtype=rtype, state=next_state)
-            self.state = next_state
-            self.state_cause = event_obj
+        if next_state is None:
+            # like _compare_and_swap_state() only the activity fields are
+            # written, most events have none and need no update
+            if activity:
+                self.save(update_fields=[*activity, 'updated'])
+            return
+
+        rtype = self.rtype.split('.')[-1]
+        logger.info('updating state', rtype=rtype, state=next_state)
+        prev_state = self._compare_and_swap_state(
+            next_state, event_obj, activity
+        )
+
+        if prev_state is not None:
+            ResourceStateCountModel.move(
+                prev_state, next_state,
+                project_id=self.project_id, rtype=self.rtype
+            )
+
+    @classmethod
+    def bulk_log_event(cls, resources, event_type, transition, reason=None):
+        """
+            log_event() for many resources in a fixed number of queries: the
+            events are bulk inserted and the state changes written by one
+            compare-and-swap update. Resources that lose the swap fall back
+            to _compare_and_swap_state(), those moved elsewhere are skipped.
+        """
+        if not resources:
+            return
+
+        current_span = trace.get_current_span()
+        if current_span._context.span_id != 0:
+            current_span.add_event(event_type)
+
+        next_state = decide_next_state_from_event(
+            transition.type, event_type, reason
+        )
+
+        # activity fields are the same for every resource
+        activity = get_activity_values(event_type)
+
+        changing, unchanged, events = [], [], []
+        for obj in resources:
+            obj._print_event(event_type, reason)
+            is_changing = next_state is not None and obj.state != next_state
+            (changing if is_changing else unchanged).append(obj)
+            events.append(ResourceEventModel(
+                type=event_type, reason=reason, resource=obj,
+                transition=transition, extra_info=create_extra_info(obj),
+                state_decision=next_state if is_changing else None
+            ))
+            for fn, val in activity.items():
+                setattr(obj, fn, val)
+
+        ResourceEventModel.objects.bulk_create(events)
+
+        now = timezone.now()
+        if unchanged:
+            cls.objects.filter(pk__in=[obj.pk for obj in unchanged]).update(
+                updated=now, **activity
+            )
+        if not changing:
+            return
+
+        logger.info(
+            'updating state', rtype=changing[0].rtype.split('.')[-1],
+            state=next_state, count=len(changing)
+        )
+        cause = ResourceEventModel.objects.filter(
+            resource=OuterRef('pk'), transition=transition, type=event_type
+        ).order_by('-id').values('id')[:1]
+        cls.objects.filter(
+            reduce(operator.or_, [
+                Q(pk=obj.pk, version=obj.version) for obj in changing
+            ])
+        ).update(
+            state=next_state, state_cause=Subquery(cause),
+            version=F('version') + 1, updated=now, **activity
+        )
+
+        written = {
+            pk: (version, cause_id) for (pk, version, cause_id) in
+            cls.objects.filter(
+                pk__in=[obj.pk for obj in changing],
+                state=next_state, state_cause__transition=transition,
+                state_cause__type=event_type
+            ).values_list('pk', 'version', 'state_cause_id')
+        }
+        deltas = defaultdict(lambda: defaultdict(int))
+        for obj in changing:
+            version, cause_id = written.get(obj.pk, (None, None))
+            if version == obj.version + 1:
+                prev_state = obj.state
+                obj.state, obj.state_cause_id, obj.version = (
+                    next_state, cause_id, version
+                )
+                obj._persisted_state = obj._get_state_values()
+            else:  # rare: written concurrently since it was read
+                event_obj = ResourceEventModel.objects.filter(
+                    resource=obj, transition=transition, type=event_type
+                ).latest('id')
+                try:
+                    prev_state = obj._compare_and_swap_state(
+                        next_state, event_obj, activity
+                    )
+                except StateUpdateConflict:
+                    continue
+                if prev_state is None:
+                    continue
+
+            key = (obj.project_id, obj.rtype)
+            deltas[key][prev_state] -= 1
+            deltas[key][next_state] += 1
+
+        for (project_id, rtype), rtype_deltas in deltas.items():
+            ResourceStateCountModel.shift(
+                rtype_deltas, project_id=project_id, rtype=rtype
+            )
 
-        self.save()
+    def _compare_and_swap_state(self, next_state, event_obj, activity=None):
+        """
+            Writes the new state, and the activity fields set by the same
+            event, only if the row's version hasn't changed since it was
+            read. Other columns aren't written. Returns the state that was
+            replaced, or None if a concurrent writer already moved it to
+            next_state. If it was moved to any other state the decision no
+            longer applies and StateUpdateConflict is raised.
+        """
+        decided_from = self.state
+        activity = activity or {}
+        for attempt in range(STATE_CAS_MAX_ATTEMPTS):
+            num_updated = ResourceModel.objects.filter(
+                pk=self.pk, version=self.version
+            ).update(
+                state=next_state, state_cause=event_obj,
+                version=F('version') + 1, updated=timezone.now(), **activity
+            )
+            if num_updated:
+                prev_state = self.state
+                self.state = next_state
+                self.state_cause = event_obj
+                self.version += 1
+                self._persisted_state = self._get_state_values()
+                return prev_state
+
+            self.refresh_from_db(fields=STATE_FIELDS)
+            self._persisted_state = self._get_state_values()
+            if self.state == next_state:
+                return None
+            if self.state != decided_from:
+                break
+            # only the version moved (e.g. a direct save), the decision holds
+            logger.info(
+                'state update conflict', resource=self.id, attempt=attempt,
+                state=self.state, next_state=next_state
+            )
+
+        # the event stays in the history but didn't decide the state
+        ResourceEventModel.objects.filter(pk=event_obj.pk).update(
+            state_decision=None
+        )
+        raise StateUpdateConflict(
+            f'{decided_from} -> {next_state}, state is now {self.state}'
+        )
 
     def _print_event(self, event_type, reason=None, extra_info=None):
         rtype = self.rtype.split('.')[-1]
@@ -1,8 +1,12 @@
 
+from collections import Counter
+
 from celery import shared_task
+from django.db import transaction
+from django.db.models import F
 import structlog
 
-from resources.models import ResourceModel
+from resources.models import ResourceModel, ResourceStateCountModel
 from resources.hcl_utils.ingestion import (
     create_hcl_resource_models, parse_hcl_and_fetch_resource_models
 )
@@ -60,9 +64,25 @@ def _hcl_express_desired_state(
         # may need to be more nuanced if we optimize create_missing_transitions()
         state = 'declared'
 
-    ResourceModel.objects.filter(id__in=resource_ids).update(
-        desired_state=desired_state, state=state
-    )
+    with transaction.atomic():
+        query = ResourceModel.objects.select_for_update().filter(
+            id__in=resource_ids
+        )
+        prev_states = Counter(query.values_list('rtype', 'state'))
+        query.update(
+            desired_state=desired_state, state=state, version=F('version') + 1
+        )
+
+        # the bulk update bypasses log_event(), move the counts in one go
+        deltas_by_rtype = {}
+        for (rtype, prev_state), num in prev_states.items():
+            deltas = deltas_by_rtype.setdefault(rtype, Counter())
+            deltas[prev_state] -= num
+            deltas[state] += num
+        for rtype, deltas in deltas_by_rtype.items():
+            ResourceStateCountModel.shift(
+                dict(deltas), project_id=project.pk, rtype=rtype
+            )
 
     return True
 
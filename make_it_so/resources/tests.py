@@ -1,3 +1,362 @@
-from django.test import TestCase
+import datetime
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import hcl2
+
+from resources.hcl_utils.ingestion import create_hcl_resource_models
+from resources.hcl_utils.parsing import (
+    PARSE_CACHE_VERSION, _parse_cache_key, parse_hcl_file
+)
+from resources.models import (
+    ChildResourceModel, ResourceDependencyModel, ResourceModel,
+    ResourceEventModel, ResourceStateCountModel, ResourceTimingModel,
+    StateUpdateConflict
+)
+from users.models import AccountModel, ProjectModel
+
+
+NETWORK_RTYPE = 'gcp_resources.GcpVpcNetworkResource'
+SUBNET_RTYPE = 'gcp_resources.GcpSubnetResource'
+
+HCL_NETWORK = '''
+provider "google" {{
+  project_id = "{project_id}"
+  resources_app = "gcp_resources"
+}}
+
+resource "GcpVpcNetworkResource" "test-network" {{
+  slug = "test-network"
+}}
+'''
+HCL_FIREWALL = '''
+resource "GcpFirewallResource" "{name}" {{
+  slug = "{name}"
+  network_id = GcpVpcNetworkResource.test-network.id
+  priority = 1000
+  source_ranges = ["0.0.0.0/0"]
+  direction = "INGRESS"
+  allow_rules = [{{ IPProtocol = "tcp", ports = ["22"] }}]
+}}
+'''
+
+
+class ResourceStateConcurrencyTests(TestCase):
+
+    def setUp(self):
+        account = AccountModel.objects.create(name='test', slug='test')
+        project = ProjectModel.objects.create(
+            slug='fake-project', account=account, provider_type='google'
+        )
+        self.resource = ResourceModel.objects.create(
+            slug='test-network', rtype=NETWORK_RTYPE, project=project,
+            state='declared', extra_data={'self_link': 'fake-link'}
+        )
+
+    def _load(self):
+        return ResourceModel.objects.get(pk=self.resource.pk)
+
+    def test_stale_save_keeps_state(self):
+        stale = self._load()
+        self._load().log_event(
+            'resource_found_and_healthy', next_state='healthy'
+        )
+
+        stale.labels = {'team': 'infra'}
+        stale.save()
+
+        resource = self._load()
+        self.assertEqual(resource.state, 'healthy')
+        self.assertEqual(resource.labels, {'team': 'infra'})
+
+    def test_conflicting_state_change_is_rejected(self):
+        stale = self._load()
+        resource = self._load()
+        resource.labels = {'team': 'infra'}
+        resource.save()
+        resource.log_event('resource_found_and_healthy', next_state='healthy')
+
+        # decided against 'declared', which is no longer the state
+        with self.assertRaises(StateUpdateConflict):
+            stale.log_event('unhealthy', next_state='unhealthy')
+
+        resource = self._load()
+        self.assertEqual(resource.state, 'healthy')
+        self.assertEqual(resource.version, 1)
+        self.assertEqual(resource.labels, {'team': 'infra'})
+        self.assertFalse(
+            ResourceEventModel.objects.filter(
+                resource=resource, state_decision='unhealthy'
+            ).exists()
+        )
+        self.assertEqual(ResourceStateCountModel.reconcile(), 0)
+
+    def test_version_only_conflict_is_retried(self):
+        stale = self._load()
+        ResourceModel.objects.filter(pk=self.resource.pk).update(
+            version=F('version') + 1
+        )
+
+        stale.log_event('resource_found_and_healthy', next_state='healthy')
+
+        resource = self._load()
+        self.assertEqual(resource.state, 'healthy')
+        self.assertEqual(resource.version, 2)
+        self.assertEqual(ResourceStateCountModel.reconcile(), 0)
+
+    def test_conflict_already_in_next_state(self):
+        stale = self._load()
+        self._load().log_event(
+            'resource_found_and_healthy', next_state='healthy'
+        )
+
+        stale.log_event('resource_found_and_healthy', next_state='healthy')
+
+        resource = self._load()
+        self.assertEqual(resource.state, 'healthy')
+        self.assertEqual(resource.version, 1)
+        self.assertEqual(ResourceStateCountModel.reconcile(), 0)
+
+    def test_direct_state_save_moves_counts(self):
+        resource = self._load()
+        resource.state = 'healthy'  # e.g. in the admin
+        resource.save()
+
+        resource = self._load()
+        self.assertEqual(resource.state, 'healthy')
+        self.assertEqual(resource.version, 1)
+        counts = ResourceStateCountModel.objects.get(
+            project=resource.project, rtype=NETWORK_RTYPE, state='healthy'
+        )
+        self.assertEqual(counts.count, 1)
+        self.assertEqual(ResourceStateCountModel.reconcile(), 0)
+
+
+class ResourceTimingTests(TestCase):
+
+    def setUp(self):
+        account = AccountModel.objects.create(name='test', slug='test')
+        self.project = ProjectModel.objects.create(
+            slug='fake-project', account=account, provider_type='google'
+        )
+        # the per-process cache outlives the test's transaction
+        self.addCleanup(setattr, ResourceTimingModel, '_cache', None)
+
+    def _create_event(self, resource, event_type, created):
+        event = ResourceEventModel.objects.create(type=event_type, resource=resource)
+        ResourceEventModel.objects.filter(pk=event.pk).update(created=created)
+
+    def test_countdown_targets_learned_completion_time(self):
+        started_at = timezone.now() - datetime.timedelta(hours=1)
+        for i in range(5):
+            network = ResourceModel.objects.create(
+                slug=f'network-{i}', rtype=NETWORK_RTYPE, project=self.project,
+                extra_data={'self_link': 'fake-link'}
+            )
+            self._create_event(network, 'creation_request_succeeded', started_at)
+            self._create_event(
+                network, 'resource_found',
+                started_at + datetime.timedelta(seconds=100 + i)
+            )
+
+        self.assertEqual(ResourceTimingModel.rebuild(), 1)
+        timing = ResourceTimingModel.get_expected(NETWORK_RTYPE, '', 'ensure_exists')
+        self.assertEqual(timing.p50_seconds, 102)
+
+        resource_w = network.resource_class(network, None)
+        countdown, _ = resource_w.get_next_retry_countdown(
+            0, 'ensure_exists', task_age=30
+        )
+        self.assertEqual(countdown, 60)  # capped at 4x the static 15s
+        countdown, _ = resource_w.get_next_retry_countdown(
+            0, 'ensure_exists', task_age=95
+        )
+        self.assertEqual(countdown, 7)
+
+
+class RetryAfterTests(TestCase):
+
+    def setUp(self):
+        account = AccountModel.objects.create(name='test', slug='test')
+        project = ProjectModel.objects.create(
+            slug='fake-project', account=account, provider_type='google'
+        )
+        self.network = ResourceModel.objects.create(
+            slug='test-network', rtype=NETWORK_RTYPE, project=project,
+            state='exists', extra_data={'self_link': 'fake-link'},
+            resource_created_at=timezone.now() - datetime.timedelta(seconds=30)
+        )
+        self.resource_w = self.network.resource_class(self.network, None)
+
+    def test_time_gated_health_check_hint(self):
+        succ, is_final, retry_after = self.resource_w.health_check__ensure_age_over_90s()
+        self.assertFalse(succ or is_final)
+        self.assertAlmostEqual(retry_after, 61, delta=1)
+
+        # beyond the backoff's 300s max (with the adaptive factor) it's capped
+        bound = self.resource_w.bound_retry_after
+        self.assertEqual(bound(62, 'ensure_healthy'), 62)
+        self.assertEqual(bound(10 ** 6, 'ensure_healthy'), 1200)
+        not_before = timezone.now() + datetime.timedelta(seconds=40)
+        self.assertAlmostEqual(bound(not_before, 'ensure_healthy'), 40, delta=1)
+
+    def test_age_counts_from_creation_request(self):
+        self.network.resource_created_at = None
+        self.network.save()
+        # found, but not created here, its age is unknown
+        self.assertEqual(
+            self.resource_w.health_check__ensure_age_over_90s(), (True, None)
+        )
+
+        self.network.log_event('creation_request_succeeded')
+
+        network = ResourceModel.objects.get(pk=self.network.pk)
+        self.assertAlmostEqual(network.resource_age, 0, delta=1)
+        succ, is_final, retry_after = self.resource_w.health_check__ensure_age_over_90s()
+        self.assertFalse(succ or is_final)
+        self.assertAlmostEqual(retry_after, 91, delta=1)
+
+
+class ChildResourceTests(TestCase):
+
+    def setUp(self):
+        account = AccountModel.objects.create(name='test', slug='test')
+        self.project = ProjectModel.objects.create(
+            slug='fake-project', account=account, provider_type='google'
+        )
+        self.network = ResourceModel.objects.create(
+            slug='test-network', rtype=NETWORK_RTYPE, project=self.project,
+            state='healthy', extra_data={'self_link': 'fake-link'}
+        )
+
+    def _sync(self, *regions):
+        return ChildResourceModel.sync(self.network, SUBNET_RTYPE, {
+            f'test-network-subnet_{region}': {
+                'network': self.network, 'region': region,
+                'self_link': f'fake-link/regions/{region}/subnetworks/test-network'
+            }
+            for region in regions
+        })
+
+    def test_sync_and_promote(self):
+        self.assertEqual(self._sync('europe-west1', 'europe-west2'), [])
+        self.assertEqual(self._sync('europe-west1', 'europe-west2'), [])
+        self.assertEqual(ChildResourceModel.objects.count(), 2)
+
+        subnet = ResourceModel(
+            slug='test-network-subnet_europe-west1', rtype=SUBNET_RTYPE,
+            project=self.project, hcl_slug=f'{SUBNET_RTYPE}.subnet'
+        )
+        [child] = ChildResourceModel.promote([subnet])
+        self.assertEqual(child.extra_data['network'], self.network.id)
+        self.assertEqual(subnet.health, 'healthy')
+        subnet.save()
+        child.delete()
+
+        # once promoted, the parent reports it as a ResourceModel
+        self.assertEqual(self._sync('europe-west1', 'europe-west2'), [subnet])
+        self.assertEqual(ChildResourceModel.objects.count(), 1)
+
+
+class ResourceDependencyTests(TestCase):
+
+    def setUp(self):
+        account = AccountModel.objects.create(name='test', slug='test')
+        project = ProjectModel.objects.create(
+            slug='fake-project', account=account, provider_type='google'
+        )
+        self.network = ResourceModel.objects.create(
+            slug='test-network', rtype=NETWORK_RTYPE, project=project,
+            state='healthy', extra_data={'self_link': 'fake-link'}
+        )
+        subnet = ResourceModel.objects.create(
+            slug='test-subnet', rtype=SUBNET_RTYPE, project=project,
+            extra_data={
+                'network': self.network.id, 'region': 'europe-west1',
+                'self_link': 'fake-link/regions/europe-west1/subnetworks'
+            }
+        )
+        ResourceDependencyModel.objects.create(
+            resource=subnet, depends_on=self.network, field_name='network'
+        )
+        self.subnet = ResourceModel.objects.get(pk=subnet.pk)
+
+    def test_extra_prefetches_dependencies(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.subnet.extra.network, self.network)
+            self.assertEqual(
+                self.subnet.get_dependencies(), {'network': self.network}
+            )
+
+    def test_extra_without_foreign_keys_doesnt_query(self):
+        network = ResourceModel.objects.get(pk=self.network.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(network.extra.self_link, 'fake-link')
+
+
+# parsed files would otherwise be cached in Redis
+@override_settings(REDIS_URL=None)
+class HclIngestionTests(TestCase):
+
+    def setUp(self):
+        self.account = AccountModel.objects.create(name='test', slug='test')
+
+    def _ingest(self, num_firewalls):
+        project = ProjectModel.objects.create(
+            slug=f'project-{num_firewalls}', account=self.account,
+            provider_type='google'
+        )
+        content = HCL_NETWORK.format(project_id=project.pk) + ''.join(
+            HCL_FIREWALL.format(name=f'firewall-{i}')
+            for i in range(num_firewalls)
+        )
+        with CaptureQueriesContext(connection) as ctx:
+            _, new_objects = create_hcl_resource_models(
+                file_content=content, project=project
+            )
+        return new_objects, len(ctx.captured_queries)
+
+    def test_waves_are_saved_in_bulk(self):
+        new_objects, num_queries = self._ingest(2)
+        self.assertEqual(len(new_objects), 3)
+
+        new_objects, num_queries_many = self._ingest(40)
+        self.assertEqual(len(new_objects), 41)
+        self.assertEqual(num_queries_many, num_queries)
+
+        network = new_objects[0]
+        self.assertEqual(network.rtype, NETWORK_RTYPE)
+        self.assertEqual(
+            ResourceDependencyModel.objects.filter(depends_on=network).count(), 40
+        )
+        # the bulk insert kept the state counts
+        self.assertEqual(ResourceStateCountModel.reconcile(), 0)
+
+    def test_parsed_once_per_content(self):
+        content = HCL_NETWORK.format(project_id='abc') + HCL_FIREWALL.format(
+            name='firewall-0'
+        )
+        with mock.patch.object(hcl2, 'loads', wraps=hcl2.loads) as loads:
+            _, entries, _, _ = parse_hcl_file(file_content=content)
+            entries[1].evaluate_expressions({
+                f'{NETWORK_RTYPE}.test-network': ResourceModel(id='fake-id')
+            })
+            _, entries_again, _, _ = parse_hcl_file(file_content=content)
+
+        self.assertEqual(loads.call_count, 1)
+        # each call gets its own copy of the entries
+        self.assertEqual(entries[1].rdict['network_id'], 'fake-id')
+        self.assertNotEqual(entries_again[1].rdict['network_id'], 'fake-id')
+
+    def test_parse_cache_key_is_versioned(self):
+        key = _parse_cache_key('abc')
+        with mock.patch(
+            'resources.hcl_utils.parsing.PARSE_CACHE_VERSION',
+            PARSE_CACHE_VERSION + 1
+        ):
+            # entries pickled by an older deploy are never read
+            self.assertNotEqual(_parse_cache_key('abc'), key)
@@ -1,9 +1,12 @@
 from django.contrib import admin
 
-from .models import TransitionModel, TransitionEventModel
+from .models import (
+    TransitionModel, TransitionEventModel, TransitionStatusCountModel
+)
 
 
 admin.site.register(TransitionEventModel)
+admin.site.register(TransitionStatusCountModel)
 
 
 @admin.register(TransitionModel)
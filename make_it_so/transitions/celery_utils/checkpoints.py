@@ -0,0 +1,206 @@
+"""
+    Checkpoints record the result of an expensive or non-idempotent step
+    (e.g. a creation request) so a retried task can skip it. They're scoped
+    to a Transition and expire once the Transition can no longer be retrying.
+
+    usage:
+        @checkpoint('attempt_creation')
+        def checkpoint__attempt_creation(task, resource_w):
+            ...
+            return success, response
+
+    The wrapped function must return a bool or a tuple whose first element
+    is a bool, only successful results are stored.
+"""
+from collections import OrderedDict
+import functools
+import pickle
+import threading
+import time
+
+from redis.exceptions import LockError
+import structlog
+
+from transitions.celery_utils.exceptions import TaskRetryException
+from transitions.celery_utils.redis_client import get_redis_client, REDIS_ERRORS
+
+
+logger = structlog.get_logger(__name__)
+
+
+LRU_SIZE = 2048
+LOCK_TIMEOUT = 120  # seconds, the step must finish within this
+LOCK_BLOCKING_TIMEOUT = 10
+
+
+class _LRUCache:
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return False, None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return False, None
+            self._data.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CheckpointStore:
+    """ in-process LRU in front of Redis, Redis failures degrade to the LRU """
+
+    def __init__(self, lru_size=LRU_SIZE):
+        self.local = _LRUCache(lru_size)
+
+    @property
+    def redis_cli(self):
+        return get_redis_client()
+
+    @property
+    def is_shared(self):
+        """ whether tasks in other worker processes see what's set here """
+        return self.redis_cli is not None
+
+    def get(self, key):
+        """ returns (hit, value) """
+        hit, value = self.local.get(key)
+        if hit or self.redis_cli is None:
+            return hit, value
+
+        try:
+            raw = self.redis_cli.get(key)
+            ttl = self.redis_cli.ttl(key) if raw is not None else None
+        except REDIS_ERRORS as e:
+            logger.warning('checkpoint store unavailable', exception=str(e))
+            return False, None
+
+        if raw is None:
+            return False, None
+        value = pickle.loads(raw)
+        if ttl and ttl > 0:
+            self.local.set(key, value, ttl)
+        return True, value
+
+    def set(self, key, value, ttl):
+        self.local.set(key, value, ttl)
+        if self.redis_cli is None:
+            return
+        try:
+            self.redis_cli.set(key, pickle.dumps(value), ex=int(ttl))
+        except REDIS_ERRORS as e:
+            logger.warning('checkpoint not persisted', key=key, exception=str(e))
+
+    def lock(self, key):
+        if self.redis_cli is None:
+            return _NoLock()
+        return self.redis_cli.lock(
+            f'{key}:lock', timeout=LOCK_TIMEOUT,
+            blocking_timeout=LOCK_BLOCKING_TIMEOUT
+        )
+
+    def clear_local(self):
+        self.local.clear()
+
+
+class _NoLock:
+
+    def acquire(self):
+        return True
+
+    def release(self):
+        pass
+
+
+_store = CheckpointStore()
+
+
+def get_checkpoint_store():
+    return _store
+
+
+def _is_success(result):
+    success = result[0] if isinstance(result, (tuple, list)) else result
+    assert isinstance(success, bool)
+    return success
+
+
+def _checkpoint_key(transition_pk, name):
+    return f'ckpt:{transition_pk}:{name}'
+
+
+def record_checkpoint(transition, resource_w, name, result):
+    """
+        stores a step's result on behalf of the Transition's task, e.g. when
+        a batch task ran it for many Transitions. Returns False if the
+        result wasn't a success, so the task runs the step itself
+    """
+    if not _is_success(result):
+        return False
+    ttl = resource_w.get_transition_lifetime(transition.type)
+    get_checkpoint_store().set(_checkpoint_key(transition.pk, name), result, ttl)
+    return True
+
+
+def checkpoint(name):
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(task, *args, **kwargs):
+            transition = task.task_context.transition
+            resource_w = task.task_context.resource_w
+            key = _checkpoint_key(transition.pk, name)
+
+            store = get_checkpoint_store()
+            hit, value = store.get(key)
+            if hit:
+                logger.info('checkpoint hit, skipping step', checkpoint=name)
+                return value
+
+            # only one attempt of a Transition may run the step at a time
+            lock = store.lock(key)
+            try:
+                acquired = lock.acquire()
+            except REDIS_ERRORS as e:
+                logger.warning('checkpoint lock unavailable', exception=str(e))
+                lock, acquired = _NoLock(), True
+            if not acquired:
+                raise TaskRetryException('checkpoint_locked', reason=name)
+
+            try:
+                hit, value = store.get(key)  # may have finished while waiting
+                if hit:
+                    return value
+
+                result = func(task, *args, **kwargs)
+                if _is_success(result):
+                    ttl = resource_w.get_transition_lifetime(transition.type)
+                    store.set(key, result, ttl)
+                return result
+            finally:
+                try:
+                    lock.release()
+                except REDIS_ERRORS + (LockError,):
+                    pass  # expires after LOCK_TIMEOUT
+
+        return wrapper
+
+    return decorator
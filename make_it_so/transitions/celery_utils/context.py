@@ -7,45 +7,81 @@ from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapProp
 import structlog
 
 from resources.utils import CatchTime
-from make_it_so.celery import IS_EAGER
+from make_it_so.celery import IS_EAGER, SLIM_TRACKING, TRACING_ENABLED
+from transitions.celery_utils.payloads import resolve_kwargs
 
 
 logger = structlog.get_logger(__name__)
 tracer = trace.get_tracer(__name__)
 
+# fast path: transition_pk -> (transition, context of the preceding task)
+_handoffs = {}
+
 
 class TransitionTaskContext:
 
     def __init__(
         self, transition, task_result_obj, request,
-        cached_existing=None
+        cached_existing=None, cli=None, existing=None, deadline=None
     ):
         self.transition = transition
         self.task_result_obj = task_result_obj
         self.cached_existing = cached_existing
+        # time.monotonic() by which the worker's time limit ends this
+        # execution, fast path tasks share their predecessor's
+        self.deadline = deadline
 
         self.model_obj = self.obj = transition.resource
-
-        ResourceClass = self.obj.resource_class
-        self.resource_w = ResourceClass(self.obj, transition)
+        self._cli = cli
+        self._existing = existing
+        self._resource_w = None
 
         self.carrier = {}
-        span_name = f'{request.id}_{request.retries}'
-        with tracer.start_as_current_span(span_name, end_on_exit=False) as span:
-            TraceContextTextMapPropagator().inject(self.carrier)
+        if TRACING_ENABLED:
+            span_name = f'{request.id}_{request.retries}'
+            with tracer.start_as_current_span(span_name, end_on_exit=False):
+                TraceContextTextMapPropagator().inject(self.carrier)
+
+    @property
+    def resource_w(self):
+        # built on first use, duplicates revoked in before_start() never need it
+        if self._resource_w is None:
+            ResourceClass = self.obj.resource_class
+            self._resource_w = ResourceClass(
+                self.obj, self.transition, cli=self._cli,
+                existing=self._existing
+            )
+        return self._resource_w
 
     @classmethod
     def fetch_transition(cls, transition_pk):
         from transitions.models import TransitionModel
+
+        # dependencies are prefetched by ResourceModel.extra, on first use
         return TransitionModel.objects.select_related(
-            'resource', 'resource__state_cause').filter(pk=transition_pk).first()
+            'resource', 'resource__state_cause', 'resource__project'
+        ).filter(pk=transition_pk).first()
+
+    @classmethod
+    def hand_off(cls, transition, prev_context):
+        """
+            the next task's context reuses the resource, client and list
+            response of this one
+        """
+        transition.resource._extra_attrdict = None  # extra_data may have changed
+        _handoffs[transition.pk] = (transition, prev_context)
+
+    @classmethod
+    def discard_handoff(cls, transition_pk):
+        _handoffs.pop(transition_pk, None)
 
     @classmethod
     def fetch_task_result_object(cls, request):
 
         # task_id is sufficient but task_name has a DB index
         task_name = getattr(request, 'task', None)
-        if task_name is None and IS_EAGER is False:
+        is_eager = IS_EAGER or getattr(request, 'is_eager', False)
+        if task_name is None and is_eager is False:
             logger.warning('request.task missing', id=request.id)
 
         filter_kwargs = {'task_id': request.id, 'task_name': task_name}
@@ -54,9 +90,11 @@ class TransitionTaskContext:
 
         task_result = TaskResult.objects.filter(**filter_kwargs).first()
 
-        if task_result is None and IS_EAGER:  # hack for eager tasks
+        if task_result is None and is_eager:  # hack for eager tasks
+            # task_name must match the filter above, retries under
+            # apply() reuse the task id and would otherwise create it again
             task_result = TaskResult.objects.create(
-                task_id=request.id,
+                task_id=request.id, task_name=task_name,
                 task_args=json.dumps(request.args),
                 task_kwargs=json.dumps(request.kwargs)
             )
@@ -73,14 +111,21 @@ class TransitionTaskContext:
 
     @classmethod
     def _populate_context(cls, request):
-        transition, task_result_obj = None, None
+        transition, task_result_obj, prev_context = None, None, None
         transition_pk = request.kwargs.get('transition_pk')
+        resolve_kwargs(request.kwargs)  # in place, the task receives the same dict
 
-        if transition_pk:
+        if transition_pk and transition_pk in _handoffs:
+            transition, prev_context = _handoffs.pop(transition_pk)
+            request.fast_path = True
+        elif transition_pk:
             transition = cls.fetch_transition(transition_pk)
+
+        if transition_pk and not SLIM_TRACKING:
+            # slim mode records attempts on the Transition
             task_result_obj = cls.fetch_task_result_object(request)
 
-        if transition is None or task_result_obj is None:
+        if transition is None or (task_result_obj is None and not SLIM_TRACKING):
             logger.warning(
                 'Transition or TaskResult missing', task_id=request.id,
                 transition=transition, task_result_obj=task_result_obj
@@ -89,15 +134,22 @@ class TransitionTaskContext:
 
         request.transition = transition
 
-        cached_existing = None
+        cached_existing, cli, existing, deadline = None, None, None, None
         if request.retries == 0:
             cached_existing = request.kwargs.get('cached_existing')
+        if prev_context is not None:
+            deadline = prev_context.deadline
+            prev_w = prev_context.resource_w
+            if prev_w.has_cli:
+                cli = prev_w.cli
+            existing = prev_w._existing  # its last list response, if any
 
         # additional context object, not to be confused with task.request
         # whose type is: celery.app.task.Context
         request.task_context = cls(
             transition, task_result_obj, request,
-            cached_existing=cached_existing
+            cached_existing=cached_existing, cli=cli, existing=existing,
+            deadline=deadline
         )
 
         return True, request.task_context
@@ -106,6 +158,12 @@ class TransitionTaskContext:
     def t(self):
         return self.transition
 
+    @property
+    def task_started_at(self):
+        if self.task_result_obj is not None:
+            return self.task_result_obj.date_created
+        return self.transition.attempt_started_at
+
     def get_max_retries(self):
         retry_params = self.resource_w.get_retry_params(
             self.transition.type
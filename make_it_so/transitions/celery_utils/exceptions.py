@@ -46,7 +46,8 @@ class BaseTransitionTaskException(Exception):
 class TaskRetryException(BaseTransitionTaskException):
 
     def __init__(
-        self, *args, reason=None, info=None, exhausted_side_effect=None
+        self, *args, reason=None, info=None, exhausted_side_effect=None,
+        retry_after=None
     ):
         # super().__init__() seems to mess with celery, so
         # the constructor is repeated here
@@ -55,6 +56,8 @@ class TaskRetryException(BaseTransitionTaskException):
         self.reason = reason
         self.extra_info = info
         self.exhausted_side_effect = exhausted_side_effect
+        # seconds or a 'not before' datetime, replaces the Resource's countdown
+        self.retry_after = retry_after
 
 
 class TaskFailureException(BaseTransitionTaskException):
@@ -0,0 +1,162 @@
+"""
+    A lease gives one task attempt exclusive execution of a Transition. It's
+    a Redis key holding the attempt's token, set with NX and a short TTL
+    that a heartbeat keeps renewing, so a lost worker's lease soon lapses.
+    A retrying attempt hands the lease over to the task's next attempt, so
+    no other task can take the Transition during the countdown.
+"""
+import os
+import socket
+import threading
+import uuid
+
+import structlog
+
+from transitions.celery_utils.redis_client import get_redis_client, REDIS_ERRORS
+
+
+logger = structlog.get_logger(__name__)
+
+
+LEASE_TTL_MS = 60 * 1000
+HEARTBEAT_INTERVAL = 20  # seconds
+
+# only the holder may renew or release the lease
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+# replaces the token ARGV[1] with ARGV[2], used to hand over and take over
+SWAP_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('set', KEYS[1], ARGV[2], 'PX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+_HOST_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+
+class TransitionLease:
+
+    def __init__(self, transition_pk, task_id, retry_index):
+        self.key = f'lease:transition:{transition_pk}'
+        self.task_id = task_id
+        self.retry_index = retry_index
+        self.token = f'{task_id}|{retry_index}|{_HOST_ID}:{uuid.uuid4().hex[:8]}'
+
+        self.redis_cli = get_redis_client()
+        self.is_held = False
+        self._stop_heartbeat = threading.Event()
+
+    @staticmethod
+    def _get_task_id(token):
+        if token is None:
+            return None
+        if isinstance(token, bytes):
+            token = token.decode()
+        return token.split('|')[0]
+
+    @staticmethod
+    def _get_reserved_token(task_id, retry_index):
+        return f'{task_id}|{retry_index}|reserved'
+
+    def acquire(self):
+        """
+            returns (acquired, holder_task_id). Fails open, i.e. (True, None)
+            with is_held=False, if Redis is unavailable
+        """
+        if self.redis_cli is None:
+            return True, None
+        try:
+            if self.redis_cli.set(self.key, self.token, nx=True, px=LEASE_TTL_MS):
+                self.is_held = True
+                self._start_heartbeat()
+                return True, None
+            holder = self.redis_cli.get(self.key)
+            if holder is not None and self._take_over(holder):
+                return True, None
+        except REDIS_ERRORS as e:
+            logger.warning('lease unavailable, proceeding', exception=str(e))
+            return True, None
+
+        if holder is None:  # released in the meantime
+            return self.acquire()
+        return False, self._get_task_id(holder)
+
+    def _take_over(self, holder):
+        """ takes the lease if the previous attempt reserved it for this one """
+        if isinstance(holder, bytes):
+            holder = holder.decode()
+        reserved = self._get_reserved_token(self.task_id, self.retry_index)
+        if holder != reserved:
+            return False
+        if not self.redis_cli.eval(
+            SWAP_SCRIPT, 1, self.key, reserved, self.token, LEASE_TTL_MS
+        ):
+            return False
+        self.is_held = True
+        self._start_heartbeat()
+        return True
+
+    def get_remaining_ttl(self):
+        try:
+            ttl_ms = self.redis_cli.pttl(self.key)
+        except REDIS_ERRORS:
+            return LEASE_TTL_MS // 1000
+        return max(1, ttl_ms // 1000)
+
+    def _start_heartbeat(self):
+        thread = threading.Thread(target=self._heartbeat, daemon=True)
+        thread.start()
+
+    def _heartbeat(self):
+        while not self._stop_heartbeat.wait(HEARTBEAT_INTERVAL):
+            try:
+                renewed = self.redis_cli.eval(
+                    RENEW_SCRIPT, 1, self.key, self.token, LEASE_TTL_MS
+                )
+            except REDIS_ERRORS as e:
+                logger.warning('lease renewal failed', exception=str(e))
+                continue
+            if not renewed:
+                logger.warning('lease lost', key=self.key, task_id=self.task_id)
+                self.is_held = False
+                return
+
+    def hand_over(self, countdown):
+        """
+            keeps the lease through a retry's countdown, reserved for the
+            next attempt of the same task
+        """
+        self._stop_heartbeat.set()
+        if not self.is_held:
+            return
+        self.is_held = False
+        reserved = self._get_reserved_token(self.task_id, self.retry_index + 1)
+        ttl_ms = int(countdown * 1000) + LEASE_TTL_MS
+        try:
+            self.redis_cli.eval(
+                SWAP_SCRIPT, 1, self.key, self.token, reserved, ttl_ms
+            )
+        except REDIS_ERRORS as e:
+            logger.warning('lease hand over failed', exception=str(e))
+
+    def release(self):
+        self._stop_heartbeat.set()
+        if not self.is_held:
+            return
+        self.is_held = False
+        try:
+            self.redis_cli.eval(RELEASE_SCRIPT, 1, self.key, self.token)
+        except REDIS_ERRORS as e:
+            logger.warning('lease release failed', exception=str(e))
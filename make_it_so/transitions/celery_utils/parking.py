@@ -0,0 +1,93 @@
+"""
+    Parked retries wait in a Redis sorted set scored by their due time,
+    instead of as ETA messages held in worker memory. The signature that
+    celery's retry() would have sent is stored alongside, pump_parked()
+    sends it once it's due.
+"""
+import time
+
+from kombu.utils.json import dumps, loads
+import structlog
+
+from transitions.celery_utils.redis_client import get_redis_client, REDIS_ERRORS
+
+
+logger = structlog.get_logger(__name__)
+
+
+PARKED_KEY = 'transitions:parked'  # zset: task_id -> due timestamp
+SIGNATURES_KEY = 'transitions:parked:signatures'  # hash: task_id -> signature
+
+# a claimed entry reappears after this if it was never sent, e.g. the pump died
+CLAIM_TIMEOUT = 60
+REPARK_DELAY = 10
+
+# pushes due entries forward by the claim timeout and returns them with their signatures
+CLAIM_SCRIPT = """
+local ids = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+local out = {}
+for _, id in ipairs(ids) do
+    redis.call('zadd', KEYS[1], ARGV[1] + ARGV[3], id)
+    out[#out + 1] = id
+    out[#out + 1] = redis.call('hget', KEYS[2], id)
+end
+return out
+"""
+
+# removes a sent entry, unless it was re-parked (with a new signature) since
+DONE_SCRIPT = """
+if redis.call('hget', KEYS[2], ARGV[1]) == ARGV[2] then
+    redis.call('hdel', KEYS[2], ARGV[1])
+    redis.call('zrem', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+def park_signature(sig, countdown):
+    """ returns False if Redis is unavailable, the caller should retry as usual """
+    redis_cli = get_redis_client()
+    if redis_cli is None:
+        return False
+
+    task_id = sig.options['task_id']
+    try:
+        with redis_cli.pipeline() as pipe:
+            pipe.hset(SIGNATURES_KEY, task_id, dumps(dict(sig)))
+            pipe.zadd(PARKED_KEY, {task_id: time.time() + countdown})
+            pipe.execute()
+    except REDIS_ERRORS as e:
+        logger.warning('failed to park retry', task_id=task_id, exception=str(e))
+        return False
+    return True
+
+
+def pump_parked(app, limit=500):
+    redis_cli = get_redis_client()
+    if redis_cli is None:
+        return 0
+
+    claimed = redis_cli.eval(
+        CLAIM_SCRIPT, 2, PARKED_KEY, SIGNATURES_KEY,
+        time.time(), limit, CLAIM_TIMEOUT
+    )
+    num_sent = 0
+    for task_id, sig_str in zip(claimed[::2], claimed[1::2]):
+        if sig_str is None:  # already sent and removed
+            redis_cli.zrem(PARKED_KEY, task_id)
+            continue
+        try:
+            app.signature(loads(sig_str)).apply_async()
+        except Exception as e:
+            logger.warning(
+                'failed to send parked retry', task_id=task_id, exception=str(e)
+            )
+            redis_cli.zadd(PARKED_KEY, {task_id: time.time() + REPARK_DELAY})
+            continue
+
+        redis_cli.eval(
+            DONE_SCRIPT, 2, PARKED_KEY, SIGNATURES_KEY, task_id, sig_str
+        )
+        num_sent += 1
+
+    return num_sent
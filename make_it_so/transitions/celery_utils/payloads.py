@@ -0,0 +1,97 @@
+"""
+    Large task kwargs (e.g. a cached_existing list response) are stored in
+    Redis under their content hash and only a reference is sent with the
+    task message, populate_context() resolves them back in place.
+"""
+import hashlib
+
+from kombu.utils.json import dumps, loads
+import structlog
+
+from transitions.celery_utils.redis_client import get_redis_client, REDIS_ERRORS
+
+
+logger = structlog.get_logger(__name__)
+
+
+PAYLOAD_KWARGS = ('cached_existing', 'previous_retry_event')
+
+REF_KEY = '__payload_ref__'
+INLINE_LIMIT = 4 * 1024  # bytes, smaller payloads stay in the message
+MAX_SIZE = 1024 * 1024  # bytes, larger payloads are dropped
+PAYLOAD_TTL = 24 * 60 * 60  # seconds, refreshed whenever it's re-sent
+
+
+def _payload_key(digest):
+    return f'payload:{digest}'
+
+
+def is_reference(value):
+    return isinstance(value, dict) and set(value) == {REF_KEY}
+
+
+def externalize_kwargs(kwargs):
+    """
+        returns a copy of kwargs with large payloads replaced by references.
+        They're sent inline if Redis is unavailable, both kwargs are only
+        optimizations so oversized ones are dropped
+    """
+    kwargs = dict(kwargs)
+    redis_cli = None
+
+    for name in PAYLOAD_KWARGS:
+        value = kwargs.get(name)
+        if value is None or is_reference(value):
+            continue
+
+        serialized = dumps(value).encode()
+        if len(serialized) <= INLINE_LIMIT:
+            continue
+        if len(serialized) > MAX_SIZE:
+            logger.warning(
+                'dropping oversized task kwarg', kwarg=name, size=len(serialized)
+            )
+            kwargs[name] = None
+            continue
+
+        redis_cli = redis_cli or get_redis_client()
+        if redis_cli is None:
+            continue
+
+        digest = hashlib.sha256(serialized).hexdigest()
+        try:
+            redis_cli.set(_payload_key(digest), serialized, ex=PAYLOAD_TTL)
+        except REDIS_ERRORS as e:
+            logger.warning(
+                'payload not stored, sending inline', kwarg=name, exception=str(e)
+            )
+            continue
+        kwargs[name] = {REF_KEY: digest}
+
+    return kwargs
+
+
+def resolve_kwargs(kwargs):
+    """ resolves references in place, an expired or unreachable payload becomes None """
+    for name in PAYLOAD_KWARGS:
+        value = kwargs.get(name)
+        if is_reference(value):
+            kwargs[name] = _fetch_payload(name, value[REF_KEY])
+    return kwargs
+
+
+def _fetch_payload(name, digest):
+    redis_cli = get_redis_client()
+    if redis_cli is None:
+        logger.warning('payload reference without Redis', kwarg=name)
+        return None
+    try:
+        serialized = redis_cli.get(_payload_key(digest))
+    except REDIS_ERRORS as e:
+        logger.warning('payload unavailable', kwarg=name, exception=str(e))
+        return None
+
+    if serialized is None:
+        logger.warning('payload expired', kwarg=name, digest=digest)
+        return None
+    return loads(serialized)
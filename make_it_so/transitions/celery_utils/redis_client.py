@@ -0,0 +1,23 @@
+from django.conf import settings
+import redis
+import structlog
+
+
+logger = structlog.get_logger(__name__)
+
+
+REDIS_ERRORS = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)
+
+_POOLS = {}
+
+
+def get_redis_client():
+    """ client on a process-wide connection pool, None if REDIS_URL is unset """
+    url = settings.REDIS_URL
+    if not url:
+        return None
+    if url not in _POOLS:
+        _POOLS[url] = redis.ConnectionPool.from_url(
+            url, socket_timeout=5, socket_connect_timeout=2
+        )
+    return redis.Redis(connection_pool=_POOLS[url])
@@ -1,18 +1,28 @@
 import datetime
 import os
+import time
 
+from django.db import transaction as db_transaction
 from django.utils import timezone
-from celery import shared_task, Task
+from celery import shared_task, states, Task
 from celery.contrib import rdb
 from celery.exceptions import SoftTimeLimitExceeded, TimeLimitExceeded
 from celery.exceptions import Ignore as IgnoreException
+from celery.signals import task_postrun
 from celery.worker import state as worker_state
 import structlog
 
+from make_it_so.celery import (
+    app, FAST_PATH, PARKING_THRESHOLD, SLIM_TRACKING, TASK_SERIALIZER
+)
+from resources.models import StateUpdateConflict
 from transitions.celery_utils.context import TransitionTaskContext
 from transitions.celery_utils.exceptions import (
     TaskRetryException, TaskFailureException, RETRY_FOR, THROWS
 )
+from transitions.celery_utils.leases import TransitionLease
+from transitions.celery_utils.parking import park_signature
+from transitions.celery_utils.payloads import externalize_kwargs
 from transitions.celery_utils.request import TransitionRequest
 from transitions.celery_utils.tracing import trace_method
 
@@ -25,17 +35,26 @@ CELERY_POOL_TYPE = os.environ['CELERY_POOL_TYPE']
 
 DEFAULT_TASK_KWARGS = dict(
     bind=True,
-    autoretry_for=RETRY_FOR,
-    throws=tuple(THROWS),
+    # state conflicts are retried, see TransitionTask.retry()
+    autoretry_for=tuple(RETRY_FOR + [StateUpdateConflict]),
+    throws=tuple(THROWS) + (StateUpdateConflict,),
     max_retries=80,  # high upper limit, so this can be decided by the Resource
     default_retry_delay=45,
     soft_time_limit=655,  # limit per retry, not total
     time_limit=660,
+    serializer=TASK_SERIALIZER,
     # retry_backoff=1, retry_backoff_max=90, retry_jitter=False,
 )
 
 task_ready = worker_state.task_ready
 
+# options copied from an eager request's delivery_info, not valid for the broker
+EAGER_DELIVERY_OPTIONS = ('is_eager', 'exchange', 'routing_key', 'priority')
+
+
+def _send_to_broker(sig, countdown):
+    sig.apply_async(countdown=countdown)
+
 
 EXHAUSTED_SIDE_EFFECTS_FOR_TRANSITION = {
     # do we need 'failure' side effects also? to implement this modify on_failure()
@@ -94,15 +113,19 @@ class TransitionTask(Task):
         return self.task_context
 
     def get_task_age(self):
-        if self.tc is None:
+        if self.tc is None or self.tc.task_started_at is None:
             return None
-        started_at = self.tc.task_result_obj.date_created
+        started_at = self.tc.task_started_at
         return (timezone.now() - started_at).seconds
 
     @property
     def retry_index(self):
         return self.request.retries
 
+    @property
+    def is_fast_path(self):
+        return getattr(self.request, 'fast_path', False)
+
     def retry(
         self, args=None, kwargs=None, exc=None, throw=True, eta=None,
         countdown=None, max_retries=None, **options
@@ -110,6 +133,10 @@ class TransitionTask(Task):
         kwargs = kwargs or {}
         kwargs.update(self.request.kwargs)
 
+        if isinstance(exc, StateUpdateConflict):
+            # the next attempt observes the resource again
+            exc = TaskRetryException('state_update_conflict', reason=str(exc))
+
         transition = self.get_transition(self.request, kwargs)
         if transition is None: # or self.tc is None:
             return super().retry(
@@ -128,6 +155,12 @@ class TransitionTask(Task):
                 raise_exc=True, execute_hook=True
             )
 
+        retry_after = getattr(exc, 'retry_after', None)
+        if retry_after is not None:
+            countdown = self.tc.resource_w.bound_retry_after(
+                retry_after, transition.type
+            )
+
         if 'countdown_override' in options:
             # this takes precedence over the Resource's value
             countdown = options.pop('countdown_override')
@@ -135,12 +168,60 @@ class TransitionTask(Task):
         kwargs['previous_retry_event'] = None  # clear out any prev value
         if isinstance(exc, TaskRetryException):
             kwargs['previous_retry_event'] = exc.details_tuple
+        kwargs = externalize_kwargs(kwargs)
+
+        # this attempt is over, the next one takes over its lease (eager
+        # retries run nested inside super().retry())
+        self.hand_over_lease(countdown)
+
+        if self._should_park(countdown):
+            self._retry_out_of_band(
+                park_signature, countdown, exc, args, kwargs, **options
+            )
+        if self.is_fast_path:
+            # chained in-process, retries go back to the broker rather
+            # than running nested (and eagerly) in this worker
+            self._retry_out_of_band(
+                _send_to_broker, countdown, exc, args, kwargs, **options
+            )
 
         return super().retry(
             args=args, kwargs=kwargs, exc=exc, throw=throw, eta=eta,
             countdown=countdown, max_retries=max_retries, **options
         )
 
+    def _should_park(self, countdown):
+        if not PARKING_THRESHOLD:
+            return False
+        if self.request.is_eager and not self.is_fast_path:
+            return False
+        return countdown is not None and countdown >= PARKING_THRESHOLD
+
+    def _retry_out_of_band(
+        self, enqueue, countdown, exc, args, kwargs, **options
+    ):
+        """
+            Hands the retry to enqueue(signature, countdown) instead of
+            celery, then ends this attempt as a retry would. Returns if
+            enqueue() returns False, so the caller can retry as usual.
+        """
+        request = self.request
+        sig = self.signature_from_request(
+            request, args, kwargs, retries=request.retries + 1, **options
+        )
+        if request.is_eager:
+            for key in EAGER_DELIVERY_OPTIONS:
+                sig.options.pop(key, None)
+        if enqueue(sig, countdown) is False:
+            return
+
+        # the tracer only calls on_retry() for celery's Retry exception
+        self.on_retry(exc, request.id, args, kwargs, None)
+        self.backend.mark_as_retry(request.id, exc, request=request)
+        exc = IgnoreException(f'retry scheduled out of band in {countdown}s')
+        exc.reason = 'retry_out_of_band'
+        raise exc
+
     def _notify_retries_exhausted(self, transition, task_kwargs, exc=None):
         if exc is None or isinstance(exc, TaskRetryException) is False:
             return
@@ -200,20 +281,39 @@ class TransitionTask(Task):
         transition = t = self.get_transition(self.request, kwargs)
         is_rescheduled = kwargs.get('rescheduled', False)
 
-        if transition.status == 'in_progress' and is_rescheduled is False:
-            if self.retry_index == 0:
-                # A potential duplicate task was submitted, trigger a delayed retry.
-                # With this concurrent duplicates are still possible but less likely
-                transition.log_event('potential_duplicate_task')
-                return self._force_retry(
-                    'potential_duplicate_task', 90, args, kwargs
-                )
+        if self.tc.deadline is None and not self.request.is_eager:
+            hard_limit = (self.request.timelimit or (None, None))[0]
+            hard_limit = hard_limit or self.time_limit
+            if hard_limit:
+                self.tc.deadline = time.monotonic() + hard_limit
 
         if transition.status in ('succeeded', 'failed'):
             return self.simulate_revoked(
                 f'revoking duplicate task, Transition.status: {t.status}'
             )
 
+        lease = self._acquire_lease(transition, task_id, args, kwargs)
+
+        if transition.status == 'in_progress' and is_rescheduled is False:
+            if self.retry_index == 0 and lease.is_held:
+                if not self._is_redelivery(transition, task_id):
+                    # another task set 'in_progress' and its lease lapsed
+                    self.release_lease()
+                    transition.log_event('duplicate_task_rejected')
+                    return self.simulate_revoked(
+                        'revoking duplicate task, Transition in progress'
+                    )
+                # the lease is free, so whichever attempt set 'in_progress' is gone
+                logger.info('resuming redelivered task', task_id=task_id)
+            elif self.retry_index == 0:
+                # Redis is unavailable: a potential duplicate task was submitted,
+                # trigger a delayed retry. With this concurrent duplicates are
+                # still possible but less likely
+                transition.log_event('potential_duplicate_task')
+                return self._force_retry(
+                    'potential_duplicate_task', 90, args, kwargs
+                )
+
         if kwargs.get('is_duplicate', False) is True:
             del kwargs['is_duplicate']
             logger.info('proceeding with duplicate', task_id=task_id)
@@ -228,9 +328,55 @@ class TransitionTask(Task):
                 retry_index=self.retry_index, rescheduled=is_rescheduled
             )
 
+        if SLIM_TRACKING:
+            # on the first attempt the 'started' event below saves these columns
+            transition.record_attempt(
+                task_id, self.retry_index, commit=self.retry_index > 0
+            )
+
         if self.retry_index == 0:
             transition.log_event('started')
-            transition.celery_tasks.add(self.tc.task_result_obj)
+            if not SLIM_TRACKING:
+                transition.celery_tasks.add(self.tc.task_result_obj)
+
+    @staticmethod
+    def _is_redelivery(transition, task_id):
+        if SLIM_TRACKING:
+            return transition.task_id == task_id
+        return transition.celery_tasks.filter(task_id=task_id).exists()
+
+    def _acquire_lease(self, transition, task_id, args, kwargs):
+        lease = TransitionLease(transition.pk, task_id, self.retry_index)
+        acquired, holder_task_id = lease.acquire()
+        if acquired:
+            self.request.transition_lease = lease
+            return lease
+
+        if holder_task_id == task_id:
+            # an earlier delivery of this same task, its lease lapses
+            # shortly if that worker is gone
+            return self._force_retry(
+                'lease_held', lease.get_remaining_ttl(), args, kwargs
+            )
+
+        transition.log_event(
+            'duplicate_task_rejected', info={'lease_holder': holder_task_id}
+        )
+        return self.simulate_revoked(
+            f'revoking duplicate task, Transition leased by: {holder_task_id}'
+        )
+
+    def hand_over_lease(self, countdown):
+        lease = getattr(self.request, 'transition_lease', None)
+        if lease is not None:
+            lease.hand_over(countdown or 0)
+            self.request.transition_lease = None
+
+    def release_lease(self):
+        lease = getattr(self.request, 'transition_lease', None)
+        if lease is not None:
+            lease.release()
+            self.request.transition_lease = None
 
     def on_retry(self, exc, task_id, args, kwargs, einfo):
 
@@ -257,6 +403,57 @@ class TransitionTask(Task):
 
         transition.log_event('succeeded')
 
+    def create_next_transition(self, transition_type):
+        """
+            creates the resource's next Transition, with FAST_PATH it's
+            also claimed here and run in this worker once this task is done
+        """
+        from transitions.models import TransitionModel
+
+        c = self.task_context
+        if not FAST_PATH:
+            return TransitionModel.create_transition(
+                c.obj, transition_type, prev=c.transition
+            )
+
+        # in one transaction so submit_transition_tasks never sees it pending
+        with db_transaction.atomic():
+            transition = TransitionModel.create_transition(
+                c.obj, transition_type, prev=c.transition
+            )
+            transition.log_event('sent_to_broker', reason='fast_path')
+        self.request.next_transition = transition
+        return transition
+
+    def _run_next_transition(self, next_transition):
+        from transitions.tasks import TASKS_BY_TRANSITION_TYPE
+
+        ResourceClass = next_transition.resource.resource_class
+        time_limit = ResourceClass.get_attempt_time_limit(next_transition.type)
+        deadline = self.tc.deadline
+        if deadline is not None and deadline - time.monotonic() < time_limit:
+            # it would run under this execution's time limit, which may
+            # not leave it enough time
+            next_transition.celery_apply_async(app, claimed=True)
+            return
+
+        task = TASKS_BY_TRANSITION_TYPE[next_transition.type]
+        task_kwargs = {'transition_pk': next_transition.pk}
+        if next_transition.extra_task_kwargs:
+            task_kwargs.update(next_transition.extra_task_kwargs)
+
+        TransitionTaskContext.hand_off(next_transition, self.tc)
+        try:
+            task.apply(kwargs=task_kwargs)
+        except Exception as e:
+            # its own on_failure() has handled the Transition
+            logger.warning(
+                'fast path transition raised', pk=next_transition.pk,
+                exception=str(e)
+            )
+        finally:
+            TransitionTaskContext.discard_handoff(next_transition.pk)
+
     def simulate_failure(
         self, reason=None, raise_exc=True, execute_hook=False,
         request=None, transition=None
@@ -280,6 +477,10 @@ class TransitionTask(Task):
                 None, transition=transition
             )
 
+        # task_failure isn't sent for Ignore, so it can't mark the Transition
+        from transitions.models import ensure_transition_marked_as_failed
+        ensure_transition_marked_as_failed(kwargs=request.kwargs)
+
         if raise_exc:
             raise exc
 
@@ -295,9 +496,10 @@ class TransitionTask(Task):
         self.log_events_for_exception(exc, einfo, transition, failure=True)
 
     def log_events_for_exception(self, exc, einfo, transition, failure=False):
+        # the attempt is over, a state conflict can't be retried from here
 
         if isinstance(exc, (TaskRetryException, TaskFailureException)):
-            self.log_resource_event(
+            self._log_resource_event_after_attempt(
                 exc.event_type, reason=exc.reason, transition=transition,
                 extra_info=exc.extra_info, exc=exc, einfo=einfo
             )
@@ -317,13 +519,24 @@ class TransitionTask(Task):
             if isinstance(exc, TaskFailureException):
                 reason = exc.event_type_and_reason
 
-            self.log_resource_event(
+            self._log_resource_event_after_attempt(
                 'terminal_failure', reason=reason,
                 transition=transition
             )
             if transition.status != 'failed':  # avoid duplicate event
                 transition.log_event('terminal_failure')
 
+    def _log_resource_event_after_attempt(self, event_type, **kwargs):
+        try:
+            self.log_resource_event(event_type, **kwargs)
+        except StateUpdateConflict as e:
+            # the event is recorded, the state is left to whichever
+            # writer moved it since this attempt observed the resource
+            logger.warning(
+                'state update conflict after attempt', type=event_type,
+                exception=str(e), task_id=self.request.id
+            )
+
     def log_resource_event(
         self, event_type, reason=None, extra_info=None, info=None,
         transition=None, t=None, exc=None, einfo=None  # no 'next_state' arg
@@ -339,3 +552,17 @@ class TransitionTask(Task):
             event_type, reason=reason, t=transition,
             extra_info=extra_info, exc=exc, einfo=einfo
         )
+
+
+@task_postrun.connect(weak=False)
+def finish_transition_task(sender=None, task=None, state=None, **kwargs):
+    # after_return() isn't called for retried or ignored tasks, this always is
+    if not isinstance(task, TransitionTask):
+        return
+    task.release_lease()
+
+    # on the fast path the next Transition runs once this task is done
+    next_transition = getattr(task.request, 'next_transition', None)
+    if next_transition is not None and state == states.SUCCESS:
+        task.request.next_transition = None
+        task._run_next_transition(next_transition)
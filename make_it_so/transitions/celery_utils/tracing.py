@@ -18,6 +18,7 @@ from opentelemetry.trace import SpanKind, use_span
 from opentelemetry import trace
 import structlog
 
+from make_it_so.celery import TRACING_ENABLED
 from transitions.celery_utils.context import TransitionTaskContext
 
 
@@ -31,9 +32,10 @@ trace.set_tracer_provider(
 jaeger_exporter = JaegerExporter(
    agent_host_name="localhost", agent_port=6831,
 )
-trace.get_tracer_provider().add_span_processor(
-   BatchSpanProcessor(jaeger_exporter)
-)
+if TRACING_ENABLED:
+    trace.get_tracer_provider().add_span_processor(
+       BatchSpanProcessor(jaeger_exporter)
+    )
 if DEBUG:
     trace.get_tracer_provider().add_span_processor(
         SimpleSpanProcessor(ConsoleSpanExporter())
@@ -112,6 +114,9 @@ def trace_method(func):
 
     def _inner(self, *args, **kwargs):
 
+        if not TRACING_ENABLED:
+            return func(self, *args, **kwargs)
+
         current_span = trace.get_current_span()
         span_name = f'{self.request.id[:-6]}_{self.retry_index}_{func.__name__}'
 
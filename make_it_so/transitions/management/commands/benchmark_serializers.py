@@ -0,0 +1,75 @@
+import time
+
+from django.core.management.base import BaseCommand
+from kombu.serialization import dumps, loads
+import structlog
+
+from make_it_so.serialization import MSGPACK_COMPRESSED
+
+
+logger = structlog.get_logger(__name__)
+
+SERIALIZERS = ['json', 'msgpack', MSGPACK_COMPRESSED]
+
+
+def _list_response(i):
+    name = f'network-{i}'
+    self_link = f'https://www.googleapis.com/compute/v1/projects/fake-project/global/networks/{name}'
+    return {
+        'id': str(1000000000 + i), 'name': name, 'selfLink': self_link,
+        'creationTimestamp': '2022-05-01T10:00:00.000-07:00',
+        'subnetworks': [
+            f'{self_link}/regions/europe-west{r}/subnetworks/{name}'
+            for r in range(25)
+        ]
+    }
+
+
+def _task_body(num_items):
+    """ (args, kwargs, embed) as in a protocol 2 task message """
+    kwargs = {
+        'transition_pk': 123456,
+        'previous_retry_event': [
+            'retry', 'health_check_failed', {'hc_name': 'check_exists'}
+        ]
+    }
+    if num_items:
+        kwargs['cached_existing'] = _list_response(num_items)
+        kwargs['extra'] = [_list_response(i) for i in range(num_items)]
+    embed = {'callbacks': None, 'errbacks': None, 'chain': None, 'chord': None}
+    return [], kwargs, embed
+
+
+class Command(BaseCommand):
+    help = 'reports message sizes and encode/decode throughput per task serializer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=5000)
+        parser.add_argument(
+            '--items', type=int, nargs='+', default=[0, 10, 200],
+            help='number of list responses carried by each message'
+        )
+
+    def handle(self, *args, **kwargs):
+        iterations = kwargs['iterations']
+
+        print(f'{"items":>6} {"serializer":>20} {"bytes":>9} {"enc/s":>10} {"dec/s":>10}')
+        for num_items in kwargs['items']:
+            body = _task_body(num_items)
+            for name in SERIALIZERS:
+                content_type, encoding, data = dumps(body, serializer=name)
+
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    dumps(body, serializer=name)
+                encode_rate = iterations / (time.perf_counter() - start)
+
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    loads(data, content_type, encoding, accept=[content_type])
+                decode_rate = iterations / (time.perf_counter() - start)
+
+                print(
+                    f'{num_items:>6} {name:>20} {len(data):>9} '
+                    f'{encode_rate:>10.0f} {decode_rate:>10.0f}'
+                )
@@ -0,0 +1,38 @@
+# Generated by Django 4.0.3 on 2026-10-19 07:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transitions', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transitionmodel',
+            name='attempt_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='transitionmodel',
+            name='attempt_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transitionmodel',
+            name='last_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transitionmodel',
+            name='last_outcome',
+            field=models.CharField(blank=True, choices=[('started', 'started'), ('retrying', 'retrying'), ('succeeded', 'succeeded'), ('failed', 'failed')], max_length=16, null=True),
+        ),
+        migrations.AddField(
+            model_name='transitionmodel',
+            name='task_id',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
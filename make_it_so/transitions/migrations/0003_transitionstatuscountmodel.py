@@ -0,0 +1,29 @@
+# Generated by Django 4.0.3 on 2026-10-19 07:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_usermodel_username'),
+        ('transitions', '0002_transitionmodel_attempt_count_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransitionStatusCountModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('type', models.CharField(max_length=64)),
+                ('status', models.CharField(max_length=64)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='users.projectmodel')),
+            ],
+            options={
+                'unique_together': {('project', 'type', 'status')},
+            },
+        ),
+    ]
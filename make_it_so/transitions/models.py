@@ -1,19 +1,22 @@
-from ast import literal_eval
 import os
 import uuid
 
 from django.db import models, transaction
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.db.models import Count
+from django.utils import timezone
 from django_celery_results.models import TaskResult
 from celery.contrib import rdb
+from celery.signals import task_failure
 from opentelemetry import trace
 from structlog import getLogger
 
-from base_classes.models import BaseModel
-from make_it_so.celery import IS_EAGER
+from base_classes.models import BaseModel, BaseCountModel
+from make_it_so.celery import IS_EAGER, SLIM_TRACKING
 from transitions.celery_utils.exceptions import ensure_extra_info_is_serializable
-from transitions.types import TransitionTypeEnum, TransitionStatusEnum
+from transitions.celery_utils.payloads import externalize_kwargs
+from transitions.types import (
+    TransitionTypeEnum, TransitionStatusEnum, AttemptOutcomeEnum
+)
 
 
 logger = getLogger(__name__)
@@ -29,6 +32,18 @@ EVENT_STATUS_SIDE_EFFECTS = {
     'terminal_failure': 'failed'
 }
 
+EVENT_ATTEMPT_OUTCOMES = {  # slim tracking only
+    'started': AttemptOutcomeEnum.started,
+    'retrying': AttemptOutcomeEnum.retrying,
+    'succeeded': AttemptOutcomeEnum.succeeded,
+    'terminal_failure': AttemptOutcomeEnum.failed
+}
+
+ATTEMPT_FIELDS = [
+    'task_id', 'attempt_count', 'attempt_started_at',
+    'last_attempt_at', 'last_outcome'
+]
+
 
 class TransitionModel(BaseModel):
 
@@ -58,6 +73,18 @@ class TransitionModel(BaseModel):
     # ideally this would be a FK on TaskResult, but it can't be customized
     celery_tasks = models.ManyToManyField(TaskResult, blank=True)
 
+    # slim tracking: attempts are recorded here instead of on TaskResult
+    task_id = models.CharField(max_length=255, blank=True, null=True)
+    attempt_count = models.PositiveIntegerField(default=0)
+    attempt_started_at = models.DateTimeField(  # first attempt of task_id
+        blank=True, null=True
+    )
+    last_attempt_at = models.DateTimeField(blank=True, null=True)
+    last_outcome = models.CharField(
+        max_length=16, choices=AttemptOutcomeEnum.choices(),
+        blank=True, null=True
+    )
+
     @classmethod
     def create_transition(
         cls, resource_model, type, status='pending', prev=None
@@ -72,6 +99,9 @@ class TransitionModel(BaseModel):
             defaults={'previous_transition': prev}
         )
         if created:
+            TransitionStatusCountModel.move(
+                None, status, project_id=project.id, type=type
+            )
             rtype_short = resource_model.rtype.split('.')[-1]
             logger.info(
                 f'new Transition: {type} on {rtype_short}', pk=obj.pk
@@ -88,6 +118,8 @@ class TransitionModel(BaseModel):
 
     @property
     def task_started_at(self):
+        if self.attempt_started_at:
+            return self.attempt_started_at
         latest_task = self.celery_tasks.all().order_by('date_created').last()
         if latest_task is None:
             return None
@@ -105,6 +137,17 @@ class TransitionModel(BaseModel):
             query = query.exclude(pk__in=exclude)
         return query
 
+    def record_attempt(self, task_id, retry_index, commit=True):
+        now = timezone.now()
+        if task_id != self.task_id:  # retries keep the same task_id
+            self.task_id = task_id
+            self.attempt_started_at = now
+        self.attempt_count = retry_index + 1
+        self.last_attempt_at = now
+        self.last_outcome = AttemptOutcomeEnum.started
+        if commit:
+            self.save(update_fields=ATTEMPT_FIELDS + ['updated'])
+
     def log_event(
         self, event_type, reason=None, info=None, extra_info=None
     ):
@@ -130,10 +173,22 @@ class TransitionModel(BaseModel):
         if next_status == self.status:
             next_status = None
 
+        outcome_changed = False
+        if SLIM_TRACKING and event_type in EVENT_ATTEMPT_OUTCOMES:
+            self.last_outcome = EVENT_ATTEMPT_OUTCOMES[event_type]
+            outcome_changed = True
+
         if next_status:
+            prev_status = self.status
             self.status = next_status
             self.status_cause = event
             self.save()
+            TransitionStatusCountModel.move(
+                prev_status, next_status,
+                project_id=self.resource.project_id, type=self.type
+            )
+        elif outcome_changed:
+            self.save(update_fields=ATTEMPT_FIELDS + ['updated'])
 
     def _print_event(self, event_type, reason=None, extra_info=None):
         msg = f'[TRANSITION-EVENT: {event_type}] on: Transition {self.pk}'
@@ -149,10 +204,14 @@ class TransitionModel(BaseModel):
 
         log_func(**log_kwargs)
 
-    def celery_apply_async(self, app):
+    def celery_apply_async(self, app, task_kwargs=None, claimed=False):
+        """
+            task_kwargs are sent along with the Transition's own, claimed=True
+            if a batch task already logged 'sent_to_broker' for it
+        """
         from transitions.tasks import TASK_SIGNATURES_BY_TRANSITION_TYPE
 
-        if self.status != 'pending' and IS_EAGER is False:
+        if self.status != 'pending' and IS_EAGER is False and not claimed:
             logger.warning(
                 'executing task Transition that is not pending',
                 pk=self.pk, status=self.status
@@ -163,9 +222,10 @@ class TransitionModel(BaseModel):
         task_signature = app.signature(
             TASK_SIGNATURES_BY_TRANSITION_TYPE[type_key]
         )
-        task_kwargs = {'transition_pk': self.pk}
+        task_kwargs = {'transition_pk': self.pk, **(task_kwargs or {})}
         if self.extra_task_kwargs:
             task_kwargs.update(self.extra_task_kwargs)
+        task_kwargs = externalize_kwargs(task_kwargs)
 
         ResourceClass = self.resource.resource_class
         assert ResourceClass is not None
@@ -179,7 +239,8 @@ class TransitionModel(BaseModel):
         if 'time_limit' in time_params:
             apply_kwargs['time_limit'] = time_params['time_limit']
 
-        self.log_event('sent_to_broker')
+        if not claimed:
+            self.log_event('sent_to_broker')
 
         return task_signature.apply_async(**apply_kwargs)
 
@@ -187,6 +248,35 @@ class TransitionModel(BaseModel):
         return f'TransitionModel: {self.pk}'
 
 
+class TransitionStatusCountModel(BaseCountModel):
+    """ number of TransitionModels per (project, type, status) """
+
+    KEY_FIELDS = ('project_id', 'type')
+    COUNTED_FIELD = 'status'
+
+    project = models.ForeignKey(
+        'users.ProjectModel', on_delete=models.CASCADE
+    )
+    type = models.CharField(max_length=64)
+    status = models.CharField(max_length=64)
+
+    class Meta:
+        unique_together = ('project', 'type', 'status')
+
+    def __str__(self):
+        return f'{self.type}.{self.status}: {self.count}'
+
+    @classmethod
+    def reconcile(cls):
+        actual_counts = {
+            (di['resource__project_id'], di['type'], di['status']): di['num']
+            for di in TransitionModel.objects.values(
+                'resource__project_id', 'type', 'status'
+            ).annotate(num=Count('id'))
+        }
+        return cls.rebuild(actual_counts)
+
+
 class TransitionEventModel(BaseModel):
 
     type = models.CharField(
@@ -209,42 +299,70 @@ class TransitionEventModel(BaseModel):
         return f'"{self.type}" event on: {self.transition}'
 
 
-@receiver(post_save, sender=TaskResult)
-def ensure_transition_marked_as_failed(sender, instance: TaskResult, **kwargs):
+@task_failure.connect(weak=False)
+def ensure_transition_marked_as_failed(
+    sender=None, task_id=None, kwargs=None, **other
+):
     """
         Exceptions raised by internally by TransitionTask sometimes fail to
         trigger on_failure(), this signal ensures Transitions are marked as 'failed'
 
-        # note: another option is to use celery's task_failure_notifier
+        # note: this is sent once per failed task, in the worker, so it stays off
+        # the result-backend write path. reconcile_failed_transitions() periodically
+        # sweeps up any failures it misses (e.g. if the worker is lost)
     """
-    if kwargs['created'] or instance.status != 'FAILURE':
+    transition_pk = (kwargs or {}).get('transition_pk')
+    if transition_pk is None:  # not a Transition task
         return
 
-    transition = _fetch_transition_for_taskresult(instance)
-    if transition and transition.status != 'failed':
+    transition = TransitionModel.objects.filter(
+        pk=transition_pk).exclude(status='failed').first()
+    if transition:
         transition.log_event('terminal_failure')
 
 
-def _fetch_transition_for_taskresult(task_result):
+def claim_pending_transitions(query, limit=500, reason=None):
+    """
+        marks up to limit of query's pending Transitions as 'sent_to_broker'
+        and returns them. Rows locked by a concurrent claim are skipped, so
+        each Transition is claimed (and sent) once
+    """
+    with transaction.atomic():
+        transitions = list(
+            query.filter(status='pending').select_related(
+                'resource', 'resource__project'
+            ).select_for_update(skip_locked=True, of=('self',))[:limit]
+        )
+        for t in transitions:
+            t.log_event('sent_to_broker', reason=reason)
+    return transitions
 
-    transition_pk = None
 
-    if task_result.task_kwargs:
-        try:
-            task_kwargs = literal_eval(task_result.task_kwargs.strip('"'))
-            transition_pk = task_kwargs.get('transition_pk')
-        except (Exception, SyntaxError):
-            logger.info('failed to parse task_kwargs', pk=task_result.pk)
+def get_unmarked_failed_transitions(since, limit=500):
+    """ Transitions whose TaskResult failed but were never marked 'failed' """
+    return TransitionModel.objects.filter(
+        celery_tasks__status='FAILURE', celery_tasks__date_done__gte=since
+    ).exclude(status='failed').distinct()[:limit]
 
-    if transition_pk:
-        transition = TransitionModel.objects.filter(pk=transition_pk).first()
-    else:
-        transition = TransitionModel.objects.filter(
-            celery_tasks__in=[task_result]
-        ).first()
 
-    if transition is None:
-        logger.warning(
-            'failed to fetch Transition', task_result=task_result.id
-        )
-    return transition
+def get_stalled_fast_path_transitions(claimed_before):
+    """
+        Transitions claimed by the fast path before claimed_before whose
+        task never started, e.g. the worker was lost before it ran them
+    """
+    return TransitionModel.objects.filter(
+        status='sent_to_broker', status_cause__type='sent_to_broker',
+        status_cause__reason='fast_path',
+        status_cause__created__lt=claimed_before
+    )
+
+
+def get_abandoned_transitions(started_before, limit=500):
+    """
+        slim mode: Transitions whose latest attempt started before
+        started_before and never recorded an outcome, e.g. the worker was lost
+    """
+    return TransitionModel.objects.filter(
+        status='in_progress', last_outcome=AttemptOutcomeEnum.started,
+        last_attempt_at__lt=started_before
+    )[:limit]
@@ -0,0 +1,169 @@
+"""
+    Batch variants of ensure_exists and ensure_deleted, sent by
+    submit_transition_tasks for large groups. They claim the pending
+    Transitions of one (project, rtype), find which resources exist with a
+    single list request and create/delete the rest in bulk. Each
+    Transition's own task is then sent with its list response (so it skips
+    the list) and the outcome recorded in its checkpoint (so it skips the
+    request), it does the polling, hooks and events as usual.
+
+    Checkpoints only reach tasks in other workers through Redis, without it
+    the batch only does the list request.
+"""
+from celery import shared_task
+import structlog
+
+from make_it_so.celery import app
+from transitions.celery_utils.checkpoints import (
+    get_checkpoint_store, record_checkpoint
+)
+from transitions.celery_utils.payloads import externalize_kwargs, is_reference
+from transitions.models import TransitionModel, claim_pending_transitions
+
+
+logger = structlog.get_logger(__name__)
+
+
+BATCH_SIZE = 100
+# smaller groups are sent individually by submit_transition_tasks
+BATCH_MIN_SIZE = 20
+
+BATCH_TASK_NAMES_BY_TRANSITION_TYPE = {
+    'ensure_exists': 'transitions.tasks.batch_tasks.ensure_exists_batch',
+    'ensure_deleted': 'transitions.tasks.batch_tasks.ensure_deleted_batch',
+}
+
+
+@shared_task(bind=True)
+def ensure_exists_batch(self, project_pk, rtype):
+    return _run_batch(project_pk, rtype, 'ensure_exists', _create_missing)
+
+
+@shared_task(bind=True)
+def ensure_deleted_batch(self, project_pk, rtype):
+    return _run_batch(project_pk, rtype, 'ensure_deleted', _delete_existing)
+
+
+def _run_batch(project_pk, rtype, transition_type, bulk_step):
+    query = TransitionModel.objects.filter(
+        type=transition_type, resource__project_id=project_pk,
+        resource__rtype=rtype
+    )
+    transitions = claim_pending_transitions(
+        query, limit=BATCH_SIZE, reason='batch'
+    )
+    if not transitions:
+        return 0
+
+    if not get_checkpoint_store().is_shared:
+        # the tasks wouldn't see the outcome and would repeat the request
+        bulk_step = get_cached_existing
+
+    cached_by_pk = {}
+    try:
+        cached_by_pk = bulk_step(transitions)
+    except Exception as e:
+        # the tasks do each step themselves
+        logger.warning(
+            'batch step failed', type=transition_type, rtype=rtype,
+            exception=str(e)
+        )
+
+    cached_by_pk = share_cached_existing(cached_by_pk)
+    for t in transitions:
+        task_kwargs = {}
+        if t.pk in cached_by_pk:
+            task_kwargs['cached_existing'] = cached_by_pk[t.pk]
+        t.celery_apply_async(app, task_kwargs=task_kwargs, claimed=True)
+
+    return len(transitions)
+
+
+def _get_resource_wrappers(transitions):
+    first = transitions[0].resource
+    ResourceClass = first.resource_class
+    cli = ResourceClass.create_cli(first.rtype, first.project)
+    resource_ws = [ResourceClass(t.resource, t, cli=cli) for t in transitions]
+    return ResourceClass, cli, resource_ws
+
+
+def get_cached_existing(transitions):
+    """ {Transition pk: cached_existing} for Transitions of one (project, rtype) """
+    return _check_existence(transitions)[-1]
+
+
+def share_cached_existing(cached_by_pk):
+    """
+        the group's entries merged back into one list response, stored once
+        so every task message carries the same reference. If it isn't
+        stored (small, oversized or no Redis) each keeps its own entry
+    """
+    merged = {}
+    for existing in cached_by_pk.values():
+        merged.update(existing)
+    shared = externalize_kwargs({'cached_existing': merged})['cached_existing']
+    if not is_reference(shared):
+        return cached_by_pk
+    return {pk: shared for pk in cached_by_pk}
+
+
+def _check_existence(transitions):
+    """ returns the wrappers and each Transition's cached_existing """
+    ResourceClass, cli, resource_ws = _get_resource_wrappers(transitions)
+    project = transitions[0].resource.project
+    existing = ResourceClass.check_exists_many(cli, project, resource_ws)
+
+    cached_by_pk = {}
+    for t, w in zip(transitions, resource_ws):
+        resp = existing[w.model_obj.pk]
+        id = ResourceClass.IDENTIFIER.fetch_id(w.model_obj)
+        cached_by_pk[t.pk] = {id: resp} if resp is not None else {}
+    return ResourceClass, cli, resource_ws, cached_by_pk
+
+
+def _create_missing(transitions):
+    ResourceClass, cli, resource_ws, cached_by_pk = _check_existence(transitions)
+
+    missing = [
+        (t, w) for (t, w) in zip(transitions, resource_ws)
+        if not cached_by_pk[t.pk]
+    ]
+    for t, w in missing:
+        w.model_obj.log_event('creating', t=t)
+    _run_bulk_request(
+        ResourceClass.create_resources, cli, missing, 'attempt_creation'
+    )
+    return cached_by_pk
+
+
+def _delete_existing(transitions):
+    ResourceClass, cli, resource_ws, cached_by_pk = _check_existence(transitions)
+
+    present = [
+        (t, w) for (t, w) in zip(transitions, resource_ws)
+        if cached_by_pk[t.pk]
+    ]
+    for t, w in present:
+        w.model_obj.log_event('deleting', t=t)
+    _run_bulk_request(
+        ResourceClass.delete_resources, cli, present, 'attempt_deletion'
+    )
+    return cached_by_pk
+
+
+def _run_bulk_request(bulk_method, cli, pairs, checkpoint_name):
+    """
+        checkpoints each result as it completes. If the bulk request fails
+        partway the list response is still sent, the Transitions without a
+        checkpoint make the request themselves
+    """
+    def on_result(i, result):
+        t, w = pairs[i]
+        record_checkpoint(t, w, checkpoint_name, result)
+
+    try:
+        bulk_method(cli, [w for (_, w) in pairs], on_result=on_result)
+    except Exception as e:
+        logger.warning(
+            'bulk request failed', checkpoint=checkpoint_name, exception=str(e)
+        )
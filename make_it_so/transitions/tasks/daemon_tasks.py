@@ -1,10 +1,31 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+import datetime
+import functools
+
 from celery import shared_task
 from celery.contrib import rdb
+from django.db import connections, transaction
+from django.utils import timezone
+import gevent
+from gevent import monkey
 import structlog
 
-from make_it_so.celery import app
-from resources.models import ResourceModel
-from transitions.models import TransitionModel
+from make_it_so.celery import app, SLIM_TRACKING
+from resources.base_resource import _run_in_greenlet
+from resources.models import (
+    ResourceModel, ResourceStateCountModel, ResourceTimingModel
+)
+from transitions.celery_utils.parking import pump_parked
+from transitions.models import (
+    TransitionEventModel, TransitionModel, TransitionStatusCountModel,
+    claim_pending_transitions, get_abandoned_transitions,
+    get_stalled_fast_path_transitions, get_unmarked_failed_transitions
+)
+from transitions.tasks.batch_tasks import (
+    BATCH_MIN_SIZE, BATCH_TASK_NAMES_BY_TRANSITION_TYPE, get_cached_existing,
+    share_cached_existing
+)
 
 
 logger = structlog.get_logger(__name__)
@@ -50,8 +71,204 @@ def _create_missing_transitions(desired_state):
             )
 
 
+# their first existence check can use a list response fetched here
+PRELISTED_TRANSITION_TYPES = ('ensure_exists', 'ensure_deleted')
+
+# seconds for all of a run's list requests, groups still listing after
+# this are sent without cached_existing
+PRELIST_TIMEOUT = 5
+PRELIST_THREADS = 8  # used where gevent isn't patched in
+
+
 @shared_task(bind=True)
 def submit_transition_tasks(self):
-    transitions = TransitionModel.objects.filter(status='pending')[:500]
+    pending = TransitionModel.objects.filter(status='pending').values_list(
+        'pk', 'type', 'resource__project_id', 'resource__rtype'
+    )[:500]
+
+    sizes = defaultdict(int)
+    for (pk, type, project_id, rtype) in pending:
+        if type in PRELISTED_TRANSITION_TYPES:
+            sizes[(project_id, rtype, type)] += 1
+
+    # large groups go to a batch task, it claims the Transitions itself
+    batched_keys = set()
+    for (project_id, rtype, type), size in sizes.items():
+        if size < BATCH_MIN_SIZE:
+            continue
+        app.signature(
+            BATCH_TASK_NAMES_BY_TRANSITION_TYPE[type],
+            kwargs={'project_pk': project_id, 'rtype': rtype}
+        ).apply_async()
+        batched_keys.add((project_id, rtype, type))
+
+    # claimed before any list request, an overlapping run skips them
+    transitions = claim_pending_transitions(TransitionModel.objects.filter(
+        pk__in=[
+            pk for (pk, type, project_id, rtype) in pending
+            if (project_id, rtype, type) not in batched_keys
+        ]
+    ))
+
+    groups = defaultdict(list)
+    for t in transitions:
+        if t.type in PRELISTED_TRANSITION_TYPES:
+            groups[(t.resource.project_id, t.resource.rtype)].append(t)
+    cached_by_pk = _prelist(groups)
+
     for t in transitions:
-        t.celery_apply_async(app)
+        task_kwargs = None
+        if t.pk in cached_by_pk:
+            task_kwargs = {'cached_existing': cached_by_pk[t.pk]}
+        t.celery_apply_async(app, task_kwargs=task_kwargs, claimed=True)
+
+
+def _prelist(groups):
+    """ one list request per (project, rtype), concurrently and within PRELIST_TIMEOUT """
+    if monkey.is_module_patched('socket'):
+        results = _prelist_in_greenlets(groups)
+    else:  # e.g. prefork, a greenlet blocked on I/O couldn't be timed out
+        results = _prelist_in_threads(groups)
+
+    cached_by_pk = {}
+    for (project_id, rtype), (value, exception) in results.items():
+        if exception is None:
+            cached_by_pk.update(share_cached_existing(value))
+            continue
+        logger.warning(
+            'failed to pre-list resources', rtype=rtype, exception=exception
+        )
+    return cached_by_pk
+
+
+def _prelist_in_greenlets(groups):
+    greenlets = {
+        key: gevent.spawn(
+            _run_in_greenlet, functools.partial(get_cached_existing, group)
+        )
+        for key, group in groups.items()
+    }
+    try:
+        gevent.joinall(list(greenlets.values()), timeout=PRELIST_TIMEOUT)
+    finally:
+        # a killed greenlet is ready() too, read the finished ones first
+        finished = {key: g for key, g in greenlets.items() if g.ready()}
+        gevent.killall(list(greenlets.values()))
+
+    results = {}
+    for key, greenlet in greenlets.items():
+        if key not in finished:
+            results[key] = (None, 'timeout')
+        elif greenlet.successful():
+            results[key] = (greenlet.value, None)
+        else:
+            results[key] = (None, str(greenlet.exception))
+    return results
+
+
+def _prelist_in_threads(groups):
+    if not groups:
+        return {}
+    executor = ThreadPoolExecutor(max_workers=min(len(groups), PRELIST_THREADS))
+    futures = {
+        key: executor.submit(_run_in_thread, get_cached_existing, group)
+        for key, group in groups.items()
+    }
+    # threads can't be killed, those still listing finish in the background
+    done, _ = wait(futures.values(), timeout=PRELIST_TIMEOUT)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    results = {}
+    for key, future in futures.items():
+        if future not in done:
+            results[key] = (None, 'timeout')
+        elif future.exception() is None:
+            results[key] = (future.result(), None)
+        else:
+            results[key] = (None, str(future.exception()))
+    return results
+
+
+def _run_in_thread(func, *args):
+    try:
+        return func(*args)
+    finally:
+        connections.close_all()  # each thread has its own DB connections
+
+
+RECONCILE_FAILURES_WINDOW = datetime.timedelta(hours=2)
+
+# an attempt with no outcome this long after it started has outlived
+# the task time limits, so its worker is gone
+ABANDONED_ATTEMPT_AGE = datetime.timedelta(hours=2)
+
+
+@shared_task(bind=True)
+def reconcile_failed_transitions(self):
+    if SLIM_TRACKING:
+        # no TaskResults to sweep, look for attempts that never finished
+        started_before = timezone.now() - ABANDONED_ATTEMPT_AGE
+        for transition in get_abandoned_transitions(started_before):
+            logger.info('marking abandoned Transition as failed', pk=transition.pk)
+            transition.log_event('terminal_failure', reason='attempt_abandoned')
+        return True
+
+    since = timezone.now() - RECONCILE_FAILURES_WINDOW
+    for transition in get_unmarked_failed_transitions(since):
+        logger.info('marking Transition as failed', pk=transition.pk)
+        transition.log_event('terminal_failure', reason='failure_reconciled')
+
+    return True
+
+
+# the fast path runs a claimed Transition within seconds, or sends it
+FAST_PATH_STALL_AGE = datetime.timedelta(minutes=10)
+
+
+@shared_task(bind=True)
+def resend_stalled_transitions(self):
+    claimed_before = timezone.now() - FAST_PATH_STALL_AGE
+    with transaction.atomic():
+        transitions = list(
+            get_stalled_fast_path_transitions(claimed_before).select_related(
+                'resource', 'resource__project'
+            ).select_for_update(skip_locked=True, of=('self',))[:500]
+        )
+        for transition in transitions:
+            # a new cause, so the next run doesn't pick it up again
+            transition.status_cause = TransitionEventModel.objects.create(
+                type='sent_to_broker', reason='fast_path_resent',
+                transition=transition
+            )
+            transition.save(update_fields=['status_cause', 'updated'])
+
+    for transition in transitions:
+        logger.info('resending stalled Transition', pk=transition.pk)
+        transition.celery_apply_async(app, claimed=True)
+    return True
+
+
+@shared_task(bind=True)
+def reconcile_state_counts(self):
+    # the counts are updated incrementally, this corrects drift from
+    # writes that bypass log_event() e.g. deletions and bulk updates
+    num_fixed = ResourceStateCountModel.reconcile()
+    num_fixed += TransitionStatusCountModel.reconcile()
+    if num_fixed:
+        logger.info('corrected state counts', num_fixed=num_fixed)
+    return True
+
+
+@shared_task(bind=True)
+def pump_parked_transitions(self):
+    num_sent = pump_parked(app)
+    if num_sent:
+        logger.info('sent parked retries', num_sent=num_sent)
+    return True
+
+
+@shared_task(bind=True)
+def update_resource_timings(self):
+    num_keys = ResourceTimingModel.rebuild()
+    logger.info('updated resource timings', num_keys=num_keys)
+    return True
@@ -6,14 +6,14 @@ import structlog
 
 from transitions.celery_utils.exceptions import TaskRetryException
 from transitions.celery_utils.task_class import TransitionTask
-from transitions.celery_utils import Memorize
+from transitions.celery_utils.checkpoints import checkpoint
 
 
 logger = structlog.get_logger(__name__)
 
 
-@Memorize(cache_keys=["transition_pk"])
-def checkpoint__attempt_deletion(self, transition_pk, resource_w):
+@checkpoint('attempt_deletion')
+def checkpoint__attempt_deletion(self, resource_w):
     self.log_resource_event('deleting')
     success, response = resource_w.delete_resource()
     return success, response
@@ -33,7 +33,7 @@ def ensure_deleted(self, transition_pk, **kwargs):
         c.resource_w.deleted_hook()
         return True
 
-    succ, resp = checkpoint__attempt_deletion(self, c.t.pk, c.resource_w)
+    succ, resp = checkpoint__attempt_deletion(self, c.resource_w)
     if succ is False:
         raise TaskRetryException(
             'deletion_request_failed', info={'resp': resp}
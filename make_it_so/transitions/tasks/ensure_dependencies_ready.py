@@ -7,7 +7,6 @@ from transitions.celery_utils.task_class import TransitionTask
 from transitions.celery_utils.exceptions import (
     TaskRetryException, TaskFailureException
 )
-from transitions.models import TransitionModel
 
 
 logger = structlog.get_logger(__name__)
@@ -25,32 +24,43 @@ def _done(self, dependencies):
         logger.warning('no dependencies found but HAS_DEPENDENCIES=True')
 
     self.log_resource_event('dependencies_ready')
-    TransitionModel.create_transition(
-        c.obj, 'ensure_exists', prev=c.transition
-    )
+    self.create_next_transition('ensure_exists')
     return True
 
 
+def _has_failed(dep):
+    return dep.state == 'creation_failed' or dep.state_cause_type == 'terminal_failure'
+
+
 @shared_task(**TransitionTask.get_task_kwargs())
 def ensure_dependencies_ready(self, transition_pk, **kwargs):
     c = self.task_context
 
-    dependencies = c.obj.get_dependencies()
+    # the whole upstream subgraph, so a failure further up fails
+    # this Transition now rather than once it reaches the direct dependency
+    closure = c.obj.get_dependency_closure()
+    dependencies = [dep for dep in closure if dep.depth == 1]
 
     if len(dependencies) == 0:
         return _done(self, dependencies)
 
     ready_state = 'healthy'  # todo: make this field-specific, configured on ResourceClass
 
-    for field_name, dep in dependencies.items():
+    for dep in closure:
+        if dep.state in VALID_STATES[ready_state]:
+            continue  # recovered from any earlier failure
+        if _has_failed(dep):
+            info = {
+                'dependency': dep.id, 'dependency_state': dep.state,
+                'depth': dep.depth
+            }
+            raise TaskFailureException('dependency_failed', info=info)
+
+    for dep in dependencies:
         if dep.state in VALID_STATES[ready_state]:
             continue
         info = {'dependency': dep.id, 'dependency_state': dep.state}
 
-        cause_event_type = dep.state_cause.type if dep.state_cause else None
-        if dep.state == 'creation_failed' or cause_event_type == 'terminal_failure':
-            raise TaskFailureException('dependency_failed', info=info)
-
         logger.info('dependency not ready', state=dep.state)
         raise TaskRetryException(
             'dependencies_pending', reason='not_ready', info=info
@@ -6,16 +6,15 @@ import structlog
 
 from transitions.celery_utils.exceptions import TaskRetryException, TaskFailureException
 from transitions.celery_utils.task_class import TransitionTask
-from transitions.celery_utils import Memorize
-from transitions.models import TransitionModel
+from transitions.celery_utils.checkpoints import checkpoint
 
 
 logger = structlog.get_logger(__name__)
 
 
 
-@Memorize(cache_keys=["transition_pk"])
-def checkpoint__attempt_creation(self, transition_pk, resource_w):
+@checkpoint('attempt_creation')
+def checkpoint__attempt_creation(self, resource_w):
     self.log_resource_event('creating')
     success, response = resource_w.create_resource()
     return success, response
@@ -26,9 +25,7 @@ def _done(self, reason, list_resp):
     self.log_resource_event('resource_found', reason)
     c.resource_w.exists_hook_base(list_response=list_resp)
     c.resource_w.exists_hook(list_response=list_resp)
-    TransitionModel.create_transition(
-        c.obj, 'ensure_healthy', prev=c.transition
-    )
+    self.create_next_transition('ensure_healthy')
     return True
 
 
@@ -42,9 +39,7 @@ def ensure_exists(self, transition_pk, **kwargs):
     if exists:
         return _done(self, 'found_before_creation', list_resp)
 
-    succ, resp = checkpoint__attempt_creation(
-        self, c.t.pk, c.resource_w
-    )
+    succ, resp = checkpoint__attempt_creation(self, c.resource_w)
     if succ is False:
         raise TaskRetryException(
             'creation_request_failed', info={'resp': resp}
@@ -7,7 +7,6 @@ from transitions.celery_utils.task_class import TransitionTask
 from transitions.celery_utils.exceptions import (
     TaskRetryException, TaskFailureException
 )
-from transitions.models import TransitionModel
 
 
 logger = structlog.get_logger(__name__)
@@ -19,36 +18,44 @@ VALID_STATES = {
 
 
 def _done(self):
-    c = self.task_context
-
     self.log_resource_event('forward_dependencies_absent')
-    TransitionModel.create_transition(
-        c.obj, 'ensure_deleted', prev=c.transition
-    )
+    self.create_next_transition('ensure_deleted')
     return True
 
 
+def _deletion_terminated(dep):
+    return dep.state == 'deletion_terminated' or dep.state_cause_type == 'terminal_failure'
+
+
 @shared_task(**TransitionTask.get_task_kwargs())
 def ensure_forward_dependencies_deleted(self, transition_pk, **kwargs):
     c = self.task_context
 
-    fw_dependencies = c.obj.get_forward_dependencies()
+    # every transitive dependent must be gone, not only the direct ones
+    fw_dependencies = [
+        dep for dep in c.obj.get_forward_dependency_closure()
+        if dep.state != 'deleted'
+    ]
 
     if len(fw_dependencies) == 0:
         return _done(self)
 
     for dep in fw_dependencies:
-        if dep.state == 'deleted':
-            continue
-        info = {'dependency': dep.id, 'dependency_state': dep.state}
-
-        cause_event_type = dep.state_cause.type if dep.state_cause else None
-        if dep.state == 'deletion_terminated' or cause_event_type == 'terminal_failure':
+        if _deletion_terminated(dep):
+            info = {
+                'dependency': dep.id, 'dependency_state': dep.state,
+                'depth': dep.depth
+            }
             raise TaskFailureException(
                 'deletion_terminated', info=info
             )
-        raise TaskRetryException(
-            'dependency_deletion_pending', reason='not_ready', info=info
-        )
 
-    return _done(self)
+    dep = fw_dependencies[0]
+    info = {
+        'dependency': dep.id, 'dependency_state': dep.state,
+        'num_pending': len(fw_dependencies),
+        'max_depth': max(d.depth for d in fw_dependencies)
+    }
+    raise TaskRetryException(
+        'dependency_deletion_pending', reason='not_ready', info=info
+    )
@@ -1,8 +1,12 @@
+import hashlib
+import json
+
 from celery.contrib import rdb
 from celery import shared_task, Task
 from opentelemetry import trace
 import structlog
 
+from transitions.celery_utils.checkpoints import get_checkpoint_store
 from transitions.celery_utils.exceptions import TaskRetryException, TaskFailureException
 from transitions.celery_utils.task_class import TransitionTask
 
@@ -10,6 +14,44 @@ from transitions.celery_utils.task_class import TransitionTask
 logger = structlog.get_logger(__name__)
 
 
+# checks can regress (e.g. an instance becomes unhealthy), only those
+# decorated with health_check_success_ttl() have their passes cached
+DEFAULT_HC_SUCCESS_TTL = 0
+
+
+def _get_success_ttl(hc):
+    return getattr(hc, 'success_ttl', DEFAULT_HC_SUCCESS_TTL)
+
+
+def _hc_key_prefix(c):
+    # a state change bumps the version and a hook may rewrite extra_data,
+    # either invalidates earlier passes
+    extra_data = json.dumps(c.obj.extra_data, sort_keys=True, default=str)
+    digest = hashlib.sha1(extra_data.encode()).hexdigest()[:12]
+    return f'ckpt:{c.transition.pk}:hc:v{c.obj.version}:{digest}'
+
+
+def _get_cached_passes(c, health_checks):
+    store = get_checkpoint_store()
+    prefix = _hc_key_prefix(c)
+    return {
+        hc.__name__ for hc in health_checks
+        if _get_success_ttl(hc) != 0 and store.get(f'{prefix}:{hc.__name__}')[0]
+    }
+
+
+def _cache_passes(c, health_checks, results):
+    ttls = {hc.__name__: _get_success_ttl(hc) for hc in health_checks}
+    store = get_checkpoint_store()
+    prefix = _hc_key_prefix(c)
+    for hc_name, (succ, _, _) in results:
+        ttl = ttls[hc_name]
+        if ttl is None:
+            ttl = c.resource_w.get_transition_lifetime(c.transition.type)
+        if succ and ttl:
+            store.set(f'{prefix}:{hc_name}', True, ttl)
+
+
 def _done(self):
     c = self.task_context
     self.log_resource_event('health_checks_succeeded')
@@ -17,12 +59,13 @@ def _done(self):
     return True
 
 
-def _hc_failed(hc_name):
+def _hc_failed(hc_name, retry_after=None):
     raise TaskRetryException(
         'health_check_failed', info={'hc_name': hc_name},
-        exhausted_side_effect='health_checks_terminated'
+        exhausted_side_effect='health_checks_terminated',
         # note: this side effect is not set on the transition level to
         # keep more control over the termination signal
+        retry_after=retry_after
     )
 
 
@@ -49,15 +92,23 @@ def ensure_healthy(self, transition_pk, **kwargs):
         c.resource_w.exists_hook_base(list_response=list_resp)
         c.resource_w.exists_hook(list_response=list_resp)
 
-    for healthcheck_method in health_checks:
-        # note: successes aren't cached, could use @Memorize on expensive HCs
-        hc_name = healthcheck_method.__name__
-        succ, is_final = healthcheck_method()
-        if succ is False:
-            if is_final:
-                raise TaskFailureException(
-                    'health_checks_terminated', info={'hc_name': hc_name}
-                )
-            return _hc_failed(hc_name)
+    # checks that passed on an earlier attempt aren't re-run
+    cached_passes = _get_cached_passes(c, health_checks)
+    results = c.resource_w.run_health_checks(skip=cached_passes)
+    _cache_passes(c, health_checks, results)
+
+    failed = [
+        (hc_name, is_final, retry_after) for hc_name, (succ, is_final, retry_after)
+        in results if succ is False
+    ]
+    if failed:
+        hc_name, is_final, _ = failed[0]
+        if is_final:
+            raise TaskFailureException(
+                'health_checks_terminated', info={'hc_name': hc_name}
+            )
+        # retry when the time-gated checks can pass, if every failure is one
+        hints = [retry_after for (_, _, retry_after) in failed]
+        return _hc_failed(hc_name, None if None in hints else max(hints))
 
     return _done(self)
@@ -1,3 +1,1384 @@
-from django.test import TestCase
+"""
+    Tests for the transition tasks, executed eagerly against an in-memory
+    fake of the GCP API client.
 
-# Create your tests here.
+    TransitionTaskBudgetTests captures each task's SQL and compares it
+    against the budgets in task_budgets.json. If a change legitimately
+    alters a task's query count, update the budget file in the same
+    commit. The other classes cover one feature each.
+"""
+import datetime
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from celery import Task
+from celery.canvas import Signature
+from celery.exceptions import Retry
+from celery.signals import task_prerun, task_success
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_celery_results.models import TaskResult
+import fakeredis
+from kombu.serialization import dumps, loads
+
+from gcp_resources.api_client import GcpApiListResponse
+from gcp_resources.resources.base_resource import GcpProvider
+from gcp_resources.resources.subnets import GcpSubnetResource
+from gcp_resources.resources.vpc_networks import GcpVpcNetworkResource
+from gcp_resources.types import REGIONS
+from make_it_so.celery import CELERY_POOL_TYPE, app
+from make_it_so.serialization import MSGPACK_COMPRESSED
+from resources import warm_up_resource_classes
+from resources.base_resource import health_check_success_ttl
+from resources.models import (
+    ChildResourceModel, ResourceModel, ResourceDependencyModel,
+    ResourceEventModel, ResourceStateCountModel, StateUpdateConflict
+)
+from resources.types import ResourceStateEnum
+from transitions.celery_utils.checkpoints import (
+    CheckpointStore, get_checkpoint_store
+)
+from transitions.celery_utils.context import TransitionTaskContext
+from transitions.celery_utils.exceptions import (
+    TaskFailureException, TaskRetryException
+)
+from transitions.celery_utils.leases import LEASE_TTL_MS, TransitionLease
+from transitions.celery_utils.parking import (
+    CLAIM_SCRIPT, CLAIM_TIMEOUT, PARKED_KEY, SIGNATURES_KEY, park_signature
+)
+from transitions.celery_utils.payloads import (
+    externalize_kwargs, is_reference, resolve_kwargs, INLINE_LIMIT, MAX_SIZE
+)
+from transitions.celery_utils.task_class import TransitionTask
+from transitions.models import (
+    TransitionModel, TransitionEventModel, TransitionStatusCountModel
+)
+from transitions.tasks import TASKS_BY_TRANSITION_TYPE
+from transitions.tasks.ensure_healthy import _cache_passes, _get_cached_passes
+from transitions.types import TransitionStatusEnum, TransitionTypeEnum
+from transitions.tasks.batch_tasks import BATCH_MIN_SIZE, ensure_exists_batch
+from transitions.tasks.daemon_tasks import (
+    create_missing_transitions, pump_parked_transitions,
+    reconcile_failed_transitions, resend_stalled_transitions,
+    submit_transition_tasks
+)
+from users.models import AccountModel, ProjectModel
+
+
+BUDGETS_FILEPATH = os.path.join(os.path.dirname(__file__), 'task_budgets.json')
+
+NETWORK_RTYPE = 'gcp_resources.GcpVpcNetworkResource'
+FIREWALL_RTYPE = 'gcp_resources.GcpFirewallResource'
+SUBNET_RTYPE = 'gcp_resources.GcpSubnetResource'
+
+GCP_URL = 'https://www.googleapis.com/compute/v1/projects'
+SUBNET_REGIONS = sorted(set(REGIONS))[:25]
+
+
+def _load_budgets():
+    with open(BUDGETS_FILEPATH) as f:
+        return json.loads(f.read())
+
+
+def _network_link(project_slug, name):
+    return f'{GCP_URL}/{project_slug}/global/networks/{name}'
+
+
+def _firewall_link(project_slug, name):
+    return f'{GCP_URL}/{project_slug}/global/firewalls/{name}'
+
+
+class FakeGcpApiClient:
+    """ in-memory stand-in for GcpApiClient, clients share a single store """
+
+    def __init__(self, store):
+        self.store = store
+
+    def list_networks(self, gcp_project_id):
+        return [GcpApiListResponse(di) for di in self.store['networks'].values()]
+
+    def create_vpc_network(
+        self, gcp_project_id, name, routing_mode=None, mtu=1460,
+        auto_create_subnetworks=True
+    ):
+        network_di = self.add_network(gcp_project_id, name)
+        response = {
+            'id': network_di['id'], 'targetLink': network_di['selfLink'],
+            'status': 'RUNNING'
+        }
+        return True, network_di['selfLink'], response
+
+    def delete_network(self, gcp_project_id, network_name):
+        self.store['networks'].pop(network_name, None)
+        return {'status': 'RUNNING'}
+
+    def list_firewalls(self, gcp_project_id):
+        return [GcpApiListResponse(di) for di in self.store['firewalls'].values()]
+
+    def delete_firewall(self, project_id, name):
+        self.store['firewalls'].pop(name, None)
+        return {'status': 'RUNNING'}
+
+    def add_network(self, gcp_project_id, name):
+        self_link = _network_link(gcp_project_id, name)
+        self.store['networks'][name] = network_di = {
+            'id': str(abs(hash(self_link))), 'name': name, 'selfLink': self_link,
+            'subnetworks': [
+                f'{GCP_URL}/{gcp_project_id}/regions/{region}/subnetworks/{name}'
+                for region in SUBNET_REGIONS
+            ]
+        }
+        return network_di
+
+    def add_firewall(self, gcp_project_id, name):
+        self_link = _firewall_link(gcp_project_id, name)
+        self.store['firewalls'][name] = firewall_di = {
+            'id': str(abs(hash(self_link))), 'name': name, 'selfLink': self_link
+        }
+        return firewall_di
+
+
+# Redis isn't available here, checkpoints are only cached in-process
+@override_settings(REDIS_URL=None)
+class TransitionTaskTestCase(TestCase):
+
+    def setUp(self):
+        self.store = {'networks': {}, 'firewalls': {}}
+        self.cli = FakeGcpApiClient(self.store)
+
+        patchers = [
+            mock.patch.object(
+                GcpProvider, 'create_cli', return_value=self.cli
+            ),
+            mock.patch('gevent.sleep'),
+        ]
+        self.create_cli, _ = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        # pks are reused between tests, don't carry checkpoints over
+        get_checkpoint_store().clear_local()
+
+        account = AccountModel.objects.create(name='test', slug='test')
+        self.project = ProjectModel.objects.create(
+            slug='fake-project', account=account, provider_type='google'
+        )
+        self._seed_counts()
+
+    def _seed_counts(self):
+        # in steady state every count row exists, the budgets assume this
+        ResourceStateCountModel.objects.bulk_create([
+            ResourceStateCountModel(project=self.project, rtype=rtype, state=state)
+            for rtype in (NETWORK_RTYPE, FIREWALL_RTYPE, SUBNET_RTYPE)
+            for state in ResourceStateEnum
+        ])
+        TransitionStatusCountModel.objects.bulk_create([
+            TransitionStatusCountModel(
+                project=self.project, type=type, status=status
+            )
+            for type in TransitionTypeEnum for status in TransitionStatusEnum
+        ])
+
+    def _create_network(self, slug, **kwargs):
+        return ResourceModel.objects.create(
+            slug=slug, rtype=NETWORK_RTYPE, project=self.project,
+            extra_data={'self_link': _network_link(self.project.slug, slug)},
+            **kwargs
+        )
+
+    def _set_state_cause(self, resource_model, event_type):
+        resource_model.state_cause = ResourceEventModel.objects.create(
+            type=event_type, resource=resource_model,
+            state_decision=resource_model.state
+        )
+        resource_model.save()
+        return resource_model
+
+    def _create_firewall(self, slug, network, **kwargs):
+        firewall = ResourceModel.objects.create(
+            slug=slug, rtype=FIREWALL_RTYPE, project=self.project,
+            extra_data={
+                'self_link': _firewall_link(self.project.slug, slug),
+                'network': network, 'priority': 1000, 'direction': 'INGRESS'
+            },
+            **kwargs
+        )
+        ResourceDependencyModel.objects.create(
+            resource=firewall, depends_on=network, field_name='network'
+        )
+        return firewall
+
+    def _create_sent_transition(self, resource_model, transition_type):
+        transition = TransitionModel.create_transition(
+            resource_model, transition_type
+        )
+        transition.log_event('sent_to_broker')
+        return transition
+
+    def _apply_transition(self, transition):
+        TASKS_BY_TRANSITION_TYPE[transition.type].apply(
+            kwargs={'transition_pk': transition.pk}
+        )
+        transition.refresh_from_db()
+        return transition
+
+
+class TransitionTaskBudgetTests(TransitionTaskTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.budgets = _load_budgets()
+
+    def _run_task(self, name, task, **task_kwargs):
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            result = task.apply(kwargs=task_kwargs)
+            duration = time.perf_counter() - start
+
+        self._assert_within_budget(name, ctx, duration)
+        return result
+
+    def _run_transition(self, name, transition):
+        task = TASKS_BY_TRANSITION_TYPE[transition.type]
+        result = self._run_task(name, task, transition_pk=transition.pk)
+        transition.refresh_from_db()
+        return result, transition
+
+    def _assert_within_budget(self, name, ctx, duration):
+        budget = self.budgets[name]
+        num_queries = len(ctx.captured_queries)
+        if num_queries > budget['queries']:
+            queries = '\n'.join(q['sql'] for q in ctx.captured_queries)
+            self.fail(
+                f'{name}: {num_queries} queries exceeds the budget of '
+                f'{budget["queries"]}, executed:\n{queries}'
+            )
+        self.assertLessEqual(
+            duration, budget['seconds'],
+            f'{name}: took {duration:.3f}s, budget is {budget["seconds"]}s'
+        )
+
+    def test_ensure_dependencies_ready(self):
+        networks = [
+            self._set_state_cause(
+                self._create_network(f'network-{i}', state='healthy'),
+                'resource_found_and_healthy'
+            )
+            for i in range(3)
+        ]
+        firewall = self._create_firewall('allow-ssh', networks[0])
+        for i, network in enumerate(networks[1:]):
+            ResourceDependencyModel.objects.create(
+                resource=firewall, depends_on=network, field_name=f'extra_{i}'
+            )
+        transition = self._create_sent_transition(
+            firewall, 'ensure_dependencies_ready'
+        )
+
+        _, transition = self._run_transition('ensure_dependencies_ready', transition)
+
+        self.assertEqual(transition.status, 'succeeded')
+        # DB-only transition, no provider client is created
+        self.create_cli.assert_not_called()
+        self.assertTrue(
+            TransitionModel.objects.filter(
+                resource=firewall, type='ensure_exists', status='pending'
+            ).exists()
+        )
+
+    def test_ensure_dependencies_ready__dependency_failed(self):
+        network = self._create_network('test-network', state='healthy')
+        failed_network = self._set_state_cause(
+            self._create_network('failed-network', state='creation_failed'),
+            'terminal_failure'
+        )
+        firewall = self._create_firewall('allow-ssh', network)
+        ResourceDependencyModel.objects.create(
+            resource=firewall, depends_on=failed_network, field_name='extra'
+        )
+        transition = self._create_sent_transition(
+            firewall, 'ensure_dependencies_ready'
+        )
+
+        _, transition = self._run_transition(
+            'ensure_dependencies_ready__dependency_failed', transition
+        )
+        self.assertEqual(transition.status, 'failed')
+
+    def test_ensure_dependencies_ready__ancestor_failed(self):
+        failed_network = self._set_state_cause(
+            self._create_network('failed-network', state='creation_failed'),
+            'terminal_failure'
+        )
+        network = self._create_network('test-network', state='healthy')
+        ResourceDependencyModel.objects.create(
+            resource=network, depends_on=failed_network, field_name='extra'
+        )
+        firewall = self._create_firewall('allow-ssh', network)
+        transition = self._create_sent_transition(
+            firewall, 'ensure_dependencies_ready'
+        )
+
+        _, transition = self._run_transition(
+            'ensure_dependencies_ready__ancestor_failed', transition
+        )
+        self.assertEqual(transition.status, 'failed')
+
+    def test_ensure_exists(self):
+        network = self._create_network('test-network', state='declared')
+        transition = self._create_sent_transition(network, 'ensure_exists')
+
+        _, transition = self._run_transition('ensure_exists', transition)
+
+        self.assertEqual(transition.status, 'succeeded')
+        self.assertIn('test-network', self.store['networks'])
+        network.refresh_from_db()
+        self.assertEqual(network.state, 'exists')
+
+    def test_ensure_exists__fast_path(self):
+        network = self._create_network('test-network', state='declared')
+        self.cli.add_network(self.project.slug, 'test-network')
+        transition = self._create_sent_transition(network, 'ensure_exists')
+
+        with mock.patch('transitions.celery_utils.task_class.FAST_PATH', True):
+            _, transition = self._run_transition(
+                'ensure_exists__fast_path', transition
+            )
+
+        # ensure_healthy ran in the same execution, its history is recorded
+        self.assertEqual(transition.status, 'succeeded')
+        next_transition = TransitionModel.objects.get(
+            resource=network, type='ensure_healthy'
+        )
+        self.assertEqual(next_transition.status, 'succeeded')
+        self.assertEqual(next_transition.previous_transition, transition)
+        network.refresh_from_db()
+        self.assertEqual(network.state, 'healthy')
+
+    def test_ensure_healthy(self):
+        network = self._create_network('test-network', state='exists')
+        network_di = self.cli.add_network(self.project.slug, 'test-network')
+        network.extra_data['self_id'] = network_di['id']
+        network.save()
+        # declared already, healthy_hook() records the others as children
+        subnet_link = network_di['subnetworks'][0]
+        region = GcpSubnetResource.get_region_from_self_link(subnet_link)
+        existing_subnet = ResourceModel.objects.create(
+            slug=f'test-network-subnet_{region}', rtype=SUBNET_RTYPE,
+            project=self.project, state='exists', extra_data={
+                'network': network, 'self_link': subnet_link, 'region': region
+            }
+        )
+        transition = self._create_sent_transition(network, 'ensure_healthy')
+
+        with mock.patch.object(
+            self.cli, 'list_networks', wraps=self.cli.list_networks
+        ) as list_networks:
+            _, transition = self._run_transition('ensure_healthy', transition)
+
+        self.assertEqual(transition.status, 'succeeded')
+        # health checks and healthy_hook() share one list request
+        self.assertEqual(list_networks.call_count, 1)
+        network.refresh_from_db()
+        self.assertEqual(network.state, 'healthy')
+
+        self.assertEqual(
+            ResourceModel.objects.filter(rtype=SUBNET_RTYPE).count(), 1
+        )
+        children = ChildResourceModel.objects.filter(parent=network)
+        self.assertEqual(children.count(), len(network_di['subnetworks']) - 1)
+        existing_subnet.refresh_from_db()
+        self.assertEqual(existing_subnet.state, 'healthy')
+        self.assertEqual(existing_subnet.version, 1)
+        self.assertEqual(
+            existing_subnet.state_cause.type, 'resource_found_and_healthy'
+        )
+        self.assertEqual(ResourceStateCountModel.reconcile(), 0)
+
+    def test_ensure_forward_dependencies_deleted(self):
+        network = self._create_network(
+            'test-network', state='healthy', desired_state='deleted'
+        )
+        for i in range(3):
+            self._create_firewall(f'firewall-{i}', network, state='deleted')
+        transition = self._create_sent_transition(
+            network, 'ensure_forward_dependencies_deleted'
+        )
+
+        _, transition = self._run_transition(
+            'ensure_forward_dependencies_deleted', transition
+        )
+
+        self.assertEqual(transition.status, 'succeeded')
+        self.assertTrue(
+            TransitionModel.objects.filter(
+                resource=network, type='ensure_deleted', status='pending'
+            ).exists()
+        )
+
+    def test_ensure_deleted(self):
+        network = self._create_network('test-network', state='deleted')
+        firewall = self._create_firewall(
+            'allow-ssh', network, state='healthy', desired_state='deleted'
+        )
+        self.cli.add_firewall(self.project.slug, 'allow-ssh')
+        transition = self._create_sent_transition(firewall, 'ensure_deleted')
+
+        _, transition = self._run_transition('ensure_deleted', transition)
+
+        self.assertEqual(transition.status, 'succeeded')
+        self.assertNotIn('allow-ssh', self.store['firewalls'])
+        firewall.refresh_from_db()
+        self.assertEqual(firewall.state, 'deleted')
+
+    def test_create_missing_transitions(self):
+        for i in range(5):
+            network = self._create_network(
+                f'network-{i}', state='declared', desired_state='healthy'
+            )
+            self._create_firewall(
+                f'firewall-{i}', network, state='declared',
+                desired_state='healthy'
+            )
+
+        self._run_task('create_missing_transitions', create_missing_transitions)
+
+        self.assertEqual(
+            TransitionModel.objects.filter(status='pending').count(), 10
+        )
+
+    def test_ensure_exists_batch(self):
+        networks = [
+            self._create_network(f'network-{i}', state='declared')
+            for i in range(5)
+        ]
+        self.cli.add_network(self.project.slug, 'network-0')
+        for network in networks:
+            TransitionModel.create_transition(network, 'ensure_exists')
+
+        with mock.patch.object(Signature, 'apply_async') as apply_async, \
+                mock.patch.object(CheckpointStore, 'is_shared', True), \
+                mock.patch.object(
+                    self.cli, 'list_networks', wraps=self.cli.list_networks
+                ) as list_networks, \
+                mock.patch.object(
+                    self.cli, 'create_vpc_network',
+                    wraps=self.cli.create_vpc_network
+                ) as create_vpc_network:
+            self._run_task(
+                'ensure_exists_batch', ensure_exists_batch,
+                project_pk=self.project.pk, rtype=NETWORK_RTYPE
+            )
+
+        # one list request and only the missing ones were created
+        self.assertEqual(list_networks.call_count, 1)
+        self.assertEqual(create_vpc_network.call_count, 4)
+        self.assertEqual(apply_async.call_count, 5)
+
+        # each Transition's task skips the creation request
+        with mock.patch.object(self.cli, 'create_vpc_network') as create_vpc_network:
+            for call in apply_async.call_args_list:
+                TASKS_BY_TRANSITION_TYPE['ensure_exists'].apply(
+                    kwargs=call.kwargs['kwargs']
+                )
+        create_vpc_network.assert_not_called()
+        transitions = TransitionModel.objects.filter(type='ensure_exists')
+        self.assertEqual({t.status for t in transitions}, {'succeeded'})
+
+    def test_submit_transition_tasks(self):
+        for i in range(10):
+            network = self._create_network(f'network-{i}', state='declared')
+            TransitionModel.create_transition(network, 'ensure_exists')
+        network_di = self.cli.add_network(self.project.slug, 'network-0')
+
+        with mock.patch.object(Signature, 'apply_async') as apply_async, \
+                mock.patch.object(
+                    self.cli, 'list_networks', wraps=self.cli.list_networks
+                ) as list_networks:
+            self._run_task('submit_transition_tasks', submit_transition_tasks)
+
+        self.assertEqual(apply_async.call_count, 10)
+        # listed once for the group, each task gets its own entry
+        self.assertEqual(list_networks.call_count, 1)
+        cached = [
+            call.kwargs['kwargs']['cached_existing']
+            for call in apply_async.call_args_list
+        ]
+        self.assertIn({network_di['selfLink']: network_di}, cached)
+        self.assertEqual(cached.count({}), 9)
+        self.assertEqual(
+            TransitionModel.objects.filter(status='sent_to_broker').count(), 10
+        )
+
+
+class DependencyReadinessTests(TransitionTaskTestCase):
+
+    def test_ensure_dependencies_ready__ancestor_recovered(self):
+        # healthy again after a failed transition, that failure is still its cause
+        recovered_network = self._set_state_cause(
+            self._create_network('recovered-network', state='healthy'),
+            'terminal_failure'
+        )
+        network = self._set_state_cause(
+            self._create_network('test-network', state='healthy'),
+            'resource_found_and_healthy'
+        )
+        ResourceDependencyModel.objects.create(
+            resource=network, depends_on=recovered_network, field_name='extra'
+        )
+        firewall = self._create_firewall('allow-ssh', network)
+        transition = self._create_sent_transition(
+            firewall, 'ensure_dependencies_ready'
+        )
+
+        transition = self._apply_transition(transition)
+        self.assertEqual(transition.status, 'succeeded')
+
+
+class CheckpointTests(TransitionTaskTestCase):
+
+    def test_ensure_exists__checkpoint_skips_repeated_creation(self):
+        network = self._create_network('test-network', state='declared')
+        transition = self._create_sent_transition(network, 'ensure_exists')
+
+        # the creation request succeeds but the network never appears
+        self_link = _network_link(self.project.slug, 'test-network')
+        create_response = (
+            True, self_link,
+            {'id': '123', 'targetLink': self_link, 'status': 'RUNNING'}
+        )
+        with mock.patch.object(
+            self.cli, 'create_vpc_network', return_value=create_response
+        ) as create_vpc_network:
+            TASKS_BY_TRANSITION_TYPE['ensure_exists'].apply(
+                kwargs={'transition_pk': transition.pk}
+            )
+
+        self.assertEqual(create_vpc_network.call_count, 1)
+        transition.refresh_from_db()
+        self.assertEqual(transition.status, 'failed')
+
+
+class StateCountTests(TransitionTaskTestCase):
+
+    def test_ensure_exists__state_counts(self):
+        network = self._create_network('test-network', state='declared')
+        transition = self._create_sent_transition(network, 'ensure_exists')
+        self._apply_transition(transition)
+
+        counts = ResourceStateCountModel.objects.get(
+            project=self.project, rtype=NETWORK_RTYPE, state='exists'
+        )
+        self.assertEqual(counts.count, 1)
+        # incremental updates agree with a full recount
+        self.assertEqual(ResourceStateCountModel.reconcile(), 0)
+        self.assertEqual(TransitionStatusCountModel.reconcile(), 0)
+
+
+class FastPathTests(TransitionTaskTestCase):
+
+    def test_ensure_exists__fast_path_near_time_limit(self):
+        network = self._create_network('test-network', state='declared')
+        self.cli.add_network(self.project.slug, 'test-network')
+        transition = self._create_sent_transition(network, 'ensure_exists')
+
+        populate_context = TransitionTaskContext.populate_context
+
+        def populate_context_at_deadline(request):
+            # the execution's time limit has already run out
+            succ, tc = populate_context(request)
+            tc.deadline = time.monotonic()
+            return succ, tc
+
+        with mock.patch('transitions.celery_utils.task_class.FAST_PATH', True), \
+                mock.patch.object(
+                    TransitionTaskContext, 'populate_context',
+                    populate_context_at_deadline
+                ), \
+                mock.patch.object(Signature, 'apply_async') as apply_async:
+            TASKS_BY_TRANSITION_TYPE['ensure_exists'].apply(
+                kwargs={'transition_pk': transition.pk}
+            )
+
+        # sent to the broker rather than run under this execution's limit
+        self.assertEqual(apply_async.call_count, 1)
+        next_transition = TransitionModel.objects.get(
+            resource=network, type='ensure_healthy'
+        )
+        self.assertEqual(next_transition.status, 'sent_to_broker')
+
+    def test_ensure_exists__fast_path_after_postrun(self):
+        network = self._create_network('test-network', state='declared')
+        self.cli.add_network(self.project.slug, 'test-network')
+        transition = self._create_sent_transition(network, 'ensure_exists')
+        calls = []
+
+        def on_prerun(sender=None, **kwargs):
+            calls.append(('prerun', sender.name.split('.')[-1]))
+
+        def on_success(sender=None, **kwargs):
+            calls.append(('success', sender.name.split('.')[-1]))
+
+        task_prerun.connect(on_prerun)
+        task_success.connect(on_success)
+        self.addCleanup(task_prerun.disconnect, on_prerun)
+        self.addCleanup(task_success.disconnect, on_success)
+
+        with mock.patch('transitions.celery_utils.task_class.FAST_PATH', True), \
+                mock.patch.object(
+                    self.cli, 'list_networks', wraps=self.cli.list_networks
+                ) as list_networks:
+            transition = self._apply_transition(transition)
+
+        # ensure_healthy started once ensure_exists was done
+        self.assertEqual(calls, [
+            ('prerun', 'ensure_exists'), ('success', 'ensure_exists'),
+            ('prerun', 'ensure_healthy'), ('success', 'ensure_healthy'),
+        ])
+        # and its checks used ensure_exists' list response
+        self.assertEqual(list_networks.call_count, 1)
+        next_transition = TransitionModel.objects.get(
+            resource=network, type='ensure_healthy'
+        )
+        self.assertEqual(next_transition.status, 'succeeded')
+
+    def test_resend_stalled_transitions(self):
+        network = self._create_network('test-network', state='exists')
+        transition = TransitionModel.create_transition(network, 'ensure_healthy')
+        # claimed by the fast path, the worker was lost before it ran it
+        transition.log_event('sent_to_broker', reason='fast_path')
+        TransitionEventModel.objects.filter(transition=transition).update(
+            created=timezone.now() - datetime.timedelta(minutes=15)
+        )
+
+        with mock.patch.object(Signature, 'apply_async') as apply_async:
+            resend_stalled_transitions.apply()
+            resend_stalled_transitions.apply()
+
+        self.assertEqual(apply_async.call_count, 1)
+        transition.refresh_from_db()
+        self.assertEqual(transition.status, 'sent_to_broker')
+        self.assertEqual(transition.status_cause.reason, 'fast_path_resent')
+
+
+class HealthCheckCacheTests(TransitionTaskTestCase):
+
+    def test_ensure_healthy__cached_passes(self):
+        network = self._create_network('test-network', state='exists')
+        network_di = self.cli.add_network(self.project.slug, 'test-network')
+        subnetworks = network_di.pop('subnetworks')
+        network.extra_data['self_id'] = network_di['id']
+        network.save()
+        transition = self._create_sent_transition(network, 'ensure_healthy')
+
+        def list_networks(gcp_project_id):
+            # the subnetworks only appear after the first attempt listed them
+            responses = FakeGcpApiClient.list_networks(self.cli, gcp_project_id)
+            network_di['subnetworks'] = subnetworks
+            return responses
+
+        calls = []
+
+        @health_check_success_ttl(None)
+        def health_check__ensure_age_over_90s(resource_w):
+            calls.append(resource_w.t.pk)
+            return True, None
+
+        with mock.patch.object(self.cli, 'list_networks', list_networks), \
+                mock.patch.object(
+                    GcpVpcNetworkResource, 'health_check__ensure_age_over_90s',
+                    health_check__ensure_age_over_90s
+                ):
+            TASKS_BY_TRANSITION_TYPE['ensure_healthy'].apply(
+                kwargs={'transition_pk': transition.pk}
+            )
+
+        transition.refresh_from_db()
+        self.assertEqual(transition.status, 'succeeded')
+        # passed on the first attempt, the retry didn't re-run it
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(
+            TransitionEventModel.objects.filter(
+                transition=transition, type='retrying'
+            ).exists()
+        )
+
+    def test_ensure_healthy__cached_pass_invalidated_by_extra_data(self):
+        network = self._create_network('test-network', state='exists')
+        transition = self._create_sent_transition(network, 'ensure_healthy')
+        c = SimpleNamespace(
+            obj=network, transition=transition, resource_w=GcpVpcNetworkResource
+        )
+        check = GcpVpcNetworkResource.health_check__ensure_age_over_90s
+
+        _cache_passes(
+            c, [check], [(check.__name__, (True, None, None))]
+        )
+        self.assertEqual(_get_cached_passes(c, [check]), {check.__name__})
+
+        # e.g. exists_hook() recorded a new self_id
+        network.extra_data['self_id'] = '123'
+        self.assertEqual(_get_cached_passes(c, [check]), set())
+
+    def test_ensure_healthy__undecorated_pass_not_cached(self):
+        network = self._create_network('test-network', state='exists')
+        transition = self._create_sent_transition(network, 'ensure_healthy')
+        c = SimpleNamespace(
+            obj=network, transition=transition, resource_w=GcpVpcNetworkResource
+        )
+
+        def health_check__instance_running(resource_w):
+            return True, None
+
+        # it could regress, so later attempts run it again
+        check = health_check__instance_running
+        _cache_passes(c, [check], [(check.__name__, (True, None, None))])
+        self.assertEqual(_get_cached_passes(c, [check]), set())
+
+
+class BatchTaskTests(TransitionTaskTestCase):
+
+    def test_ensure_exists_batch__checkpoints_not_shared(self):
+        networks = [
+            self._create_network(f'network-{i}', state='declared')
+            for i in range(5)
+        ]
+        for network in networks:
+            TransitionModel.create_transition(network, 'ensure_exists')
+
+        with mock.patch.object(Signature, 'apply_async') as apply_async, \
+                mock.patch.object(CheckpointStore, 'is_shared', False), \
+                mock.patch.object(
+                    self.cli, 'create_vpc_network'
+                ) as create_vpc_network:
+            ensure_exists_batch.apply(kwargs={
+                'project_pk': self.project.pk, 'rtype': NETWORK_RTYPE
+            })
+            # a second batch finds nothing left to claim
+            ensure_exists_batch.apply(kwargs={
+                'project_pk': self.project.pk, 'rtype': NETWORK_RTYPE
+            })
+
+        # tasks in other workers wouldn't see the outcome, they create
+        create_vpc_network.assert_not_called()
+        self.assertEqual(apply_async.call_count, 5)
+        for call in apply_async.call_args_list:
+            self.assertEqual(call.kwargs['kwargs']['cached_existing'], {})
+
+    def test_ensure_exists_batch__bulk_request_failed_partway(self):
+        networks = [
+            self._create_network(f'network-{i}', state='declared')
+            for i in range(5)
+        ]
+        self.cli.add_network(self.project.slug, 'network-0')
+        for network in networks:
+            TransitionModel.create_transition(network, 'ensure_exists')
+
+        def run_batch(calls, on_result=None):
+            # e.g. a provider's batch API, it fails after two creations
+            for i, call in enumerate(calls[:2]):
+                on_result(i, call())
+            raise ConnectionError('batch request failed')
+
+        with mock.patch.object(Signature, 'apply_async') as apply_async, \
+                mock.patch.object(CheckpointStore, 'is_shared', True), \
+                mock.patch.object(GcpProvider, 'run_batch', run_batch):
+            ensure_exists_batch.apply(kwargs={
+                'project_pk': self.project.pk, 'rtype': NETWORK_RTYPE
+            })
+
+        self.assertEqual(len(self.store['networks']), 3)
+        # the list response is still sent along
+        self.assertEqual(apply_async.call_count, 5)
+        for call in apply_async.call_args_list:
+            self.assertIn('cached_existing', call.kwargs['kwargs'])
+
+        # only the two without a checkpoint make the creation request
+        create_vpc_network = self.cli.create_vpc_network
+        with mock.patch.object(
+            self.cli, 'create_vpc_network', wraps=create_vpc_network
+        ) as create_vpc_network:
+            for call in apply_async.call_args_list:
+                TASKS_BY_TRANSITION_TYPE['ensure_exists'].apply(
+                    kwargs=call.kwargs['kwargs']
+                )
+        self.assertEqual(create_vpc_network.call_count, 2)
+        transitions = TransitionModel.objects.filter(type='ensure_exists')
+        self.assertEqual({t.status for t in transitions}, {'succeeded'})
+        self.assertEqual(len(self.store['networks']), 5)
+
+
+class SubmitTransitionTasksTests(TransitionTaskTestCase):
+
+    def test_submit_transition_tasks__batched(self):
+        for i in range(BATCH_MIN_SIZE):
+            network = self._create_network(f'network-{i}', state='declared')
+            TransitionModel.create_transition(network, 'ensure_exists')
+
+        with mock.patch.object(
+                    Signature, 'apply_async', autospec=True
+                ) as apply_async, \
+                mock.patch.object(self.cli, 'list_networks') as list_networks:
+            submit_transition_tasks.apply()
+
+        # the batch task lists and claims them
+        self.assertEqual(apply_async.call_count, 1)
+        signature = apply_async.call_args.args[0]
+        self.assertEqual(signature.task, ensure_exists_batch.name)
+        self.assertEqual(
+            signature.kwargs,
+            {'project_pk': self.project.pk, 'rtype': NETWORK_RTYPE}
+        )
+        list_networks.assert_not_called()
+        self.assertEqual(
+            TransitionModel.objects.filter(status='pending').count(),
+            BATCH_MIN_SIZE
+        )
+
+    def test_submit_transition_tasks__slow_list(self):
+        for i in range(10):
+            network = self._create_network(f'network-{i}', state='declared')
+            TransitionModel.create_transition(network, 'ensure_exists')
+
+        def slow_list(*args, **kwargs):
+            # blocks, as a request would where gevent isn't patched in
+            threading.Event().wait(1)
+
+        with mock.patch.object(Signature, 'apply_async') as apply_async, \
+                mock.patch(
+                    'transitions.tasks.daemon_tasks.PRELIST_TIMEOUT', 0.05
+                ), \
+                mock.patch.object(self.cli, 'list_networks', side_effect=slow_list):
+            submit_transition_tasks.apply()
+            # an overlapping run finds them claimed
+            submit_transition_tasks.apply()
+
+        # sent without the list response, the tasks list for themselves
+        self.assertEqual(apply_async.call_count, 10)
+        for call in apply_async.call_args_list:
+            self.assertNotIn('cached_existing', call.kwargs['kwargs'])
+
+    def test_submit_transition_tasks__shared_payload(self):
+        for i in range(10):
+            network = self._create_network(f'network-{i}', state='declared')
+            self.cli.add_network(self.project.slug, f'network-{i}')
+            TransitionModel.create_transition(network, 'ensure_exists')
+        redis = fakeredis.FakeRedis()
+
+        with mock.patch.object(Signature, 'apply_async') as apply_async, \
+                mock.patch(
+                    'transitions.celery_utils.payloads.get_redis_client',
+                    return_value=redis
+                ), \
+                mock.patch.object(redis, 'set', wraps=redis.set) as redis_set:
+            submit_transition_tasks.apply()
+
+            # the group's list response is stored once, every task refers to it
+            self.assertEqual(redis_set.call_count, 1)
+            cached = [
+                call.kwargs['kwargs']['cached_existing']
+                for call in apply_async.call_args_list
+            ]
+            self.assertEqual(len(cached), 10)
+            self.assertTrue(is_reference(cached[0]))
+            self.assertEqual(cached.count(cached[0]), 10)
+            existing = resolve_kwargs({'cached_existing': cached[0]})
+        self.assertEqual(
+            set(existing['cached_existing']),
+            {_network_link(self.project.slug, f'network-{i}') for i in range(10)}
+        )
+
+
+class ReconcileFailedTransitionsTests(TransitionTaskTestCase):
+
+    def test_reconcile_failed_transitions__abandoned_attempt(self):
+        network = self._create_network('test-network', state='declared')
+        transition = self._create_sent_transition(network, 'ensure_exists')
+        transition.log_event('started')
+        transition.record_attempt('lost-task-id', 0)
+        TransitionModel.objects.filter(pk=transition.pk).update(
+            last_attempt_at=timezone.now() - datetime.timedelta(hours=3)
+        )
+
+        # slim mode has no TaskResults, the attempt's outcome is never recorded
+        with mock.patch('transitions.tasks.daemon_tasks.SLIM_TRACKING', True):
+            reconcile_failed_transitions.apply()
+
+        transition.refresh_from_db()
+        self.assertEqual(transition.status, 'failed')
+
+
+class TransitionLeaseTests(TransitionTaskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.redis = fakeredis.FakeRedis()
+        patchers = [
+            mock.patch(
+                'transitions.celery_utils.leases.get_redis_client',
+                return_value=self.redis
+            ),
+            mock.patch.object(TransitionLease, '_start_heartbeat'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _create_started_transition(self, resource_model, task_id):
+        # as left by an attempt that set 'in_progress' and was then lost
+        transition = self._create_sent_transition(resource_model, 'ensure_exists')
+        task_result = TaskResult.objects.create(
+            task_id=task_id,
+            task_name=TASKS_BY_TRANSITION_TYPE['ensure_exists'].name
+        )
+        transition.celery_tasks.add(task_result)
+        transition.record_attempt(task_id, 0)
+        transition.log_event('started')
+        return transition
+
+    def _apply(self, transition, task_id):
+        TASKS_BY_TRANSITION_TYPE[transition.type].apply(
+            kwargs={'transition_pk': transition.pk}, task_id=task_id
+        )
+        transition.refresh_from_db()
+        return transition
+
+    def test_duplicate_delivery_rejected(self):
+        network = self._create_network('test-network', state='declared')
+        transition = self._create_started_transition(network, 'task-a')
+        TransitionLease(transition.pk, 'task-a', 0).acquire()
+
+        with mock.patch.object(
+            self.cli, 'create_vpc_network'
+        ) as create_vpc_network:
+            transition = self._apply(transition, 'task-b')
+
+        create_vpc_network.assert_not_called()
+        self.assertEqual(transition.status, 'in_progress')
+        event = TransitionEventModel.objects.get(
+            transition=transition, type='duplicate_task_rejected'
+        )
+        self.assertEqual(event.extra_info, {'lease_holder': 'task-a'})
+
+    def test_redelivery_after_lease_lapsed(self):
+        network = self._create_network('test-network', state='declared')
+        transition = self._create_started_transition(network, 'task-a')
+        lease = TransitionLease(transition.pk, 'task-a', 0)
+        lease.acquire()
+        self.redis.delete(lease.key)  # its worker was lost, the lease lapsed
+
+        transition = self._apply(transition, 'task-a')
+
+        self.assertEqual(transition.status, 'succeeded')
+        self.assertIn('test-network', self.store['networks'])
+
+    def test_other_task_rejected_after_lease_lapsed(self):
+        network = self._create_network('test-network', state='declared')
+        transition = self._create_started_transition(network, 'task-a')
+
+        transition = self._apply(transition, 'task-b')
+
+        self.assertEqual(transition.status, 'in_progress')
+        self.assertNotIn('test-network', self.store['networks'])
+        self.assertIsNone(self.redis.get(f'lease:transition:{transition.pk}'))
+
+    def test_hand_over_to_next_attempt(self):
+        lease = TransitionLease('abc', 'task-a', 0)
+        self.assertEqual(lease.acquire(), (True, None))
+
+        lease.hand_over(30)
+
+        self.assertFalse(lease.is_held)
+        self.assertGreater(self.redis.pttl(lease.key), LEASE_TTL_MS)
+        # reserved for the retry, other tasks and attempts are rejected
+        self.assertEqual(
+            TransitionLease('abc', 'task-b', 0).acquire(), (False, 'task-a')
+        )
+        self.assertEqual(
+            TransitionLease('abc', 'task-a', 2).acquire(), (False, 'task-a')
+        )
+        retry_lease = TransitionLease('abc', 'task-a', 1)
+        self.assertEqual(retry_lease.acquire(), (True, None))
+        self.assertTrue(retry_lease.is_held)
+        self.assertEqual(self.redis.get(lease.key).decode(), retry_lease.token)
+        self.assertLessEqual(self.redis.pttl(lease.key), LEASE_TTL_MS)
+
+    def test_retried_task_keeps_lease(self):
+        network = self._create_network('test-network', state='declared')
+        transition = self._create_sent_transition(network, 'ensure_exists')
+        create_vpc_network = self.cli.create_vpc_network
+        tokens = []
+
+        def flaky_create(gcp_project_id, name, **kwargs):
+            tokens.append(self.redis.get(f'lease:transition:{transition.pk}'))
+            if len(tokens) == 1:
+                raise TaskRetryException('flaky')
+            return create_vpc_network(gcp_project_id, name, **kwargs)
+
+        with mock.patch.object(self.cli, 'create_vpc_network', flaky_create):
+            transition = self._apply(transition, 'task-a')
+
+        self.assertEqual(transition.status, 'succeeded')
+        self.assertFalse(
+            TransitionEventModel.objects.filter(
+                transition=transition, type='duplicate_task_rejected'
+            ).exists()
+        )
+        # each attempt held the lease under its own retry_index
+        self.assertEqual(
+            [token.decode().split('|')[:2] for token in tokens],
+            [['task-a', '0'], ['task-a', '1']]
+        )
+
+    def test_task_postrun_releases_lease(self):
+        network = self._create_network('test-network', state='declared')
+        transition = self._create_sent_transition(network, 'ensure_exists')
+        key = f'lease:transition:{transition.pk}'
+        create_vpc_network = self.cli.create_vpc_network
+        holders = []
+
+        def create(gcp_project_id, name, **kwargs):
+            holders.append(self.redis.get(key))
+            return create_vpc_network(gcp_project_id, name, **kwargs)
+
+        with mock.patch.object(self.cli, 'create_vpc_network', create):
+            transition = self._apply(transition, 'task-a')
+
+        self.assertEqual(transition.status, 'succeeded')
+        self.assertTrue(holders[0].decode().startswith('task-a|0|'))
+        self.assertIsNone(self.redis.get(key))
+
+    def test_potential_duplicate_without_redis(self):
+        network = self._create_network('test-network', state='declared')
+        transition = self._create_started_transition(network, 'task-a')
+
+        with mock.patch(
+                    'transitions.celery_utils.leases.get_redis_client',
+                    return_value=None
+                ), \
+                mock.patch.object(
+                    Task, 'retry', autospec=True, return_value=Retry()
+                ) as retry:
+            transition = self._apply(transition, 'task-b')
+
+        # without a lease it can't tell, the retry runs after any duplicate
+        self.assertEqual(retry.call_args.kwargs['countdown'], 90)
+        self.assertTrue(retry.call_args.kwargs['kwargs']['is_duplicate'])
+        self.assertTrue(
+            TransitionEventModel.objects.filter(
+                transition=transition, type='potential_duplicate_task'
+            ).exists()
+        )
+        self.assertNotIn('test-network', self.store['networks'])
+
+
+class ParkedRetryTests(TransitionTaskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch(
+            'transitions.celery_utils.parking.get_redis_client',
+            return_value=self.redis
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _park(self, task_id, countdown=0):
+        sig = ensure_exists_batch.signature(
+            kwargs={'project_pk': str(self.project.pk), 'rtype': NETWORK_RTYPE},
+            task_id=task_id
+        )
+        self.assertTrue(park_signature(sig, countdown))
+        return sig
+
+    def _make_due(self, task_id):
+        self.redis.zadd(PARKED_KEY, {task_id: 0})
+
+    def _pump(self):
+        with mock.patch.object(
+            Signature, 'apply_async', autospec=True
+        ) as apply_async:
+            pump_parked_transitions.apply()
+        return [call.args[0] for call in apply_async.call_args_list]
+
+    def test_parked_retry_sent_once(self):
+        sig = self._park('task-a', countdown=60)
+        self.assertEqual(self._pump(), [])  # not yet due
+
+        self._make_due('task-a')
+        sent = self._pump()
+        self.assertEqual(self._pump(), [])
+
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(sent[0].options['task_id'], 'task-a')
+        self.assertEqual(sent[0].kwargs, sig.kwargs)
+        self.assertEqual(self.redis.zcard(PARKED_KEY), 0)
+        self.assertEqual(self.redis.hlen(SIGNATURES_KEY), 0)
+
+    def test_claimed_but_unsent_retry_reclaimed(self):
+        self._park('task-a')
+        # a pump claimed it, then died before sending it
+        self.redis.eval(
+            CLAIM_SCRIPT, 2, PARKED_KEY, SIGNATURES_KEY, time.time(), 10,
+            CLAIM_TIMEOUT
+        )
+        self.assertEqual(self._pump(), [])
+
+        # the claim timed out
+        self._make_due('task-a')
+        sent = self._pump()
+        self.assertEqual([sig.options['task_id'] for sig in sent], ['task-a'])
+        self.assertEqual(self._pump(), [])
+
+    def test_failed_send_reparked(self):
+        self._park('task-a')
+        with mock.patch.object(
+            Signature, 'apply_async', side_effect=ConnectionError()
+        ):
+            pump_parked_transitions.apply()
+
+        self.assertEqual(self.redis.hlen(SIGNATURES_KEY), 1)
+        self.assertGreater(self.redis.zscore(PARKED_KEY, 'task-a'), time.time())
+
+    def test_retry_parked_and_restored(self):
+        network = self._create_network('test-network', state='exists')
+        network_di = self.cli.add_network(self.project.slug, 'test-network')
+        network_di['subnetworks'] = []  # the health check fails, it retries
+        network.extra_data['self_id'] = network_di['id']
+        network.save()
+        transition = self._create_sent_transition(network, 'ensure_healthy')
+        task = TASKS_BY_TRANSITION_TYPE['ensure_healthy']
+
+        with mock.patch(
+            'transitions.celery_utils.task_class.PARKING_THRESHOLD', 1
+        ), mock.patch.object(
+            TransitionTask, 'is_fast_path', new_callable=mock.PropertyMock,
+            return_value=True
+        ):
+            result = task.apply(
+                kwargs={'transition_pk': transition.pk}, task_id='task-a'
+            )
+
+        self.assertEqual(result.state, 'IGNORED')
+        transition.refresh_from_db()
+        self.assertEqual(transition.status, 'in_progress')
+        self.assertEqual(self.redis.zrange(PARKED_KEY, 0, -1), [b'task-a'])
+
+        self._make_due('task-a')
+        sent = self._pump()
+
+        # the same task's next attempt, as celery's retry() would send it
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(sent[0].task, task.name)
+        self.assertEqual(sent[0].options['task_id'], 'task-a')
+        self.assertEqual(sent[0].options['retries'], 1)
+        self.assertEqual(sent[0].kwargs['transition_pk'], transition.pk)
+        self.assertIn('previous_retry_event', sent[0].kwargs)
+        self.assertNotIn('is_eager', sent[0].options)
+
+
+class FailureHandlingTests(TransitionTaskTestCase):
+
+    def test_failure_with_state_update_conflict(self):
+        network = self._create_network('test-network', state='declared')
+        transition = self._create_sent_transition(network, 'ensure_exists')
+        conflict = StateUpdateConflict(
+            'creating -> creation_failed, state is now exists'
+        )
+
+        with mock.patch.object(
+                    self.cli, 'create_vpc_network',
+                    side_effect=TaskFailureException('creation_failed')
+                ), \
+                mock.patch.object(
+                    ResourceModel, '_compare_and_swap_state',
+                    side_effect=conflict
+                ):
+            transition = self._apply_transition(transition)
+
+        # a concurrent writer moved the state, the Transition still fails
+        self.assertEqual(transition.status, 'failed')
+        self.assertTrue(
+            ResourceEventModel.objects.filter(
+                resource=network, type='terminal_failure'
+            ).exists()
+        )
+
+
+class SlimTrackingTests(TransitionTaskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patchers = [
+            mock.patch(f'{module}.SLIM_TRACKING', True) for module in (
+                'transitions.celery_utils.task_class',
+                'transitions.celery_utils.context',
+                'transitions.models'
+            )
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(
+            TransitionTaskContext, 'fetch_task_result_object'
+        )
+        self.fetch_task_result_object = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _apply(self, transition, task_id, **kwargs):
+        TASKS_BY_TRANSITION_TYPE[transition.type].apply(
+            kwargs={'transition_pk': transition.pk}, task_id=task_id, **kwargs
+        )
+        transition.refresh_from_db()
+        return transition
+
+    def _assert_no_task_results(self, transition):
+        self.fetch_task_result_object.assert_not_called()
+        self.assertFalse(transition.celery_tasks.exists())
+
+    def test_attempt_recorded_on_start(self):
+        network = self._create_network('test-network', state='declared')
+        transition = self._create_sent_transition(network, 'ensure_exists')
+        create_vpc_network = self.cli.create_vpc_network
+        during_attempt = []
+
+        def create(gcp_project_id, name, **kwargs):
+            during_attempt.append(TransitionModel.objects.get(pk=transition.pk))
+            return create_vpc_network(gcp_project_id, name, **kwargs)
+
+        with mock.patch.object(self.cli, 'create_vpc_network', create):
+            transition = self._apply(transition, 'task-a')
+
+        [started] = during_attempt
+        self.assertEqual(started.task_id, 'task-a')
+        self.assertEqual(started.attempt_count, 1)
+        self.assertEqual(started.last_outcome, 'started')
+        self.assertIsNotNone(started.attempt_started_at)
+        self.assertEqual(started.last_attempt_at, started.attempt_started_at)
+
+        self.assertEqual(transition.status, 'succeeded')
+        self.assertEqual(transition.last_outcome, 'succeeded')
+        self.assertEqual(transition.attempt_count, 1)
+        self._assert_no_task_results(transition)
+
+    def test_attempt_recorded_on_retry(self):
+        network = self._create_network('test-network', state='declared')
+        transition = self._create_sent_transition(network, 'ensure_exists')
+
+        with mock.patch.object(
+                    self.cli, 'create_vpc_network',
+                    side_effect=TaskRetryException('creation_request_failed')
+                ), \
+                mock.patch.object(
+                    Task, 'retry', autospec=True, return_value=Retry()
+                ):
+            transition = self._apply(transition, 'task-a')
+
+        self.assertEqual(transition.status, 'in_progress')
+        self.assertEqual(transition.last_outcome, 'retrying')
+        self.assertEqual(transition.attempt_count, 1)
+        first_started_at = transition.attempt_started_at
+
+        # the retry is the same task, the attempt keeps its start time
+        transition = self._apply(transition, 'task-a', retries=1)
+
+        self.assertEqual(transition.status, 'succeeded')
+        self.assertEqual(transition.last_outcome, 'succeeded')
+        self.assertEqual(transition.task_id, 'task-a')
+        self.assertEqual(transition.attempt_count, 2)
+        self.assertEqual(transition.attempt_started_at, first_started_at)
+        self.assertGreater(transition.last_attempt_at, first_started_at)
+        self._assert_no_task_results(transition)
+
+    def test_attempt_recorded_on_failure(self):
+        network = self._create_network('test-network', state='declared')
+        transition = self._create_sent_transition(network, 'ensure_exists')
+
+        with mock.patch.object(
+            self.cli, 'create_vpc_network',
+            side_effect=TaskFailureException('creation_failed')
+        ):
+            transition = self._apply(transition, 'task-a')
+
+        self.assertEqual(transition.status, 'failed')
+        self.assertEqual(transition.last_outcome, 'failed')
+        self.assertEqual(transition.task_id, 'task-a')
+        self.assertEqual(transition.attempt_count, 1)
+        self._assert_no_task_results(transition)
+
+
+@override_settings(REDIS_URL=None)
+class TaskPayloadTests(SimpleTestCase):
+
+    def test_payloads_without_redis(self):
+        large = {'items': ['x' * 100] * (INLINE_LIMIT // 100)}
+        oversized = {'items': ['x' * 100] * (MAX_SIZE // 100)}
+        kwargs = {'transition_pk': 'abc', 'cached_existing': large}
+
+        # sent inline when it can't be stored, oversized payloads are dropped
+        self.assertEqual(externalize_kwargs(kwargs), kwargs)
+        self.assertIsNone(
+            externalize_kwargs({'cached_existing': oversized})['cached_existing']
+        )
+        self.assertEqual(resolve_kwargs(dict(kwargs)), kwargs)
+
+
+class TaskSerializerTests(SimpleTestCase):
+
+    def test_msgpack_compressed_round_trip(self):
+        small = [[], {'transition_pk': 1}, {}]
+        large = [[], {'transition_pk': 1, 'cached_existing': {'x': 'y' * 5000}}, {}]
+        for body in (small, large):
+            content_type, encoding, data = dumps(body, serializer=MSGPACK_COMPRESSED)
+            self.assertEqual(
+                loads(data, content_type, encoding, accept=[content_type]), body
+            )
+        self.assertLess(len(data), 5000)  # the large one was compressed
+
+
+class WorkerBootstepTests(SimpleTestCase):
+
+    def _create_worker(self):
+        # constructing the worker runs the bootsteps' __init__, it isn't
+        # started so no broker is needed
+        return app.WorkController(
+            app=app, pool_cls=CELERY_POOL_TYPE, concurrency=1,
+            hostname='test@localhost'
+        )
+
+    def test_warm_up(self):
+        with mock.patch(
+            'resources.warm_up_resource_classes',
+            wraps=warm_up_resource_classes
+        ) as warm_up, mock.patch('make_it_so.celery.logger') as logger:
+            worker = self._create_worker()
+
+        warm_up.assert_called_once_with()
+        self.assertIn('make_it_so.celery.WarmUpWorker', worker.blueprint.steps)
+        message, kwargs = logger.info.call_args[0][0], logger.info.call_args[1]
+        self.assertEqual(message, 'worker warm-up finished')
+        self.assertEqual(
+            set(kwargs), {'duration', 'resource_classes', 'schemas', 'providers'}
+        )
+
+    def test_failed_warm_up_doesnt_stop_the_worker(self):
+        with mock.patch(
+            'resources.warm_up_resource_classes',
+            side_effect=ImportError('provider library missing')
+        ), mock.patch('make_it_so.celery.logger') as logger:
+            worker = self._create_worker()
+
+        logger.warning.assert_called_once_with(
+            'worker warm-up failed', exception='provider library missing'
+        )
+        # the steps after it were still applied
+        self.assertEqual(worker.app.pool_type, CELERY_POOL_TYPE)
+        self.assertIsNotNone(worker.pool)
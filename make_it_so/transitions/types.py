@@ -22,3 +22,9 @@ class TransitionStatusEnum(BaseStrEnum):
     failed = 'failed'
 
 
+class AttemptOutcomeEnum(BaseStrEnum):
+    # outcome of a Transition's latest task attempt, only tracked in slim mode
+    started = 'started'
+    retrying = 'retrying'
+    succeeded = 'succeeded'
+    failed = 'failed'